@@ -3,6 +3,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from app.core.config import settings
+from app.core.database import db_executor
 from app.models.user import User
 from app.services.user_service import user_service
 
@@ -24,7 +25,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    user = user_service.get_user_by_username(username=username)
+    user = await db_executor.run(user_service.get_user_by_username, username=username)
     if user is None:
         raise credentials_exception
     
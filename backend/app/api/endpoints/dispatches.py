@@ -1,15 +1,17 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
 from typing import List, Optional
 from datetime import datetime
 from app.schemas.dispatch import DispatchResponse, DispatchFilters
 from app.services.dispatch_service import dispatch_service
 from app.api.deps import get_current_user
+from app.core.keyset import InvalidCursorError
 from app.models.user import User
 
 router = APIRouter()
 
 @router.get("/", response_model=List[DispatchResponse])
 async def get_dispatches(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     fecha_desde: Optional[datetime] = None,
@@ -17,9 +19,10 @@ async def get_dispatches(
     codigo_cliente: Optional[str] = None,
     tipo_despacho: Optional[int] = None,
     sync_status: Optional[str] = None,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Obtener lista de despachos con filtros opcionales"""
+    """Obtener lista de despachos con filtros opcionales (cursor de la página siguiente en X-Next-Cursor)"""
     filters = DispatchFilters(
         fecha_desde=fecha_desde,
         fecha_hasta=fecha_hasta,
@@ -27,7 +30,13 @@ async def get_dispatches(
         tipo_despacho=tipo_despacho,
         sync_status=sync_status
     )
-    return dispatch_service.get_dispatches(filters, skip, limit)
+    try:
+        dispatches, next_cursor = dispatch_service.get_dispatches_page(filters, limit, page_cursor=cursor, skip=skip)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return dispatches
 
 @router.get("/count")
 async def count_dispatches(
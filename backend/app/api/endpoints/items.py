@@ -2,12 +2,14 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
 from datetime import date
 
-from app.core.database import FirebirdConnection
+from app.core.database import db_executor
+from app.core.keyset import InvalidCursorError, KeysetOrder
 from app.api.deps import get_current_user
 from app.models.user import User
 
 router = APIRouter()
-db = FirebirdConnection()
+
+ITEMS_ORDER = KeysetOrder('DESCRIPCION_PRODUCTO', descending=False)
 
 @router.get("/")
 async def get_items(
@@ -15,74 +17,91 @@ async def get_items(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = Query(None),
-    codigo_familia: Optional[int] = Query(None)
+    codigo_familia: Optional[int] = Query(None),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    include_total: bool = Query(False)
 ):
-    """Obtiene items/productos con filtros y paginación"""
-    try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Construir condiciones WHERE
-            where_conditions = []
-            params = []
-            
-            if search:
-                where_conditions.append("(UPPER(DESCRIPCION_PRODUCTO) LIKE ? OR UPPER(CODIGO_PRODUCTO) LIKE ?)")
-                search_param = f"%{search.upper()}%"
-                params.extend([search_param, search_param])
-            
-            if codigo_familia:
-                where_conditions.append("CODIGO_FAMILIA = ?")
-                params.append(codigo_familia)
-            
-            where_clause = ""
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-            
-            # Contar total
+    """Obtiene items/productos con filtros y paginación (por cursor o por skip)"""
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        # Construir condiciones WHERE
+        where_conditions = []
+        params = []
+        
+        if search:
+            where_conditions.append("(UPPER(DESCRIPCION_PRODUCTO) LIKE ? OR UPPER(CODIGO_PRODUCTO) LIKE ?)")
+            search_param = f"%{search.upper()}%"
+            params.extend([search_param, search_param])
+        
+        if codigo_familia:
+            where_conditions.append("CODIGO_FAMILIA = ?")
+            params.append(codigo_familia)
+        
+        where_clause = ""
+        if where_conditions:
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Total solo a pedido: COUNT(*) recorre todas las filas del filtro
+        total = None
+        if include_total:
             count_sql = f"SELECT COUNT(*) FROM STL_ITEMS {where_clause}"
             cursor.execute(count_sql, params)
             total = cursor.fetchone()[0]
+        
+        # Página siguiente al cursor (keyset) en lugar de descartar filas con ROWS m TO n
+        if page_cursor:
+            condition, cursor_params = ITEMS_ORDER.after(page_cursor)
+            where_conditions.append(condition)
+            params.extend(cursor_params)
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Obtener datos paginados
+        rows_clause, rows_params = ITEMS_ORDER.rows(limit, 0 if page_cursor else skip)
+        sql = f"""
+        SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
+               CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
+               DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
+               CREATED_AT, LAST_SYNC_AT
+        FROM STL_ITEMS {where_clause}
+        {ITEMS_ORDER.order_by()}
+        {rows_clause}
+        """
+        
+        fetched = conn.execute_cached(sql, params + rows_params).fetchall()
+        rows, next_cursor = ITEMS_ORDER.page(fetched, limit, sort_index=2)
+        
+        items = []
+        for row in rows:
+            items.append({
+                "id": row[0],
+                "codigo_producto": row[1],
+                "descripcion_producto": row[2],
+                "codigo_producto_erp": row[3],
+                "codigo_familia": row[4],
+                "nombre_familia": row[5],
+                "dias_vencimiento": row[6],
+                "codigo_umb": row[7],
+                "descripcion_umb": row[8],
+                "codigo_forma_embalaje": row[9],
+                "nombre_forma_embalaje": row[10],
+                "created_at": row[11].isoformat() if row[11] else None,
+                "last_sync_at": row[12].isoformat() if row[12] else None
+            })
+        
+        return {
+            "items": items,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "next_cursor": next_cursor
+        }
+    
+    try:
+        return await db_executor.run_with_connection(run_in_db)
             
-            # Obtener datos paginados
-            sql = f"""
-            SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
-                   CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
-                   DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
-                   CREATED_AT, LAST_SYNC_AT
-            FROM STL_ITEMS {where_clause}
-            ORDER BY DESCRIPCION_PRODUCTO
-            ROWS {skip + 1} TO {skip + limit}
-            """
-            
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
-            
-            items = []
-            for row in rows:
-                items.append({
-                    "id": row[0],
-                    "codigo_producto": row[1],
-                    "descripcion_producto": row[2],
-                    "codigo_producto_erp": row[3],
-                    "codigo_familia": row[4],
-                    "nombre_familia": row[5],
-                    "dias_vencimiento": row[6],
-                    "codigo_umb": row[7],
-                    "descripcion_umb": row[8],
-                    "codigo_forma_embalaje": row[9],
-                    "nombre_forma_embalaje": row[10],
-                    "created_at": row[11].isoformat() if row[11] else None,
-                    "last_sync_at": row[12].isoformat() if row[12] else None
-                })
-            
-            return {
-                "items": items,
-                "total": total,
-                "skip": skip,
-                "limit": limit
-            }
-            
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo items: {str(e)}")
 
@@ -93,31 +112,33 @@ async def get_items_count(
     codigo_familia: Optional[int] = Query(None)
 ):
     """Obtiene el conteo total de items"""
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        where_conditions = []
+        params = []
+        
+        if search:
+            where_conditions.append("(UPPER(DESCRIPCION_PRODUCTO) LIKE ? OR UPPER(CODIGO_PRODUCTO) LIKE ?)")
+            search_param = f"%{search.upper()}%"
+            params.extend([search_param, search_param])
+        
+        if codigo_familia:
+            where_conditions.append("CODIGO_FAMILIA = ?")
+            params.append(codigo_familia)
+        
+        where_clause = ""
+        if where_conditions:
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        query = f"SELECT COUNT(*) FROM STL_ITEMS {where_clause}"
+        cursor.execute(query, params)
+        total = cursor.fetchone()[0]
+        
+        return {"total": total}
+    
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            where_conditions = []
-            params = []
-            
-            if search:
-                where_conditions.append("(UPPER(DESCRIPCION_PRODUCTO) LIKE ? OR UPPER(CODIGO_PRODUCTO) LIKE ?)")
-                search_param = f"%{search.upper()}%"
-                params.extend([search_param, search_param])
-            
-            if codigo_familia:
-                where_conditions.append("CODIGO_FAMILIA = ?")
-                params.append(codigo_familia)
-            
-            where_clause = ""
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-            
-            query = f"SELECT COUNT(*) FROM STL_ITEMS {where_clause}"
-            cursor.execute(query, params)
-            total = cursor.fetchone()[0]
-            
-            return {"total": total}
+        return await db_executor.run_with_connection(run_in_db)
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo conteo: {str(e)}")
@@ -128,40 +149,42 @@ async def get_item_by_code(
     current_user: User = Depends(get_current_user)
 ):
     """Obtiene un item específico por código"""
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        sql = """
+        SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
+               CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
+               DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
+               CREATED_AT, LAST_SYNC_AT
+        FROM STL_ITEMS 
+        WHERE CODIGO_PRODUCTO = ?
+        """
+        
+        cursor.execute(sql, (item_code,))
+        row = cursor.fetchone()
+        
+        if not row:
+            raise HTTPException(status_code=404, detail=f"Item {item_code} no encontrado")
+        
+        return {
+            "id": row[0],
+            "codigo_producto": row[1],
+            "descripcion_producto": row[2],
+            "codigo_producto_erp": row[3],
+            "codigo_familia": row[4],
+            "nombre_familia": row[5],
+            "dias_vencimiento": row[6],
+            "codigo_umb": row[7],
+            "descripcion_umb": row[8],
+            "codigo_forma_embalaje": row[9],
+            "nombre_forma_embalaje": row[10],
+            "created_at": row[11].isoformat() if row[11] else None,
+            "last_sync_at": row[12].isoformat() if row[12] else None
+        }
+    
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            sql = """
-            SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
-                   CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
-                   DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
-                   CREATED_AT, LAST_SYNC_AT
-            FROM STL_ITEMS 
-            WHERE CODIGO_PRODUCTO = ?
-            """
-            
-            cursor.execute(sql, (item_code,))
-            row = cursor.fetchone()
-            
-            if not row:
-                raise HTTPException(status_code=404, detail=f"Item {item_code} no encontrado")
-            
-            return {
-                "id": row[0],
-                "codigo_producto": row[1],
-                "descripcion_producto": row[2],
-                "codigo_producto_erp": row[3],
-                "codigo_familia": row[4],
-                "nombre_familia": row[5],
-                "dias_vencimiento": row[6],
-                "codigo_umb": row[7],
-                "descripcion_umb": row[8],
-                "codigo_forma_embalaje": row[9],
-                "nombre_forma_embalaje": row[10],
-                "created_at": row[11].isoformat() if row[11] else None,
-                "last_sync_at": row[12].isoformat() if row[12] else None
-            }
+        return await db_executor.run_with_connection(run_in_db)
             
     except HTTPException:
         raise
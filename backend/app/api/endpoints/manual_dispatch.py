@@ -8,6 +8,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer
 
 from app.api.deps import get_current_active_user
+from app.core.database import db_executor
 from app.models.user import User
 from app.models.manual_dispatch_models import DispatchManual, DispatchSyncResponse
 from app.services.manual_dispatch_service import manual_dispatch_service
@@ -88,45 +89,44 @@ async def check_dispatch_exists(
     
     Útil para verificar antes de sincronizar.
     """
-    try:
-        from app.core.database import FirebirdConnection
-        db = FirebirdConnection()
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ID, NUMERO_BUSQUEDA, CODIGO_CLIENTE, NOMBRE_CLIENTE, 
+                   FECHA_CREACION, SYNC_STATUS, LAST_SYNC_AT
+            FROM STL_DISPATCHES 
+            WHERE NUMERO_BUSQUEDA = ? AND TIPO_DESPACHO = ? AND NUMERO_DESPACHO = ?
+        """, (numero_busqueda, tipo_despacho, numero_despacho))
         
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT ID, NUMERO_BUSQUEDA, CODIGO_CLIENTE, NOMBRE_CLIENTE, 
-                       FECHA_CREACION, SYNC_STATUS, LAST_SYNC_AT
-                FROM STL_DISPATCHES 
-                WHERE NUMERO_BUSQUEDA = ? AND TIPO_DESPACHO = ? AND NUMERO_DESPACHO = ?
-            """, (numero_busqueda, tipo_despacho, numero_despacho))
-            
-            row = cursor.fetchone()
-            
-            if not row:
-                return {
-                    "exists": False,
-                    "message": f"Despacho {numero_despacho} tipo {tipo_despacho} no existe"
-                }
-            
-            # Contar líneas
-            cursor.execute("""
-                SELECT COUNT(*) FROM STL_DISPATCH_LINES WHERE DISPATCH_ID = ?
-            """, (row[0],))
-            
-            line_count = cursor.fetchone()[0]
-            
+        row = cursor.fetchone()
+        
+        if not row:
             return {
-                "exists": True,
-                "dispatch_id": row[0],
-                "numero_busqueda": row[1],
-                "codigo_cliente": row[2],
-                "nombre_cliente": row[3],
-                "fecha_creacion": row[4],
-                "sync_status": row[5],
-                "last_sync_at": row[6],
-                "lines_count": line_count
+                "exists": False,
+                "message": f"Despacho {numero_despacho} tipo {tipo_despacho} no existe"
             }
+        
+        # Contar líneas
+        cursor.execute("""
+            SELECT COUNT(*) FROM STL_DISPATCH_LINES WHERE DISPATCH_ID = ?
+        """, (row[0],))
+        
+        line_count = cursor.fetchone()[0]
+        
+        return {
+            "exists": True,
+            "dispatch_id": row[0],
+            "numero_busqueda": row[1],
+            "codigo_cliente": row[2],
+            "nombre_cliente": row[3],
+            "fecha_creacion": row[4],
+            "sync_status": row[5],
+            "last_sync_at": row[6],
+            "lines_count": line_count
+        }
+    
+    try:
+        return await db_executor.run_with_connection(run_in_db)
             
     except Exception as e:
         logger.error(f"Error verificando despacho: {str(e)}")
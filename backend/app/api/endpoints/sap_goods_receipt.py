@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from app.api.deps import get_current_user
+from app.core.database import db_executor
 from app.models.user import User
 from app.services.sap_goods_receipt_service import sap_goods_receipt_service
 import logging
@@ -84,4 +85,56 @@ async def get_pending_receipts(
         raise HTTPException(
             status_code=500,
             detail=f"Error obteniendo recepciones pendientes: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.get("/retry-ledger")
+async def get_retry_ledger(
+    status: Optional[str] = None,  # RETRY o DEAD
+    current_user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    Documentos con envíos fallidos: intentos, último error y próximo intento (backoff)
+    """
+    try:
+        entries = await db_executor.run(sap_goods_receipt_service.retries.entries, status)
+        return {
+            "success": True,
+            "total": len(entries),
+            "documentos": entries
+        }
+
+    except Exception as e:
+        logger.error(f"Error obteniendo ledger de reintentos: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error obteniendo ledger de reintentos: {str(e)}"
+        )
+
+@router.post("/retry-ledger/reset")
+async def reset_retry_ledger(
+    doc_ids: Optional[List[int]] = None,  # Sin IDs se reinician todos los DEAD
+    current_user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    Reinicia documentos del ledger de reintentos para que se vuelvan a enviar a SAP
+    """
+    if current_user.role not in ["ADMINISTRADOR"]:
+        raise HTTPException(
+            status_code=403,
+            detail="Solo administradores pueden ejecutar esta acción"
+        )
+
+    try:
+        removed = await db_executor.run(sap_goods_receipt_service.retries.reset, doc_ids)
+        logger.info(f"Usuario {current_user.username} reinició {removed} documentos del ledger de reintentos")
+        return {
+            "success": True,
+            "reiniciados": removed
+        }
+
+    except Exception as e:
+        logger.error(f"Error reiniciando ledger de reintentos: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error reiniciando ledger de reintentos: {str(e)}"
+        )
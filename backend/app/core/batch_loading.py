@@ -0,0 +1,49 @@
+"""
+Carga por lotes de filas hijas (líneas, detalles) para una página de cabeceras.
+
+Evita el patrón N+1 (una consulta de detalle por cabecera): se consultan todas las
+filas hijas con listas `IN (...)` por bloques y se agrupan en memoria por la columna
+padre. Una página cuesta así 1 + ceil(N / IN_CLAUSE_CHUNK_SIZE) consultas.
+
+Uso::
+
+    lines = load_children(cursor, '''
+        SELECT ID, DISPATCH_ID, CODIGO_PRODUCTO
+        FROM STL_DISPATCH_LINES
+        WHERE DISPATCH_ID IN ({placeholders})
+        ORDER BY DISPATCH_ID, LINE_NUM
+    ''', dispatch_ids, key_index=1)
+    for dispatch_id in dispatch_ids:
+        rows = lines.get(dispatch_id, [])
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Firebird admite hasta 1500 valores en un IN (...); se usa un margen seguro
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+def chunked(values: List, size: int):
+    """Divide una lista en bloques de tamaño `size`"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def load_children(cursor, query: str, parent_ids: Iterable[Any], key_index: int = 0,
+                  params: Optional[List[Any]] = None,
+                  row_factory: Optional[Callable[[tuple], Any]] = None,
+                  chunk_size: int = IN_CLAUSE_CHUNK_SIZE) -> Dict[Any, List[Any]]:
+    """Ejecuta `query` por bloques de IDs padre y agrupa las filas por `row[key_index]`.
+
+    `query` debe contener `{placeholders}` dentro del IN; `params` son parámetros
+    adicionales que van antes de la lista de IDs. El orden de las filas de cada padre
+    es el del ORDER BY de la consulta (un padre nunca queda repartido entre bloques).
+    """
+    # Sin duplicados ni nulos, conservando el orden de la página
+    ids = list(dict.fromkeys(parent_id for parent_id in parent_ids if parent_id is not None))
+    grouped: Dict[Any, List[Any]] = {}
+    for chunk in chunked(ids, chunk_size):
+        sql = query.format(placeholders=', '.join('?' * len(chunk)))
+        cursor.execute(sql, list(params or []) + chunk)
+        for row in cursor.fetchall():
+            grouped.setdefault(row[key_index], []).append(row_factory(row) if row_factory else row)
+    return grouped
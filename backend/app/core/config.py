@@ -17,11 +17,84 @@ class Settings(BaseSettings):
     FIREBIRD_DATABASE: str = os.getenv("FIREBIRD_DATABASE", "C:\\App\\STL\\Datos\\DATOS_STL.FDB")
     FIREBIRD_USER: str = os.getenv("FIREBIRD_USER", "sysdba")
     FIREBIRD_PASSWORD: str = os.getenv("FIREBIRD_PASSWORD", "masterkey")
-    
+
+    # Pool de conexiones Firebird (compartido por todos los servicios)
+    FIREBIRD_POOL_MIN_SIZE: int = int(os.getenv("FIREBIRD_POOL_MIN_SIZE", "2"))
+    FIREBIRD_POOL_MAX_SIZE: int = int(os.getenv("FIREBIRD_POOL_MAX_SIZE", "10"))
+    FIREBIRD_POOL_TIMEOUT_SECONDS: float = float(os.getenv("FIREBIRD_POOL_TIMEOUT_SECONDS", "30"))
+    FIREBIRD_POOL_MAX_IDLE_SECONDS: float = float(os.getenv("FIREBIRD_POOL_MAX_IDLE_SECONDS", "300"))
+    FIREBIRD_POOL_PING_AFTER_SECONDS: float = float(os.getenv("FIREBIRD_POOL_PING_AFTER_SECONDS", "30"))
+    # Sentencias preparadas (cursor.prep) en caché LRU por conexión; 0 = deshabilitada
+    FIREBIRD_STATEMENT_CACHE_SIZE: int = int(os.getenv("FIREBIRD_STATEMENT_CACHE_SIZE", "64"))
+    # Hilos dedicados a las llamadas fdb (bloqueantes) fuera del event loop; no más que el pool
+    FIREBIRD_EXECUTOR_THREADS: int = int(os.getenv("FIREBIRD_EXECUTOR_THREADS", "10"))
+
     # SAP-STL API Configuration
     SAP_STL_URL: str = os.getenv("SAP_STL_URL", "https://contribute-pathology-price-spelling.trycloudflare.com")
     SAP_STL_USERNAME: str = os.getenv("SAP_STL_USERNAME", "STLUser")
     SAP_STL_PASSWORD: str = os.getenv("SAP_STL_PASSWORD", "7a6T9IVeUdf5bvRIv")
+    # Transporte HTTP: pool de conexiones keep-alive compartido y HTTP/2 opcional (paquete h2)
+    SAP_STL_MAX_CONNECTIONS: int = int(os.getenv("SAP_STL_MAX_CONNECTIONS", "20"))
+    SAP_STL_MAX_KEEPALIVE: int = int(os.getenv("SAP_STL_MAX_KEEPALIVE", "10"))
+    SAP_STL_KEEPALIVE_EXPIRY: float = float(os.getenv("SAP_STL_KEEPALIVE_EXPIRY", "30"))
+    SAP_STL_HTTP2: bool = os.getenv("SAP_STL_HTTP2", "false").lower() == "true"
+    # Renovar el token este margen (segundos) antes de su expiración
+    SAP_STL_TOKEN_REFRESH_MARGIN_SECONDS: int = int(os.getenv("SAP_STL_TOKEN_REFRESH_MARGIN_SECONDS", "120"))
+    # Concurrencia adaptativa (AIMD) hacia SAP-STL y latencia objetivo hasta los encabezados
+    SAP_STL_CONCURRENCY_INITIAL: int = int(os.getenv("SAP_STL_CONCURRENCY_INITIAL", "4"))
+    SAP_STL_CONCURRENCY_MIN: int = int(os.getenv("SAP_STL_CONCURRENCY_MIN", "1"))
+    SAP_STL_CONCURRENCY_MAX: int = int(os.getenv("SAP_STL_CONCURRENCY_MAX", "16"))
+    SAP_STL_LATENCY_TARGET_MS: int = int(os.getenv("SAP_STL_LATENCY_TARGET_MS", "10000"))
+    # Circuit breaker: fallos seguidos (5xx / timeout) para abrir y segundos antes de la prueba half-open
+    SAP_STL_BREAKER_FAILURES: int = int(os.getenv("SAP_STL_BREAKER_FAILURES", "5"))
+    SAP_STL_BREAKER_RESET_SECONDS: int = int(os.getenv("SAP_STL_BREAKER_RESET_SECONDS", "30"))
+    
+    # Sincronización: tamaño de lote para executemany en las escrituras masivas
+    SYNC_BATCH_SIZE: int = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+    # Descarga en streaming: los registros se aplican en bloques mientras llega la respuesta
+    SYNC_STREAMING_ENABLED: bool = os.getenv("SYNC_STREAMING_ENABLED", "true").lower() == "true"
+    SYNC_STREAM_CHUNK_SIZE: int = int(os.getenv("SYNC_STREAM_CHUNK_SIZE", "1000"))
+    # Registros por transacción (commit + checkpoint por bloque); 0 = una sola transacción por corrida
+    SYNC_COMMIT_CHUNK_SIZE: int = int(os.getenv("SYNC_COMMIT_CHUNK_SIZE", "1000"))
+    # Antigüedad máxima de un checkpoint para reanudar una corrida interrumpida
+    SYNC_CHECKPOINT_MAX_AGE_HOURS: int = int(os.getenv("SYNC_CHECKPOINT_MAX_AGE_HOURS", "12"))
+    # Omitir la corrida si el contenido de la respuesta es idéntico al de la última aplicada
+    SYNC_PAYLOAD_DIGEST_ENABLED: bool = os.getenv("SYNC_PAYLOAD_DIGEST_ENABLED", "true").lower() == "true"
+    # Bytes de la respuesta que se leen por adelantado para decidir antes de aplicar (streaming)
+    SYNC_PAYLOAD_DIGEST_BUFFER_BYTES: int = int(os.getenv("SYNC_PAYLOAD_DIGEST_BUFFER_BYTES", str(32 * 1024 * 1024)))
+    # Sincronización completa: descargas simultáneas al API SAP-STL
+    SYNC_MAX_CONCURRENT_FETCHES: int = int(os.getenv("SYNC_MAX_CONCURRENT_FETCHES", "4"))
+    # Descarga particionada por tipo (Orders por tipoDespacho, ProcurementOrders por tipoRecepcion)
+    SYNC_SHARDED_FETCH_ENABLED: bool = os.getenv("SYNC_SHARDED_FETCH_ENABLED", "true").lower() == "true"
+    SYNC_SHARD_CONCURRENCY: int = int(os.getenv("SYNC_SHARD_CONCURRENCY", "4"))
+    # Tipos conocidos además de los ya sincronizados, p.ej. "201,202,203,204"
+    SYNC_SHARD_DISPATCH_TYPES: str = os.getenv("SYNC_SHARD_DISPATCH_TYPES", "201,202,203,204")
+    SYNC_SHARD_RECEPTION_TYPES: str = os.getenv("SYNC_SHARD_RECEPTION_TYPES", "")
+    # Cada cuántas horas se hace una pasada sin particionar para descubrir tipos nuevos
+    SYNC_SHARD_DISCOVERY_HOURS: int = int(os.getenv("SYNC_SHARD_DISCOVERY_HOURS", "24"))
+    # Índice compacto clave -> huella de cada tabla, conservado en memoria entre corridas
+    SYNC_KEY_INDEX_ENABLED: bool = os.getenv("SYNC_KEY_INDEX_ENABLED", "true").lower() == "true"
+    # Antigüedad máxima del índice antes de recargarlo desde la tabla
+    SYNC_KEY_INDEX_MAX_AGE_MINUTES: int = int(os.getenv("SYNC_KEY_INDEX_MAX_AGE_MINUTES", "60"))
+    # Snapshot del índice en un archivo SQLite local para no releer las tablas al reiniciar
+    SYNC_SNAPSHOT_ENABLED: bool = os.getenv("SYNC_SNAPSHOT_ENABLED", "true").lower() == "true"
+    SYNC_SNAPSHOT_PATH: str = os.getenv("SYNC_SNAPSHOT_PATH", "")  # Vacío = stlw/state/sync_snapshot.db
+    # Sincronización incremental: marca de agua por entidad en STL_SYNC_CONFIG
+    SYNC_DELTA_ENABLED: bool = os.getenv("SYNC_DELTA_ENABLED", "true").lower() == "true"
+    # Filtros del API por entidad, p.ej. "dispatches=fechaDesde:date" (vacío = descarga completa)
+    SAP_STL_DELTA_FILTERS: str = os.getenv("SAP_STL_DELTA_FILTERS", "")
+    # Cada cuántas horas se fuerza una pasada completa de reconciliación
+    SYNC_FULL_RECONCILE_HOURS: int = int(os.getenv("SYNC_FULL_RECONCILE_HOURS", "24"))
+    # Envío a SAP (DeliveryNotes / GoodsReceipts): POST simultáneos por endpoint y estados por transacción
+    OUTBOUND_DELIVERY_CONCURRENCY: int = int(os.getenv("OUTBOUND_DELIVERY_CONCURRENCY", "4"))
+    OUTBOUND_RECEIPT_CONCURRENCY: int = int(os.getenv("OUTBOUND_RECEIPT_CONCURRENCY", "4"))
+    OUTBOUND_STATUS_BATCH_SIZE: int = int(os.getenv("OUTBOUND_STATUS_BATCH_SIZE", "50"))
+    # Reintentos de documentos rechazados: backoff exponencial (segundos) y tope antes de dead-letter
+    OUTBOUND_RETRY_BASE_SECONDS: int = int(os.getenv("OUTBOUND_RETRY_BASE_SECONDS", "300"))
+    OUTBOUND_RETRY_MAX_SECONDS: int = int(os.getenv("OUTBOUND_RETRY_MAX_SECONDS", "21600"))
+    OUTBOUND_RETRY_MAX_ATTEMPTS: int = int(os.getenv("OUTBOUND_RETRY_MAX_ATTEMPTS", "6"))
+    # Aplicar las migraciones pendientes de sql/migrations al iniciar el backend
+    SCHEMA_MIGRATIONS_ON_STARTUP: bool = os.getenv("SCHEMA_MIGRATIONS_ON_STARTUP", "false").lower() == "true"
     
     # Modo simulación para datos SAP-STL (usar mientras el servidor no esté disponible)
     USE_MOCK_SAP_DATA: bool = os.getenv("USE_MOCK_SAP_DATA", "false").lower() == "true"
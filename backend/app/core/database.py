@@ -1,32 +1,361 @@
+import asyncio
 import fdb
-from contextlib import contextmanager
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, List, Optional, Sequence
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """No se pudo obtener una conexión del pool dentro del tiempo límite"""
+
+
+class StatementCacheStats:
+    """Contadores de la caché de sentencias, compartidos por todas las conexiones del pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def add(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else 0.0
+        return counters
+
+
+class StatementCache:
+    """LRU de sentencias preparadas (`cursor.prep`) de una conexión, por texto SQL.
+
+    Cada sentencia tiene su propio cursor: fdb exige ejecutar un PreparedStatement con
+    el cursor que lo creó, y así el resultado de una no se cierra al ejecutar otra.
+    Los commit/rollback solo cierran el resultado abierto; la sentencia sigue preparada.
+    """
+
+    def __init__(self, raw, max_size: int, stats: Optional[StatementCacheStats] = None):
+        self.raw = raw
+        self.max_size = max_size
+        self.stats = stats or StatementCacheStats()
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+
+    def get(self, sql: str) -> tuple:
+        """(cursor, sentencia preparada) para `sql`, preparándola si no está en caché"""
+        entry = self._entries.get(sql)
+        if entry is not None:
+            self._entries.move_to_end(sql)
+            self.stats.add('hits')
+            return entry
+
+        self.stats.add('misses')
+        cursor = self.raw.cursor()
+        entry = (cursor, cursor.prep(sql))
+        self._entries[sql] = entry
+        while len(self._entries) > self.max_size:
+            _, (old_cursor, _) = self._entries.popitem(last=False)
+            self._drop(old_cursor)
+            self.stats.add('evictions')
+        return entry
+
+    @staticmethod
+    def _drop(cursor):
+        try:
+            cursor.close()
+        except Exception as e:
+            logger.debug(f"Error cerrando sentencia en caché: {e}")
+
+    def clear(self):
+        for cursor, _ in self._entries.values():
+            self._drop(cursor)
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PooledConnection:
+    """Conexión fdb administrada por el pool (delega todo a la conexión real)"""
+
+    def __init__(self, raw, statement_cache_size: int = 0, statement_stats: Optional[StatementCacheStats] = None):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.statements = (StatementCache(raw, statement_cache_size, statement_stats)
+                           if statement_cache_size > 0 else None)
+
+    def execute_cached(self, sql: str, params: Optional[Sequence] = None):
+        """Ejecuta `sql` reutilizando su sentencia preparada; retorna el cursor para leer el resultado.
+
+        Volver a ejecutar el mismo texto SQL descarta el resultado anterior de esa sentencia.
+        """
+        if self.statements is None:
+            cursor = self.raw.cursor()
+            return cursor.execute(sql, params or ())
+        cursor, statement = self.statements.get(sql)
+        # Cierra un resultado anterior a medio leer (p.ej. tras fetchone); sigue preparada
+        statement.close()
+        cursor.execute(statement, params or ())
+        return cursor
+
+    def executemany_cached(self, sql: str, rows: Sequence[Sequence]):
+        """executemany con la sentencia preparada en caché"""
+        if self.statements is None:
+            cursor = self.raw.cursor()
+            return cursor.executemany(sql, rows)
+        cursor, statement = self.statements.get(sql)
+        cursor.executemany(statement, rows)
+        return cursor
+
+    @property
+    def closed(self) -> bool:
+        return bool(getattr(self.raw, 'closed', False))
+
+    def close(self):
+        # El pool es el dueño de la conexión; se devuelve al salir del contexto
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class FirebirdConnectionPool:
+    """Pool acotado de conexiones Firebird compartido por todos los servicios.
+
+    - Mantiene entre ``min_size`` y ``max_size`` conexiones abiertas.
+    - Verifica la conexión al entregarla si estuvo ociosa más de ``ping_after`` segundos.
+    - Cierra conexiones ociosas por más de ``max_idle`` segundos (respetando ``min_size``).
+    - Hace rollback al devolver cada conexión para no arrastrar transacciones abiertas.
+    """
+
+    def __init__(self, connection_params: dict, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 30.0, max_idle: float = 300.0, ping_after: float = 30.0,
+                 statement_cache_size: int = 0):
+        self.connection_params = connection_params
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.statement_cache_size = statement_cache_size
+        self.statement_stats = StatementCacheStats()
+
+        self._idle = deque()  # Conexiones libres, la más reciente a la derecha
+        self._size = 0        # Conexiones abiertas (libres + prestadas)
+        self._cond = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'evicted': 0, 'timeouts': 0}
+
+    def _connect(self) -> PooledConnection:
+        conn = PooledConnection(fdb.connect(**self.connection_params), self.statement_cache_size,
+                                self.statement_stats)
+        self.stats['created'] += 1
+        return conn
+
+    def _close_quietly(self, conn: PooledConnection):
+        try:
+            if conn.statements is not None:
+                conn.statements.clear()
+            conn.raw.close()
+        except Exception as e:
+            logger.debug(f"Error cerrando conexión Firebird: {e}")
+
+    def _is_healthy(self, conn: PooledConnection) -> bool:
+        """Verifica que la conexión siga viva con una consulta trivial"""
+        if conn.closed:
+            return False
+        try:
+            cursor = conn.raw.cursor()
+            try:
+                cursor.execute("SELECT 1 FROM RDB$DATABASE")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            conn.raw.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Conexión Firebird inválida descartada: {e}")
+            return False
+
+    def _pop_expired_locked(self) -> list:
+        """Retira del pool las conexiones ociosas vencidas (llamar con el lock tomado)"""
+        expired = []
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size:
+            oldest = self._idle[0]
+            if now - oldest.last_used < self.max_idle:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self.stats['evicted'] += 1
+            expired.append(oldest)
+        return expired
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        conn: Optional[PooledConnection] = None
+        with self._cond:
+            expired = self._pop_expired_locked()
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"Pool Firebird agotado ({self.max_size} conexiones en uso) tras {self.timeout}s"
+                    )
+                self._cond.wait(remaining)
+
+        for old in expired:
+            self._close_quietly(old)
+
+        if conn is not None:
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for < self.ping_after or self._is_healthy(conn):
+                self.stats['reused'] += 1
+                return conn
+            # Conexión muerta: se reemplaza sin liberar el cupo
+            self._close_quietly(conn)
+            self.stats['discarded'] += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: PooledConnection, discard: bool = False):
+        if not discard:
+            try:
+                # Reset por préstamo: nunca devolver una transacción abierta al pool
+                conn.raw.rollback()
+            except Exception as e:
+                logger.warning(f"Rollback al devolver conexión falló, se descarta: {e}")
+                discard = True
+
+        if discard or conn.closed:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self.stats['discarded'] += 1
+                self._cond.notify()
+            return
+
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            expired = self._pop_expired_locked()
+            self._cond.notify()
+        for old in expired:
+            self._close_quietly(old)
+
+    def warm_up(self):
+        """Abre conexiones hasta alcanzar min_size"""
+        opened = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size:
+                        break
+                    self._size += 1
+                try:
+                    opened.append(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                    raise
+        finally:
+            for conn in opened:
+                self.release(conn)
+
+    def close_all(self):
+        """Cierra todas las conexiones libres (las prestadas se cierran al devolverse)"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self.stats,
+                'statement_cache': {'size_per_connection': self.statement_cache_size,
+                                    **self.statement_stats.snapshot()}
+            }
+
+
+_pool: Optional[FirebirdConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> FirebirdConnectionPool:
+    """Pool global, creado de forma perezosa con la configuración actual"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = FirebirdConnectionPool(
+                    connection_params={
+                        'host': settings.FIREBIRD_HOST,
+                        'port': settings.FIREBIRD_PORT,
+                        'database': settings.FIREBIRD_DATABASE,
+                        'user': settings.FIREBIRD_USER,
+                        'password': settings.FIREBIRD_PASSWORD,
+                        'charset': 'UTF8'
+                    },
+                    min_size=settings.FIREBIRD_POOL_MIN_SIZE,
+                    max_size=settings.FIREBIRD_POOL_MAX_SIZE,
+                    timeout=settings.FIREBIRD_POOL_TIMEOUT_SECONDS,
+                    max_idle=settings.FIREBIRD_POOL_MAX_IDLE_SECONDS,
+                    ping_after=settings.FIREBIRD_POOL_PING_AFTER_SECONDS,
+                    statement_cache_size=settings.FIREBIRD_STATEMENT_CACHE_SIZE
+                )
+    return _pool
+
+
 class FirebirdConnection:
     def __init__(self):
-        self.connection_params = {
-            'host': settings.FIREBIRD_HOST,
-            'port': settings.FIREBIRD_PORT,
-            'database': settings.FIREBIRD_DATABASE,
-            'user': settings.FIREBIRD_USER,
-            'password': settings.FIREBIRD_PASSWORD,
-            'charset': 'UTF8'
-        }
- 
+        self.pool = get_pool()
+        self.connection_params = self.pool.connection_params
+
     @contextmanager
     def get_connection(self):
-        connection = None
+        connection = self.pool.acquire()
+        discard = False
         try:
-            connection = fdb.connect(**self.connection_params)
             yield connection
         except Exception as e:
-            if connection:
+            try:
                 connection.rollback()
+            except Exception:
+                # La conexión quedó inservible (red caída, etc.)
+                discard = True
             raise e
         finally:
-            if connection:
-                connection.close()
-    
+            self.pool.release(connection, discard=discard)
+
     def execute_query(self, query: str, params: tuple = None):
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -35,7 +364,7 @@ class FirebirdConnection:
                     cursor.execute(query, params)
                 else:
                     cursor.execute(query)
-                
+
                 if query.strip().upper().startswith('SELECT'):
                     return cursor.fetchall()
                 else:
@@ -44,4 +373,131 @@ class FirebirdConnection:
             finally:
                 cursor.close()
 
-db = FirebirdConnection()
\ No newline at end of file
+db = FirebirdConnection()
+
+
+class DatabaseExecutor:
+    """Ejecuta el trabajo Firebird (fdb es bloqueante) en un pool de hilos dedicado.
+
+    Así una sincronización pesada no congela el event loop de FastAPI ni los jobs de
+    APScheduler. Registra cuánto espera cada tarea en cola antes de tomar un hilo.
+    """
+
+    def __init__(self, database: FirebirdConnection, max_workers: int):
+        self.db = database
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {'tasks': 0, 'in_flight': 0, 'queue_wait_total': 0.0, 'queue_wait_max': 0.0, 'run_total': 0.0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="firebird")
+        return self._executor
+
+    def _record(self, queue_wait: float, run_time: float):
+        with self._lock:
+            self.stats['tasks'] += 1
+            self.stats['queue_wait_total'] += queue_wait
+            self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'], queue_wait)
+            self.stats['run_total'] += run_time
+        if queue_wait > 1.0:
+            logger.warning(f"Tarea Firebird esperó {queue_wait:.2f}s en cola (hilos: {self.max_workers})")
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Ejecuta fn(*args, **kwargs) en un hilo del pool y espera su resultado"""
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._record(started - submitted, time.perf_counter() - started)
+
+        with self._lock:
+            self.stats['in_flight'] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), task)
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+
+    async def run_with_connection(self, fn: Callable, *args, **kwargs) -> Any:
+        """Ejecuta fn(conn, *args, **kwargs) con una conexión del pool, todo en el hilo"""
+        def task():
+            with self.db.get_connection() as conn:
+                return fn(conn, *args, **kwargs)
+        return await self.run(task)
+
+    @asynccontextmanager
+    async def connection(self):
+        """Conexión prestada por el pool para varias llamadas `run` sucesivas.
+
+        La obtención y devolución (rollback) también ocurren en el pool de hilos.
+        """
+        context = self.db.get_connection()
+        conn = await self.run(context.__enter__)
+        try:
+            yield conn
+        except BaseException as e:
+            suppress = await self.run(context.__exit__, type(e), e, e.__traceback__)
+            if not suppress:
+                raise
+        else:
+            await self.run(context.__exit__, None, None, None)
+
+    async def execute(self, query: str, params: Optional[Sequence] = None) -> int:
+        """INSERT/UPDATE/DELETE con commit; retorna filas afectadas"""
+        def task(conn):
+            cursor = conn.execute_cached(query, params)
+            conn.commit()
+            return cursor.rowcount
+        return await self.run_with_connection(task)
+
+    async def executemany(self, query: str, rows: List[Sequence]) -> int:
+        """Ejecuta la sentencia para cada fila en una sola transacción"""
+        def task(conn):
+            conn.executemany_cached(query, rows)
+            conn.commit()
+            return len(rows)
+        return await self.run_with_connection(task)
+
+    async def fetchall(self, query: str, params: Optional[Sequence] = None, as_dict: bool = False) -> list:
+        """SELECT completo; con as_dict retorna dicts con nombres de columna en minúscula"""
+        def task(conn):
+            cursor = conn.execute_cached(query, params)
+            rows = cursor.fetchall()
+            if not as_dict:
+                return rows
+            columns = [desc[0].lower() for desc in cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+        return await self.run_with_connection(task)
+
+    async def fetchone(self, query: str, params: Optional[Sequence] = None):
+        def task(conn):
+            return conn.execute_cached(query, params).fetchone()
+        return await self.run_with_connection(task)
+
+    def status(self) -> dict:
+        with self._lock:
+            tasks = self.stats['tasks']
+            return {
+                'max_workers': self.max_workers,
+                'in_flight': self.stats['in_flight'],
+                'tasks': tasks,
+                'queue_wait_avg_ms': round(self.stats['queue_wait_total'] / tasks * 1000, 2) if tasks else 0.0,
+                'queue_wait_max_ms': round(self.stats['queue_wait_max'] * 1000, 2),
+                'run_avg_ms': round(self.stats['run_total'] / tasks * 1000, 2) if tasks else 0.0
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+db_executor = DatabaseExecutor(db, settings.FIREBIRD_EXECUTOR_THREADS)
@@ -0,0 +1,121 @@
+"""
+Huellas (fingerprints) de filas para detectar cambios en la sincronización.
+
+Reemplaza al hash MD5 hexadecimal de `json.dumps(..., sort_keys=True)`: los campos de
+cada entidad se leen en un orden fijo (tupla de atributos), se codifican con `repr`
+de la tupla (en C, distingue tipos y None de '') sin pasar por JSON y se resumen con
+BLAKE2b de 7 bytes. El resultado es un entero de 64 bits con signo que se guarda en
+columnas BIGINT (DATA_FP / DOC_FP) en lugar de un VARCHAR(32).
+
+Formato de la huella (esquema versionado)::
+
+    bit 63      : 0 (siempre positivo en BIGINT)
+    bits 56..62 : versión del esquema (FINGERPRINT_VERSION)
+    bits 0..55  : resumen BLAKE2b
+
+Una fila cuya huella es de otra versión (o NULL, filas anteriores que solo tienen
+DATA_HASH) se compara con el esquema anterior y se migra de forma perezosa al
+reescribir solo su huella.
+
+Micro-benchmark contra el esquema anterior::
+
+    python -m app.core.fingerprint [filas]
+"""
+import hashlib
+import json
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, Callable, Iterable, Optional, Sequence, Tuple
+
+FINGERPRINT_VERSION = 1
+
+_VERSION_SHIFT = 56
+_DIGEST_SIZE = 7                      # 56 bits de resumen
+
+
+def legacy_hash(data: dict) -> str:
+    """Esquema anterior (versión 0): MD5 hex de JSON ordenado, guardado en DATA_HASH"""
+    data_str = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.md5(data_str.encode()).hexdigest()
+
+
+def encode_values(values: Iterable[Any]) -> bytes:
+    """Codificación canónica de una tupla de valores escalares (str, números, fechas, None)"""
+    return repr(values if isinstance(values, tuple) else tuple(values)).encode()
+
+
+def fingerprint_values(values: Iterable[Any]) -> int:
+    """Huella versionada de una tupla de valores"""
+    digest = hashlib.blake2b(encode_values(values), digest_size=_DIGEST_SIZE).digest()
+    return (FINGERPRINT_VERSION << _VERSION_SHIFT) | int.from_bytes(digest, 'big')
+
+
+def fingerprint_version(fingerprint: Optional[int]) -> Optional[int]:
+    """Versión del esquema con que se calculó una huella guardada (None si no hay)"""
+    if fingerprint is None:
+        return None
+    return fingerprint >> _VERSION_SHIFT
+
+
+def is_current(fingerprint: Optional[int]) -> bool:
+    """True si la huella guardada es comparable con las que se calculan ahora"""
+    return fingerprint_version(fingerprint) == FINGERPRINT_VERSION
+
+
+@lru_cache(maxsize=None)
+def field_reader(fields: Tuple[str, ...]) -> Callable[[Any], tuple]:
+    """Lector compilado de los atributos de una entidad (siempre retorna tupla)"""
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda record: (getter(record),)
+    return getter
+
+
+def fingerprint_record(fields: Tuple[str, ...], record: Any) -> int:
+    """Huella de los atributos `fields` de un modelo SAP"""
+    return fingerprint_values(field_reader(fields)(record))
+
+
+def document_fingerprint(header_fields: Tuple[str, ...], record: Any, line_fields: Tuple[str, ...],
+                         lines: Optional[Sequence[Any]]) -> int:
+    """Huella agregada de una cabecera y sus líneas (ya ordenadas) en una sola pasada"""
+    read_line = field_reader(line_fields)
+    values = list(field_reader(header_fields)(record))
+    values.append(len(lines) if lines else 0)
+    for line in lines or ():
+        values.extend(read_line(line))
+    return fingerprint_values(values)
+
+
+def _benchmark(rows: int):
+    import time
+    from datetime import datetime
+    from types import SimpleNamespace
+
+    fields = ('numeroBusqueda', 'fechaCreacion', 'fechaPicking', 'fechaCarga', 'codigoCliente', 'nombreCliente')
+    now = datetime(2025, 7, 2, 8, 30)
+    records = [
+        SimpleNamespace(numeroBusqueda=i, fechaCreacion=now, fechaPicking=now, fechaCarga=None,
+                        codigoCliente=f'C{i % 500:05d}', nombreCliente=f'Cliente de prueba {i % 500}')
+        for i in range(rows)
+    ]
+
+    started = time.perf_counter()
+    for record in records:
+        legacy_hash({attr: getattr(record, attr) for attr in fields})
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for record in records:
+        fingerprint_record(fields, record)
+    current = time.perf_counter() - started
+
+    print(f"{rows} filas")
+    print(f"  MD5 + JSON (DATA_HASH): {legacy:.3f}s  ({legacy / rows * 1e6:.2f} us/fila, 32 bytes)")
+    print(f"  BLAKE2b-56 (DATA_FP):   {current:.3f}s  ({current / rows * 1e6:.2f} us/fila, 8 bytes)")
+    print(f"  Aceleración: {legacy / current:.1f}x")
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,194 @@
+"""
+Parser incremental de arreglos JSON.
+
+Permite procesar respuestas grandes del API SAP-STL (``[{...}, {...}, ...]``) a medida
+que llegan, sin tener en memoria el cuerpo completo ni la lista completa de dicts.
+"""
+import json
+import re
+from typing import Any, AsyncIterator, Iterable, List
+
+# Caracteres que cambian la profundidad o el estado de string fuera de un string
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+# Dentro de un string solo importan la comilla de cierre y los escapes
+_IN_STRING = re.compile(r'["\\]')
+_SEPARATORS = ' \t\r\n,'
+# Marca "no hay elemento completo todavía" (None es un elemento válido: null)
+_PENDING = object()
+_decoder = json.JSONDecoder()
+
+
+class JSONStreamError(ValueError):
+    """El contenido recibido no es un arreglo JSON válido"""
+
+
+class JSONArrayStreamParser:
+    """Divide un arreglo JSON de nivel superior en sus elementos a medida que llegan los bytes.
+
+    Uso::
+
+        parser = JSONArrayStreamParser()
+        for chunk in chunks:
+            for element in parser.feed(chunk):
+                ...
+        parser.close()
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._started = False
+        self._finished = False
+        # Estado del escaneo del elemento en curso (para no re-escanear lo ya leído)
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._element_start = None
+
+    def feed(self, text: str) -> List[Any]:
+        """Agrega texto y retorna los elementos completos decodificados"""
+        if self._finished:
+            if text.strip():
+                raise JSONStreamError("Contenido después del cierre del arreglo JSON")
+            return []
+        self._buffer += text
+        elements = []
+
+        if not self._started:
+            stripped = self._buffer.lstrip()
+            if not stripped:
+                self._buffer = ''
+                return elements
+            if stripped[0] != '[':
+                raise JSONStreamError("Se esperaba un arreglo JSON")
+            self._buffer = stripped[1:]
+            self._started = True
+
+        while True:
+            element = self._next_element()
+            if element is _PENDING:
+                break
+            elements.append(element)
+
+        # Descartar lo ya consumido para mantener acotado el buffer
+        if self._element_start is None:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        elif self._element_start > 0:
+            self._buffer = self._buffer[self._element_start:]
+            self._pos -= self._element_start
+            self._element_start = 0
+        return elements
+
+    def _next_element(self):
+        buffer = self._buffer
+
+        if self._element_start is None:
+            pos = self._pos
+            while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+                pos += 1
+            self._pos = pos
+            if pos >= len(buffer):
+                return _PENDING
+            if buffer[pos] == ']':
+                self._finished = True
+                self._pos = pos + 1
+                return _PENDING
+            self._element_start = pos
+
+        start = self._element_start
+        if self._pos == start and buffer[start] in '{["':
+            # Camino rápido: el elemento suele llegar completo dentro del bloque recibido
+            try:
+                value, end = _decoder.raw_decode(buffer, start)
+            except ValueError:
+                # Incompleto (o inválido): seguir con el escaneo incremental
+                pass
+            else:
+                self._pos = end
+                self._element_start = None
+                return value
+
+        if buffer[start] not in '{["':
+            # Escalar de nivel superior (número, true, null...): termina en ',' o ']'
+            ends = [i for i in (buffer.find(',', start), buffer.find(']', start)) if i >= 0]
+            if not ends:
+                return _PENDING
+            return self._emit(start, min(ends), min(ends))
+
+        pos = self._pos
+        while True:
+            if self._in_string:
+                match = _IN_STRING.search(buffer, pos)
+                if match is None:
+                    self._pos = len(buffer)
+                    return _PENDING
+                if match.group() == '\\':
+                    if match.end() >= len(buffer):
+                        # El carácter escapado aún no llegó
+                        self._pos = match.start()
+                        return _PENDING
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if self._depth == 0:
+                    return self._emit(self._element_start, pos, pos)
+                continue
+
+            match = _STRUCTURAL.search(buffer, pos)
+            if match is None:
+                self._pos = len(buffer)
+                return _PENDING
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._emit(self._element_start, pos, pos)
+
+    def _emit(self, start: int, end: int, next_pos: int):
+        raw = self._buffer[start:end]
+        self._pos = next_pos
+        self._element_start = None
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            raise JSONStreamError(f"Elemento JSON inválido: {e}") from e
+
+    def close(self):
+        """Valida que el arreglo haya terminado"""
+        if not self._started:
+            raise JSONStreamError("Respuesta vacía, se esperaba un arreglo JSON")
+        if not self._finished:
+            raise JSONStreamError("Arreglo JSON incompleto")
+
+
+async def iter_json_array(chunks: AsyncIterator[str]) -> AsyncIterator[Any]:
+    """Recorre un arreglo JSON recibido por partes, elemento por elemento"""
+    parser = JSONArrayStreamParser()
+    async for chunk in chunks:
+        for element in parser.feed(chunk):
+            yield element
+    parser.close()
+
+
+async def iter_batches(items: AsyncIterator[Any], size: int) -> AsyncIterator[List[Any]]:
+    """Agrupa un iterador asíncrono en listas de hasta `size` elementos"""
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def aiter_list(values: Iterable[Any]) -> AsyncIterator[Any]:
+    """Adapta una lista (p.ej. datos simulados) a iterador asíncrono"""
+    for value in values:
+        yield value
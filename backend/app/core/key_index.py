@@ -0,0 +1,255 @@
+"""
+Índice compacto en memoria: clave natural -> (ID, DATA_FP, DATA_HASH, DOC_FP).
+
+Reemplaza al dict de tuplas de Python (cientos de bytes por fila entre la tupla de la
+clave, la tupla del valor, los enteros y el hash hexadecimal) para poder mantener el
+índice de tablas completas (STL_ITEMS, STL_DISPATCHES, STL_GOODS_RECEIPTS) entre
+corridas sin disparar el consumo de memoria del proceso:
+
+- Cada clave se codifica con `repr` y se resume con `hash()` de esos bytes (64 bits,
+  estable dentro del proceso: los resúmenes nunca se persisten, se recalculan al
+  cargar); quedan ordenados en un `array('q')` y se buscan con bisect.
+- Las claves codificadas se guardan concatenadas en un solo `bytes` (con sus offsets)
+  para confirmar cada coincidencia: una colisión del resumen nunca confunde filas. Son
+  también lo que guarda el snapshot en disco (app.services.sync_snapshot), que arma el
+  índice sin reconstruir las tuplas.
+- ID, DATA_FP y DOC_FP van en arreglos `array('q')` paralelos; NULL es -2^63 (las
+  huellas y los IDs siempre son positivos). DATA_HASH (MD5 hexadecimal del esquema
+  anterior) solo se guarda, como entero de 128 bits, para las filas aún no migradas a
+  DATA_FP.
+- Los cambios posteriores se escriben en su posición si la clave ya existe; las claves
+  nuevas van a un dict pequeño que se funde con el índice al crecer.
+
+Memoria por millón de filas contra el dict de tuplas::
+
+    python -m app.core.key_index [filas]
+"""
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app.core.fingerprint import is_current
+
+NULL = -(1 << 63)
+
+# Filas nuevas que se acumulan antes de fundirlas con los arreglos ordenados
+MIN_PENDING_MERGE = 10_000
+
+
+def encode_key(key: tuple) -> bytes:
+    return repr(key).encode()
+
+
+def _with_digest(rows: Iterable[tuple]) -> Iterator[Tuple[int, bytes, tuple]]:
+    for encoded, row_id, data_fp, data_hash, doc_fp in rows:
+        yield hash(encoded), encoded, (row_id, data_fp, data_hash, doc_fp)
+
+
+def _pack(value: Optional[int]) -> int:
+    return NULL if value is None else value
+
+
+def _unpack(value: int) -> Optional[int]:
+    return None if value == NULL else value
+
+
+def _pack_hash(data_hash: str) -> Union[int, str]:
+    """MD5 hexadecimal -> entero (44 bytes contra 81 del str); otro formato queda igual"""
+    data_hash = data_hash.strip()
+    try:
+        return int(data_hash, 16) if len(data_hash) == 32 and data_hash == data_hash.lower() else data_hash
+    except ValueError:
+        return data_hash
+
+
+def _unpack_hash(value: Union[int, str, None]) -> Optional[str]:
+    return f'{value:032x}' if isinstance(value, int) else value
+
+
+class CompactKeyIndex:
+    """Clave natural -> (ID, DATA_FP, DATA_HASH, DOC_FP), con el mismo formato que `load_existing`"""
+
+    def __init__(self, rows: Iterable[Tuple[tuple, int, Optional[int], Optional[str], Optional[int]]] = ()):
+        self._digests = array('q')
+        self._offsets = array('q', [0])
+        self._keys = b''
+        self._ids = array('q')
+        self._fps = array('q')
+        self._doc_fps = array('q')
+        self._legacy: Dict[int, Union[int, str]] = {}
+        self._pending: Dict[tuple, tuple] = {}
+        self._build(_with_digest((encode_key(key), row_id, data_fp, data_hash, doc_fp)
+                                 for key, row_id, data_fp, data_hash, doc_fp in rows))
+
+    @classmethod
+    def from_encoded(cls, rows: Iterable[Tuple[bytes, int, Optional[int], Optional[str], Optional[int]]]):
+        """Índice a partir de filas con la clave ya codificada (ver `encoded_rows`)"""
+        index = cls()
+        index._build(_with_digest(rows))
+        return index
+
+    def _build(self, entries: Iterable[Tuple[int, bytes, tuple]]):
+        """Arma los arreglos ordenados a partir de (resumen, clave codificada, valores)"""
+        digests, offsets, keys = array('q'), array('q', [0]), bytearray()
+        ids, fps, doc_fps = array('q'), array('q'), array('q')
+        legacy: Dict[int, Union[int, str]] = {}
+        for digest, encoded, (row_id, data_fp, data_hash, doc_fp) in entries:
+            if data_hash and not is_current(data_fp):
+                legacy[len(ids)] = _pack_hash(data_hash)
+            digests.append(digest)
+            keys += encoded
+            offsets.append(len(keys))
+            ids.append(row_id)
+            fps.append(_pack(data_fp))
+            doc_fps.append(_pack(doc_fp))
+
+        # Orden por resumen: se reordenan los arreglos paralelos y las claves codificadas
+        order = sorted(range(len(digests)), key=digests.__getitem__)
+        sorted_keys = bytearray()
+        self._offsets = array('q', [0])
+        for position in order:
+            sorted_keys += keys[offsets[position]:offsets[position + 1]]
+            self._offsets.append(len(sorted_keys))
+        self._keys = bytes(sorted_keys)
+        self._digests = array('q', (digests[position] for position in order))
+        self._ids = array('q', (ids[position] for position in order))
+        self._fps = array('q', (fps[position] for position in order))
+        self._doc_fps = array('q', (doc_fps[position] for position in order))
+        rank = {position: index for index, position in enumerate(order) if position in legacy}
+        self._legacy = {rank[position]: data_hash for position, data_hash in legacy.items()}
+        self._pending = {}
+
+    def _position(self, key: tuple) -> int:
+        """Posición de la clave en los arreglos ordenados, o -1"""
+        encoded = encode_key(key)
+        digest = hash(encoded)
+        digests, offsets = self._digests, self._offsets
+        position = bisect_left(digests, digest)
+        while position < len(digests) and digests[position] == digest:
+            if self._keys[offsets[position]:offsets[position + 1]] == encoded:
+                return position
+            position += 1
+        return -1
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending
+        position = self._position(key)
+        if position < 0:
+            return None
+        return (self._ids[position], _unpack(self._fps[position]), _unpack_hash(self._legacy.get(position)),
+                _unpack(self._doc_fps[position]))
+
+    def lookup(self, keys: Iterable[tuple]) -> Dict[tuple, tuple]:
+        """Filas existentes de las claves dadas (mismo formato que el dict de `load_existing`)"""
+        found = {}
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                found[key] = entry
+        return found
+
+    def update(self, rows: Iterable[Tuple[tuple, int, Optional[int], Optional[str], Optional[int]]]):
+        """Registra filas escritas (clave, ID, DATA_FP, DATA_HASH, DOC_FP)"""
+        for key, row_id, data_fp, data_hash, doc_fp in rows:
+            position = self._position(key) if key not in self._pending else -1
+            legacy = _pack_hash(data_hash) if data_hash and not is_current(data_fp) else None
+            if position < 0:
+                self._pending[key] = (row_id, data_fp, _unpack_hash(legacy), doc_fp)
+                continue
+            self._ids[position] = row_id
+            self._fps[position] = _pack(data_fp)
+            self._doc_fps[position] = _pack(doc_fp)
+            if legacy is not None:
+                self._legacy[position] = legacy
+            else:
+                self._legacy.pop(position, None)
+        if len(self._pending) > max(MIN_PENDING_MERGE, len(self._digests) // 10):
+            self._merge()
+
+    def _merge(self):
+        """Funde las claves nuevas con los arreglos ordenados (las pendientes nunca están en ellos)"""
+        self._build(_with_digest(self.encoded_rows()))
+
+    def encoded_rows(self) -> Iterator[Tuple[bytes, int, Optional[int], Optional[str], Optional[int]]]:
+        """Todas las filas como (clave codificada, ID, DATA_FP, DATA_HASH, DOC_FP)"""
+        keys, offsets = self._keys, self._offsets
+        for position in range(len(self._digests)):
+            yield (keys[offsets[position]:offsets[position + 1]], self._ids[position],
+                   _unpack(self._fps[position]), _unpack_hash(self._legacy.get(position)),
+                   _unpack(self._doc_fps[position]))
+        for key, values in self._pending.items():
+            yield (encode_key(key),) + values
+
+    def __len__(self) -> int:
+        return len(self._digests) + len(self._pending)
+
+    def __contains__(self, key: tuple) -> bool:
+        return self.get(key) is not None
+
+    def nbytes(self) -> int:
+        """Memoria aproximada de los arreglos (sin contar las filas pendientes de fundir)"""
+        arrays = (self._digests, self._offsets, self._ids, self._fps, self._doc_fps)
+        return (sum(len(values) * values.itemsize for values in arrays) + len(self._keys)
+                + 100 * len(self._legacy))
+
+
+def _benchmark(rows: int):
+    import gc
+    import random
+    import time
+    import tracemalloc
+
+    def source(legacy: bool):
+        for i in range(rows):
+            key = (i, 201 + i % 4, 100_000 + i)
+            mixed = (i * 0x9E3779B97F4A7C15) & ((1 << 128) - 1)
+            data_fp = None if legacy else (1 << 56) | (mixed & ((1 << 56) - 1))
+            data_hash = f'{mixed:032x}' if legacy else None
+            yield key, 1_000_000 + i, data_fp, data_hash, (1 << 56) | i
+
+    def measure(build):
+        gc.collect()
+        started = time.perf_counter()
+        index = build()
+        elapsed = time.perf_counter() - started
+        del index
+        gc.collect()
+        tracemalloc.start()
+        index = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return index, size, elapsed
+
+    probes: List[tuple] = [(i, 201 + i % 4, 100_000 + i) for i in random.sample(range(rows), min(rows, 100_000))]
+    print(f"{rows} filas (clave de 3 enteros, como STL_DISPATCHES)")
+    for legacy in (False, True):
+        label = 'DATA_HASH hex (sin migrar)' if legacy else 'DATA_FP BIGINT'
+        mapping, dict_bytes, dict_seconds = measure(
+            lambda: {key: (row_id, fp, data_hash, doc_fp) for key, row_id, fp, data_hash, doc_fp in source(legacy)})
+        compact, compact_bytes, compact_seconds = measure(lambda: CompactKeyIndex(source(legacy)))
+
+        started = time.perf_counter()
+        for key in probes:
+            mapping.get(key)
+        dict_lookup = (time.perf_counter() - started) / len(probes)
+        started = time.perf_counter()
+        for key in probes:
+            compact.get(key)
+        compact_lookup = (time.perf_counter() - started) / len(probes)
+        assert all(compact.get(key) == mapping[key] for key in probes[:1000])
+
+        per_million = 1_000_000 / rows / 1024 / 1024
+        print(f"  {label}:")
+        print(f"    dict de tuplas:  {dict_bytes * per_million:7.1f} MB/millón ({dict_bytes / rows:.0f} B/fila), "
+              f"carga {dict_seconds:.2f}s, búsqueda {dict_lookup * 1e6:.2f} us")
+        print(f"    CompactKeyIndex: {compact_bytes * per_million:7.1f} MB/millón ({compact_bytes / rows:.0f} B/fila), "
+              f"carga {compact_seconds:.2f}s, búsqueda {compact_lookup * 1e6:.2f} us")
+        del mapping, compact
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
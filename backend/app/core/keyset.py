@@ -0,0 +1,106 @@
+"""
+Paginación por cursor (keyset) para los listados.
+
+En lugar de `ROWS m TO n`, que obliga a Firebird a recorrer y descartar todas las filas
+anteriores, cada página se pide "después de" la última fila entregada usando la
+columna de orden más el ID como desempate:
+
+    WHERE (FECHA < ? OR (FECHA = ? AND ID < ?) OR FECHA IS NULL)
+    ORDER BY FECHA DESC, ID DESC
+    ROWS 101
+
+Firebird no admite comparar filas `(FECHA, ID) < (?, ?)`, por eso el predicado se
+expande. Los NULL se tratan como en Firebird: primero en ASC y al final en DESC.
+El cursor que recibe el cliente es opaco (base64 del valor de orden y el ID).
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+class InvalidCursorError(ValueError):
+    """El cursor recibido no es válido para este listado"""
+
+
+def _encode_value(value: Any):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'n': str(value)}
+    return value
+
+
+def _decode_value(value: Any):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        if 'n' in value:
+            return Decimal(value['n'])
+        raise ValueError(f"Tipo de valor desconocido: {value}")
+    return value
+
+
+@dataclass(frozen=True)
+class KeysetOrder:
+    """Orden estable de un listado: columna de orden + ID como desempate"""
+    column: str
+    id_column: str = 'ID'
+    descending: bool = True
+
+    def encode_cursor(self, sort_value: Any, row_id: int) -> str:
+        payload = json.dumps({'k': self.column, 'v': _encode_value(sort_value), 'id': row_id},
+                             separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str) -> Tuple[Any, int]:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            if payload['k'] != self.column:
+                raise ValueError("cursor de otro listado")
+            return _decode_value(payload['v']), int(payload['id'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise InvalidCursorError(f"Cursor de paginación inválido: {e}") from e
+
+    def after(self, cursor: str) -> Tuple[str, List[Any]]:
+        """Predicado WHERE (y sus parámetros) para las filas posteriores al cursor"""
+        value, row_id = self.decode_cursor(cursor)
+        col, id_col = self.column, self.id_column
+        if self.descending:
+            if value is None:
+                return f"({col} IS NULL AND {id_col} < ?)", [row_id]
+            return f"({col} < ? OR ({col} = ? AND {id_col} < ?) OR {col} IS NULL)", [value, value, row_id]
+        if value is None:
+            return f"(({col} IS NULL AND {id_col} > ?) OR {col} IS NOT NULL)", [row_id]
+        return f"({col} > ? OR ({col} = ? AND {id_col} > ?))", [value, value, row_id]
+
+    def order_by(self) -> str:
+        direction = 'DESC' if self.descending else 'ASC'
+        return f"ORDER BY {self.column} {direction}, {self.id_column} {direction}"
+
+    def rows(self, limit: int, skip: int = 0) -> Tuple[str, List[int]]:
+        """Cláusula ROWS (con sus parámetros) que trae una fila extra para saber si hay página siguiente.
+
+        Los valores van como parámetros: el texto SQL no cambia entre páginas y la
+        sentencia preparada en caché se reutiliza.
+        """
+        if skip:
+            # Compatibilidad con clientes que aún paginan por desplazamiento
+            return "ROWS ? TO ?", [skip + 1, skip + limit + 1]
+        return "ROWS ?", [limit + 1]
+
+    def page(self, rows: Sequence[Sequence[Any]], limit: int, sort_index: int,
+             id_index: int = 0) -> Tuple[List[Any], Optional[str]]:
+        """Recorta la fila extra y arma el cursor de la página siguiente (None si es la última)"""
+        if len(rows) <= limit:
+            return list(rows), None
+        page = list(rows[:limit])
+        last = page[-1]
+        return page, self.encode_cursor(last[sort_index], last[id_index])
@@ -0,0 +1,337 @@
+"""
+Migraciones versionadas del esquema Firebird y verificación de planes de acceso.
+
+Los scripts viven en `backend/sql/migrations/NNN_descripcion.sql` y se aplican en
+orden de versión, cada uno en su propia transacción. La versión aplicada, su checksum
+y la duración quedan registrados en STL_SCHEMA_VERSION, de modo que volver a correr
+el runner solo aplica lo pendiente.
+
+Además se mantiene el registro de sentencias calientes (HOT_STATEMENTS): `capture_plans`
+prepara cada una y lee el PLAN que eligió el optimizador, marcando las que recorren
+una tabla completa (NATURAL).
+
+Uso::
+
+    python -m app.core.migrations status
+    python -m app.core.migrations apply
+    python -m app.core.migrations plans     # código de salida 1 si hay algún NATURAL
+"""
+import hashlib
+import logging
+import re
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / 'sql' / 'migrations'
+
+_FILENAME_RE = re.compile(r'^(\d+)_([\w\-]+)\.sql$')
+_SET_TERM_RE = re.compile(r'^SET\s+TERM\s+(\S+)$', re.IGNORECASE)
+
+CREATE_VERSION_TABLE = """
+    CREATE TABLE STL_SCHEMA_VERSION (
+        VERSION INTEGER NOT NULL PRIMARY KEY,
+        NAME VARCHAR(200) NOT NULL,
+        CHECKSUM VARCHAR(32) NOT NULL,
+        APPLIED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        DURATION_MS INTEGER
+    )
+"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    """Script de migración en disco"""
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def sql(self) -> str:
+        return self.path.read_text(encoding='utf-8')
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.md5(self.path.read_bytes()).hexdigest()
+
+
+def discover_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Scripts `NNN_nombre.sql` del directorio, ordenados por versión"""
+    migrations: Dict[int, Migration] = {}
+    if not directory.is_dir():
+        return []
+    for path in directory.glob('*.sql'):
+        match = _FILENAME_RE.match(path.name)
+        if not match:
+            logger.warning(f"Archivo de migración ignorado (nombre inválido): {path.name}")
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Versión de migración duplicada {version}: {migrations[version].path.name} y {path.name}")
+        migrations[version] = Migration(version, match.group(2), path)
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def split_statements(script: str) -> List[str]:
+    """Divide un script isql en sentencias.
+
+    Respeta `SET TERM` (cuerpos de triggers y procedimientos), comentarios `--` y
+    `/* */` y literales entre comillas. Los `COMMIT` se omiten: el runner confirma
+    cada migración completa.
+    """
+    statements: List[str] = []
+    terminator = ';'
+    current: List[str] = []
+    i, length = 0, len(script)
+    in_string = in_line_comment = in_block_comment = False
+
+    def flush():
+        statement = ''.join(current).strip()
+        current.clear()
+        if not statement:
+            return
+        set_term = _SET_TERM_RE.match(statement)
+        if set_term:
+            return set_term.group(1)
+        if statement.upper() not in ('COMMIT', 'COMMIT WORK'):
+            statements.append(statement)
+        return None
+
+    while i < length:
+        char = script[i]
+        if in_line_comment:
+            if char == '\n':
+                in_line_comment = False
+                current.append(char)
+            i += 1
+            continue
+        if in_block_comment:
+            if script.startswith('*/', i):
+                in_block_comment = False
+                i += 2
+            else:
+                i += 1
+            continue
+        if in_string:
+            current.append(char)
+            if char == "'":
+                in_string = False
+            i += 1
+            continue
+        if script.startswith('--', i):
+            in_line_comment = True
+            i += 2
+            continue
+        if script.startswith('/*', i):
+            in_block_comment = True
+            i += 2
+            continue
+        if char == "'":
+            in_string = True
+            current.append(char)
+            i += 1
+            continue
+        if script.startswith(terminator, i):
+            # El SET TERM se cierra con el terminador vigente; el nuevo aplica después
+            i += len(terminator)
+            terminator = flush() or terminator
+            continue
+        current.append(char)
+        i += 1
+    flush()
+    return statements
+
+
+
+# --------------------------------------------------------------------- runner
+def ensure_version_table(conn):
+    """Crea STL_SCHEMA_VERSION si no existe (DDL confirmado antes de usarla)"""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_SCHEMA_VERSION'"
+    )
+    if cursor.fetchone():
+        return
+    cursor.execute(CREATE_VERSION_TABLE)
+    conn.commit()
+    logger.info("Tabla STL_SCHEMA_VERSION creada")
+
+
+def applied_versions(conn) -> Dict[int, str]:
+    """Versiones ya aplicadas y su checksum"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT VERSION, CHECKSUM FROM STL_SCHEMA_VERSION")
+    return {row[0]: row[1].strip() for row in cursor.fetchall()}
+
+
+def pending_migrations(conn, migrations: Optional[List[Migration]] = None) -> List[Migration]:
+    """Migraciones en disco que aún no están registradas (avisa si alguna aplicada cambió)"""
+    migrations = discover_migrations() if migrations is None else migrations
+    applied = applied_versions(conn)
+    pending = []
+    for migration in migrations:
+        checksum = applied.get(migration.version)
+        if checksum is None:
+            pending.append(migration)
+        elif checksum != migration.checksum:
+            logger.warning(f"La migración {migration.version} ({migration.name}) cambió después de aplicada")
+    return pending
+
+
+def apply_migration(conn, migration: Migration) -> int:
+    """Aplica un script completo en una transacción y registra la versión; retorna ms"""
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        for statement in split_statements(migration.sql):
+            cursor.execute(statement)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        cursor.execute("""
+            INSERT INTO STL_SCHEMA_VERSION (VERSION, NAME, CHECKSUM, APPLIED_AT, DURATION_MS)
+            VALUES (?, ?, ?, ?, ?)
+        """, (migration.version, migration.name, migration.checksum, datetime.now(), duration_ms))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Migración {migration.version} ({migration.name}) aplicada en {duration_ms} ms")
+    return duration_ms
+
+
+def apply_pending(conn, migrations: Optional[List[Migration]] = None) -> List[Migration]:
+    """Aplica en orden las migraciones pendientes; se detiene en la primera que falle"""
+    ensure_version_table(conn)
+    applied = []
+    for migration in pending_migrations(conn, migrations):
+        apply_migration(conn, migration)
+        applied.append(migration)
+    return applied
+
+
+# ------------------------------------------------------------------ plans
+@dataclass(frozen=True)
+class HotStatement:
+    """Sentencia de uso frecuente cuyo plan debe resolverse por índice"""
+    name: str
+    sql: str
+
+
+def _in_list(size: int = 3) -> str:
+    return ', '.join('?' * size)
+
+
+HOT_STATEMENTS: List[HotStatement] = [
+    HotStatement('dispatch_by_natural_key', """
+        SELECT ID FROM STL_DISPATCHES
+        WHERE NUMERO_BUSQUEDA = ? AND TIPO_DESPACHO = ? AND NUMERO_DESPACHO = ?
+    """),
+    HotStatement('dispatch_sync_lookup', f"""
+        SELECT ID, NUMERO_BUSQUEDA, TIPO_DESPACHO, NUMERO_DESPACHO, DATA_FP, DATA_HASH, DOC_FP
+        FROM STL_DISPATCHES WHERE NUMERO_DESPACHO IN ({_in_list()})
+    """),
+    HotStatement('receipt_by_natural_key', """
+        SELECT ID FROM STL_GOODS_RECEIPTS
+        WHERE NUMERO_BUSQUEDA = ? AND TIPO_RECEPCION = ? AND NUMERO_DOCUMENTO = ?
+    """),
+    HotStatement('receipt_sync_lookup', f"""
+        SELECT ID, NUMERO_BUSQUEDA, TIPO_RECEPCION, NUMERO_DOCUMENTO, DATA_FP, DATA_HASH, DOC_FP
+        FROM STL_GOODS_RECEIPTS WHERE NUMERO_DOCUMENTO IN ({_in_list()})
+    """),
+    HotStatement('item_by_code', """
+        SELECT ID, DATA_FP, DATA_HASH FROM STL_ITEMS WHERE CODIGO_PRODUCTO = ?
+    """),
+    HotStatement('dispatch_line_by_key', """
+        SELECT ID, DATA_FP, DATA_HASH FROM STL_DISPATCH_LINES WHERE DISPATCH_ID = ? AND LINE_NUM = ?
+    """),
+    HotStatement('dispatch_lines_by_parent', f"""
+        SELECT DISPATCH_ID, ID, LINE_NUM, DATA_FP, DATA_HASH
+        FROM STL_DISPATCH_LINES WHERE DISPATCH_ID IN ({_in_list()})
+        ORDER BY DISPATCH_ID, LINE_NUM
+    """),
+    HotStatement('receipt_line_by_key', """
+        SELECT ID, DATA_FP, DATA_HASH FROM STL_GOODS_RECEIPT_LINES WHERE RECEIPT_ID = ? AND LINE_NUM = ?
+    """),
+    HotStatement('receipt_lines_by_parent', f"""
+        SELECT RECEIPT_ID, ID, LINE_NUM, DATA_FP, DATA_HASH
+        FROM STL_GOODS_RECEIPT_LINES WHERE RECEIPT_ID IN ({_in_list()})
+        ORDER BY RECEIPT_ID, LINE_NUM
+    """),
+    HotStatement('dispatches_page', """
+        SELECT ID, FECHA_PICKING FROM STL_DISPATCHES
+        ORDER BY FECHA_PICKING DESC, ID DESC ROWS ?
+    """),
+    HotStatement('goods_receipts_page', """
+        SELECT ID, FECHA FROM STL_GOODS_RECEIPTS
+        ORDER BY FECHA DESC, ID DESC ROWS ?
+    """),
+    HotStatement('items_page', """
+        SELECT ID, DESCRIPCION_PRODUCTO FROM STL_ITEMS
+        ORDER BY DESCRIPCION_PRODUCTO ASC, ID ASC ROWS ?
+    """),
+    HotStatement('telegram_queue_pending', """
+        SELECT ID, CHAT_ID, MESSAGE_TYPE, MESSAGE_TEXT, PRIORITY, CREATED_AT, ERROR_MESSAGE
+        FROM STL_TELEGRAM_QUEUE
+        WHERE STATUS = 'PENDING'
+        ORDER BY PRIORITY DESC, CREATED_AT ASC
+        ROWS 50
+    """),
+]
+
+_NATURAL_RE = re.compile(r'\bNATURAL\b', re.IGNORECASE)
+
+
+def capture_plans(conn, statements: Optional[List[HotStatement]] = None) -> List[dict]:
+    """Prepara cada sentencia (sin ejecutarla) y retorna el PLAN elegido por Firebird"""
+    results = []
+    for statement in HOT_STATEMENTS if statements is None else statements:
+        cursor = conn.cursor()
+        try:
+            plan = (cursor.prep(statement.sql).plan or '').strip()
+            results.append({'name': statement.name, 'plan': plan,
+                            'natural': bool(_NATURAL_RE.search(plan)), 'error': None})
+        except Exception as e:
+            results.append({'name': statement.name, 'plan': None, 'natural': False, 'error': str(e)})
+        finally:
+            cursor.close()
+    return results
+
+
+def natural_scans(plans: List[dict]) -> List[dict]:
+    """Planes que recorren alguna tabla completa (NATURAL)"""
+    return [plan for plan in plans if plan['natural']]
+
+
+def _main(argv: List[str]) -> int:
+    from app.core.database import db
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    command = argv[0] if argv else 'status'
+    with db.get_connection() as conn:
+        if command == 'apply':
+            applied = apply_pending(conn)
+            print(f"Migraciones aplicadas: {[m.version for m in applied] or 'ninguna'}")
+            return 0
+        if command == 'status':
+            ensure_version_table(conn)
+            applied = applied_versions(conn)
+            for migration in discover_migrations():
+                state = 'aplicada' if migration.version in applied else 'pendiente'
+                print(f"{migration.version:04d} {migration.name}: {state}")
+            return 0
+        if command == 'plans':
+            plans = capture_plans(conn)
+            for plan in plans:
+                flag = 'NATURAL' if plan['natural'] else ('ERROR' if plan['error'] else 'ok')
+                print(f"[{flag}] {plan['name']}: {plan['plan'] or plan['error']}")
+            return 1 if natural_scans(plans) else 0
+    print(f"Comando desconocido: {command} (apply | status | plans)")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))
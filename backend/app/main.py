@@ -4,6 +4,8 @@ from contextlib import asynccontextmanager
 from app.api.routes import router
 from app.routers.sap_stl import router as sap_stl_router
 from app.core.config import settings
+from app.core.database import db_executor, get_pool
+from app.core.migrations import apply_pending
 from app.services.background_sync_service import background_sync_service
 import logging
 import logging.handlers
@@ -60,12 +62,25 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("STL Backend iniciando...")
     logger.info(f"Nivel de logging configurado: {settings.LOG_LEVEL}")
+    try:
+        get_pool().warm_up()
+        logger.info(f"Pool Firebird listo: {get_pool().status()}")
+    except Exception as e:
+        logger.warning(f"No se pudo pre-abrir el pool Firebird (se abrirá bajo demanda): {e}")
+    if settings.SCHEMA_MIGRATIONS_ON_STARTUP:
+        try:
+            applied = await db_executor.run_with_connection(apply_pending)
+            logger.info(f"Migraciones de esquema aplicadas: {[m.version for m in applied] or 'ninguna'}")
+        except Exception as e:
+            logger.error(f"Error aplicando migraciones de esquema: {e}")
     logger.info("Iniciando servicios de sincronización automática...")
     await background_sync_service.start_scheduler()
     yield
     # Shutdown
     logger.info("Deteniendo servicios de background...")
     await background_sync_service.stop_scheduler()
+    db_executor.shutdown()
+    get_pool().close_all()
 
 app = FastAPI(
     title="STL Backend API",
@@ -80,6 +95,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursor de la página siguiente en los listados que retornan una lista
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(router, prefix="/api/v1")
@@ -87,7 +104,7 @@ app.include_router(sap_stl_router)
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "STL Backend API is running"}
+    return {"status": "healthy", "message": "STL Backend API is running", "db_pool": get_pool().status(), "db_executor": db_executor.status()}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,95 @@
+"""
+Codec de los modelos SAP-STL: JSON <-> modelos Pydantic sin dicts intermedios.
+
+- `decode_list` valida el arreglo completo directo desde los bytes de la respuesta con
+  un TypeAdapter: un solo recorrido en pydantic-core, sin `response.json()` ni
+  `Modelo(**item)` por elemento.
+- `encode` serializa el cuerpo de un envío con `model_dump_json` (sin `.dict()` y
+  `json.dumps` posterior).
+
+Comparación con el camino anterior::
+
+    python -m app.models.sap_stl_codec [pedidos]
+"""
+from functools import lru_cache
+from typing import List, Optional, Type, TypeVar
+
+from pydantic import BaseModel, TypeAdapter
+
+M = TypeVar('M', bound=BaseModel)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[M]) -> TypeAdapter:
+    """TypeAdapter de List[model] (construirlo compila el esquema: se hace una vez por modelo)"""
+    return TypeAdapter(List[model])
+
+
+def is_json_array(content: bytes) -> bool:
+    return content.lstrip()[:1] == b'['
+
+
+def decode_list(model: Type[M], content: bytes) -> Optional[List[M]]:
+    """Arreglo JSON -> lista de modelos; None si el contenido no es un arreglo.
+
+    Un elemento inválido lanza ValidationError, igual que `Modelo(**item)`.
+    """
+    if not is_json_array(content):
+        return None
+    return list_adapter(model).validate_json(content)
+
+
+def encode(instance: BaseModel) -> bytes:
+    """Cuerpo JSON de un modelo para enviarlo a SAP-STL"""
+    return instance.model_dump_json().encode()
+
+
+def _benchmark(orders: int):
+    import json
+    import time
+
+    from app.models.sap_stl_models import DispatchSTL
+
+    payload = json.dumps([
+        {
+            'numeroDespacho': i, 'numeroBusqueda': i, 'fechaCreacion': '2025-07-02T08:30:00Z',
+            'fechaPicking': '2025-07-02T00:00:00Z', 'fechaCarga': None, 'codigoCliente': f'CL-{i % 500:05d}',
+            'nombreCliente': f'Cliente de prueba {i % 500}', 'tipoDespacho': 201 + i % 4,
+            'lines': [
+                {'codigoProducto': str(300 + line), 'nombreProducto': f'Producto {line}', 'almacen': '01',
+                 'cantidadUMB': 10.5, 'lineNum': line, 'uoMCode': 'Libra (Lb)', 'uoMEntry': 2}
+                for line in range(5)
+            ],
+        }
+        for i in range(orders)
+    ]).encode()
+    list_adapter(DispatchSTL)
+
+    started = time.process_time()
+    previous = [DispatchSTL(**dispatch) for dispatch in json.loads(payload)]
+    legacy = time.process_time() - started
+
+    started = time.process_time()
+    current = decode_list(DispatchSTL, payload)
+    bulk = time.process_time() - started
+
+    started = time.process_time()
+    for dispatch in previous[:1000]:
+        json.dumps(dispatch.dict())
+    legacy_encode = time.process_time() - started
+
+    started = time.process_time()
+    for dispatch in current[:1000]:
+        encode(dispatch)
+    bulk_encode = time.process_time() - started
+
+    print(f"{orders} pedidos con 5 líneas ({len(payload) / 1024 / 1024:.1f} MB)")
+    print(f"  json + Modelo(**item):     {legacy:.3f}s CPU")
+    print(f"  TypeAdapter.validate_json: {bulk:.3f}s CPU  ({legacy / bulk:.1f}x)")
+    print(f"  1000 envíos .dict() + json.dumps: {legacy_encode * 1000:.1f} ms CPU")
+    print(f"  1000 envíos model_dump_json:      {bulk_encode * 1000:.1f} ms CPU  ({legacy_encode / bulk_encode:.1f}x)")
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
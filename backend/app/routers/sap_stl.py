@@ -10,41 +10,50 @@ from app.models.sap_stl_models import (
     DispatchSTL, GoodsReceiptSTL, InventoryGoodsIssueSTL, 
     InventoryGoodsReceiptSTL, InventoryTransfer
 )
-from app.core.database import FirebirdConnection
+from app.core.database import db_executor
+from app.core.keyset import InvalidCursorError, KeysetOrder
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/sap-stl", tags=["SAP-STL Integration"])
 
-db = FirebirdConnection()
+# Orden estable de los listados paginados por cursor
+ITEMS_ORDER = KeysetOrder('DESCRIPCION_PRODUCTO', descending=False)
+DISPATCHES_ORDER = KeysetOrder('FECHA_PICKING')
+GOODS_RECEIPTS_ORDER = KeysetOrder('FECHA')
+
+# Entidades del pipeline cuyos datos borra cada opción de /data/clean
+# (las órdenes de compra escriben en las tablas de recepciones)
+CLEAN_ENTITIES = {
+    'items': ['items'],
+    'dispatches': ['dispatches'],
+    'goods_receipts': ['goods_receipts', 'procurement_orders'],
+}
+
 
 
 @router.post("/sync-now")
 async def sync_now():
     """Sincronización inmediata con resultados"""
     try:
-        # Sincronizar todas las entidades con optimización
-        items_results = await optimized_sync_service.sync_items_optimized()
-        dispatches_results = await optimized_sync_service.sync_dispatches_optimized()
-        receipts_results = await optimized_sync_service.sync_receipts_optimized()
+        # Sincronizar todas las entidades: descargas en paralelo, escrituras en orden de dependencias
+        report = await optimized_sync_service.sync_all_optimized(["items", "dispatches", "goods_receipts"])
+        entities = report["entities"]
         
         # Contar datos en BD
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
-            total_items = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
-            total_dispatches = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
-            total_receipts = cursor.fetchone()[0]
+        total_items, total_dispatches, total_receipts = await db_executor.fetchone("""
+            SELECT (SELECT COUNT(*) FROM STL_ITEMS),
+                   (SELECT COUNT(*) FROM STL_DISPATCHES),
+                   (SELECT COUNT(*) FROM STL_GOODS_RECEIPTS)
+            FROM RDB$DATABASE
+        """)
             
         return {
             "sync_results": {
-                "items": items_results,
-                "dispatches": dispatches_results,
-                "goods_receipts": receipts_results
+                "items": entities["items"]["stats"],
+                "dispatches": entities["dispatches"]["stats"],
+                "goods_receipts": entities["goods_receipts"]["stats"]
             },
+            "sync_report": report,
             "totals_in_db": {
                 "items": total_items,
                 "dispatches": total_dispatches,
@@ -79,7 +88,8 @@ async def get_config_status():
             "mock_mode_enabled": sap_stl_client.use_mock_data,
             "api_url": sap_stl_client.base_url,
             "username": sap_stl_client.username,
-            "has_token": bool(sap_stl_client.token)
+            "has_token": bool(sap_stl_client.token),
+            "transport": sap_stl_client.transport_stats()
         }
     except Exception as e:
         return {"error": str(e)}
@@ -93,55 +103,65 @@ async def clean_data(entity_type: Optional[str] = None):
         entity_type: Tipo específico para limpiar (items, dispatches, goods_receipts)
                     Si no se especifica, limpia TODO
     """
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        counts_before = {}
+        counts_after = {}
+        
+        # Obtener conteos antes
+        cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
+        counts_before['items'] = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
+        counts_before['dispatches'] = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
+        counts_before['goods_receipts'] = cursor.fetchone()[0]
+        
+        if entity_type == "items":
+            cursor.execute("DELETE FROM STL_ITEMS")
+        elif entity_type == "dispatches":
+            cursor.execute("DELETE FROM STL_DISPATCH_LINES")
+            cursor.execute("DELETE FROM STL_DISPATCHES")
+        elif entity_type == "goods_receipts":
+            cursor.execute("DELETE FROM STL_GOODS_RECEIPT_LINES")
+            cursor.execute("DELETE FROM STL_GOODS_RECEIPTS")
+        else:
+            # Limpiar TODO
+            cursor.execute("DELETE FROM STL_GOODS_RECEIPT_LINES")
+            cursor.execute("DELETE FROM STL_GOODS_RECEIPTS")
+            cursor.execute("DELETE FROM STL_DISPATCH_LINES")
+            cursor.execute("DELETE FROM STL_DISPATCHES")
+            cursor.execute("DELETE FROM STL_ITEMS")
+        
+        # Sin datos el digest de contenido no puede omitir la próxima corrida de lo limpiado
+        cleaned = CLEAN_ENTITIES.get(entity_type) or [name for names in CLEAN_ENTITIES.values() for name in names]
+        digests = optimized_sync_service.pipeline.payload_digests
+        if digests:
+            try:
+                digests.clear_entities(cursor, cleaned)
+            except Exception as e:
+                logger.warning(f"No se pudieron borrar los digests de contenido de {cleaned}: {str(e)}")
+        conn.commit()
+        
+        # Obtener conteos después
+        cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
+        counts_after['items'] = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
+        counts_after['dispatches'] = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
+        counts_after['goods_receipts'] = cursor.fetchone()[0]
+        
+        return {
+            "message": f"Datos {'de ' + entity_type if entity_type else 'todos'} limpiados exitosamente",
+            "deleted": {
+                "items": counts_before['items'] - counts_after['items'],
+                "dispatches": counts_before['dispatches'] - counts_after['dispatches'],
+                "goods_receipts": counts_before['goods_receipts'] - counts_after['goods_receipts']
+            },
+            "remaining": counts_after
+        }
+    
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            counts_before = {}
-            counts_after = {}
-            
-            # Obtener conteos antes
-            cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
-            counts_before['items'] = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
-            counts_before['dispatches'] = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
-            counts_before['goods_receipts'] = cursor.fetchone()[0]
-            
-            if entity_type == "items":
-                cursor.execute("DELETE FROM STL_ITEMS")
-            elif entity_type == "dispatches":
-                cursor.execute("DELETE FROM STL_DISPATCH_LINES")
-                cursor.execute("DELETE FROM STL_DISPATCHES")
-            elif entity_type == "goods_receipts":
-                cursor.execute("DELETE FROM STL_GOODS_RECEIPT_LINES")
-                cursor.execute("DELETE FROM STL_GOODS_RECEIPTS")
-            else:
-                # Limpiar TODO
-                cursor.execute("DELETE FROM STL_GOODS_RECEIPT_LINES")
-                cursor.execute("DELETE FROM STL_GOODS_RECEIPTS")
-                cursor.execute("DELETE FROM STL_DISPATCH_LINES")
-                cursor.execute("DELETE FROM STL_DISPATCHES")
-                cursor.execute("DELETE FROM STL_ITEMS")
-            
-            conn.commit()
-            
-            # Obtener conteos después
-            cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
-            counts_after['items'] = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
-            counts_after['dispatches'] = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
-            counts_after['goods_receipts'] = cursor.fetchone()[0]
-            
-            return {
-                "message": f"Datos {'de ' + entity_type if entity_type else 'todos'} limpiados exitosamente",
-                "deleted": {
-                    "items": counts_before['items'] - counts_after['items'],
-                    "dispatches": counts_before['dispatches'] - counts_after['dispatches'],
-                    "goods_receipts": counts_before['goods_receipts'] - counts_after['goods_receipts']
-                },
-                "remaining": counts_after
-            }
+        return await db_executor.run_with_connection(run_in_db)
             
     except Exception as e:
         logger.error(f"Error limpiando datos: {str(e)}")
@@ -183,11 +203,7 @@ async def test_connection():
 async def sync_all_entities(background_tasks: BackgroundTasks):
     """Inicia sincronización de todas las entidades SAP-STL"""
     try:
-        async def sync_all():
-            await optimized_sync_service.sync_items_optimized()
-            await optimized_sync_service.sync_dispatches_optimized()
-            await optimized_sync_service.sync_receipts_optimized()
-        background_tasks.add_task(sync_all)
+        background_tasks.add_task(optimized_sync_service.sync_all_optimized, ["items", "dispatches", "goods_receipts"])
         return {"message": "Sincronización iniciada en segundo plano"}
     except Exception as e:
         logger.error(f"Error iniciando sincronización: {str(e)}")
@@ -240,102 +256,63 @@ async def get_items(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = None,
-    codigo_familia: Optional[int] = None
+    codigo_familia: Optional[int] = None,
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    include_total: bool = False
 ):
     """Obtiene artículos sincronizados desde SAP-STL"""
-    try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Construir query
-            where_conditions = []
-            params = []
-            
-            if search:
-                where_conditions.append("(UPPER(DESCRIPCION_PRODUCTO) LIKE ? OR UPPER(CODIGO_PRODUCTO) LIKE ?)")
-                search_param = f"%{search.upper()}%"
-                params.extend([search_param, search_param])
-            
-            if codigo_familia:
-                where_conditions.append("CODIGO_FAMILIA = ?")
-                params.append(codigo_familia)
-            
-            where_clause = ""
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-            
-            # Contar total
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        # Construir query
+        where_conditions = []
+        params = []
+        
+        if search:
+            where_conditions.append("(UPPER(DESCRIPCION_PRODUCTO) LIKE ? OR UPPER(CODIGO_PRODUCTO) LIKE ?)")
+            search_param = f"%{search.upper()}%"
+            params.extend([search_param, search_param])
+        
+        if codigo_familia:
+            where_conditions.append("CODIGO_FAMILIA = ?")
+            params.append(codigo_familia)
+        
+        where_clause = ""
+        if where_conditions:
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Total solo a pedido: COUNT(*) recorre todas las filas del filtro
+        total = None
+        if include_total:
             count_sql = f"SELECT COUNT(*) FROM STL_ITEMS {where_clause}"
             cursor.execute(count_sql, params)
             total = cursor.fetchone()[0]
-            
-            # Obtener datos paginados
-            sql = f"""
-            SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
-                   CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
-                   DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
-                   CREATED_AT, LAST_SYNC_AT
-            FROM STL_ITEMS {where_clause}
-            ORDER BY DESCRIPCION_PRODUCTO
-            ROWS {skip + 1} TO {skip + limit}
-            """
-            
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
-            
-            items = []
-            for row in rows:
-                items.append({
-                    "id": row[0],
-                    "codigoProducto": row[1],
-                    "descripcionProducto": row[2],
-                    "codigoProductoERP": row[3],
-                    "codigoFamilia": row[4],
-                    "nombreFamilia": row[5],
-                    "diasVencimiento": row[6],
-                    "codigoUMB": row[7],
-                    "descripcionUMB": row[8],
-                    "codigoFormaEmbalaje": row[9],
-                    "nombreFormaEmbalaje": row[10],
-                    "created_at": row[11],
-                    "last_sync_at": row[12]
-                })
-            
-            return {
-                "items": items,
-                "total": total,
-                "skip": skip,
-                "limit": limit
-            }
-            
-    except Exception as e:
-        logger.error(f"Error obteniendo items: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error obteniendo items: {str(e)}")
-
-
-@router.get("/items/{item_code}")
-async def get_item_by_code(item_code: str):
-    """Obtiene un artículo específico por código"""
-    try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            sql = """
-            SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
-                   CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
-                   DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
-                   CREATED_AT, LAST_SYNC_AT
-            FROM STL_ITEMS 
-            WHERE CODIGO_PRODUCTO = ?
-            """
-            
-            cursor.execute(sql, (item_code,))
-            row = cursor.fetchone()
-            
-            if not row:
-                raise HTTPException(status_code=404, detail=f"Artículo {item_code} no encontrado")
-            
-            return {
+        
+        # Página siguiente al cursor (keyset) en lugar de descartar filas con ROWS m TO n
+        if page_cursor:
+            condition, cursor_params = ITEMS_ORDER.after(page_cursor)
+            where_conditions.append(condition)
+            params.extend(cursor_params)
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Obtener datos paginados
+        rows_clause, rows_params = ITEMS_ORDER.rows(limit, 0 if page_cursor else skip)
+        sql = f"""
+        SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
+               CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
+               DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
+               CREATED_AT, LAST_SYNC_AT
+        FROM STL_ITEMS {where_clause}
+        {ITEMS_ORDER.order_by()}
+        {rows_clause}
+        """
+        
+        fetched = conn.execute_cached(sql, params + rows_params).fetchall()
+        rows, next_cursor = ITEMS_ORDER.page(fetched, limit, sort_index=2)
+        
+        items = []
+        for row in rows:
+            items.append({
                 "id": row[0],
                 "codigoProducto": row[1],
                 "descripcionProducto": row[2],
@@ -349,7 +326,65 @@ async def get_item_by_code(item_code: str):
                 "nombreFormaEmbalaje": row[10],
                 "created_at": row[11],
                 "last_sync_at": row[12]
-            }
+            })
+        
+        return {
+            "items": items,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "next_cursor": next_cursor
+        }
+    
+    try:
+        return await db_executor.run_with_connection(run_in_db)
+            
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error obteniendo items: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo items: {str(e)}")
+
+
+@router.get("/items/{item_code}")
+async def get_item_by_code(item_code: str):
+    """Obtiene un artículo específico por código"""
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        sql = """
+        SELECT ID, CODIGO_PRODUCTO, DESCRIPCION_PRODUCTO, CODIGO_PRODUCTO_ERP,
+               CODIGO_FAMILIA, NOMBRE_FAMILIA, DIAS_VENCIMIENTO, CODIGO_UMB,
+               DESCRIPCION_UMB, CODIGO_FORMA_EMBALAJE, NOMBRE_FORMA_EMBALAJE,
+               CREATED_AT, LAST_SYNC_AT
+        FROM STL_ITEMS 
+        WHERE CODIGO_PRODUCTO = ?
+        """
+        
+        cursor.execute(sql, (item_code,))
+        row = cursor.fetchone()
+        
+        if not row:
+            raise HTTPException(status_code=404, detail=f"Artículo {item_code} no encontrado")
+        
+        return {
+            "id": row[0],
+            "codigoProducto": row[1],
+            "descripcionProducto": row[2],
+            "codigoProductoERP": row[3],
+            "codigoFamilia": row[4],
+            "nombreFamilia": row[5],
+            "diasVencimiento": row[6],
+            "codigoUMB": row[7],
+            "descripcionUMB": row[8],
+            "codigoFormaEmbalaje": row[9],
+            "nombreFormaEmbalaje": row[10],
+            "created_at": row[11],
+            "last_sync_at": row[12]
+        }
+    
+    try:
+        return await db_executor.run_with_connection(run_in_db)
             
     except HTTPException:
         raise
@@ -365,77 +400,94 @@ async def get_dispatches(
     codigo_cliente: Optional[str] = None,
     tipo_despacho: Optional[int] = None,
     from_date: Optional[date] = None,
-    to_date: Optional[date] = None
+    to_date: Optional[date] = None,
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    include_total: bool = False
 ):
     """Obtiene despachos sincronizados desde SAP-STL"""
-    try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            where_conditions = []
-            params = []
-            
-            if codigo_cliente:
-                where_conditions.append("CODIGO_CLIENTE = ?")
-                params.append(codigo_cliente)
-            
-            if tipo_despacho:
-                where_conditions.append("TIPO_DESPACHO = ?")
-                params.append(tipo_despacho)
-            
-            if from_date:
-                where_conditions.append("FECHA_PICKING >= ?")
-                params.append(from_date)
-            
-            if to_date:
-                where_conditions.append("FECHA_PICKING <= ?")
-                params.append(to_date)
-            
-            where_clause = ""
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-            
-            # Contar total
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        where_conditions = []
+        params = []
+        
+        if codigo_cliente:
+            where_conditions.append("CODIGO_CLIENTE = ?")
+            params.append(codigo_cliente)
+        
+        if tipo_despacho:
+            where_conditions.append("TIPO_DESPACHO = ?")
+            params.append(tipo_despacho)
+        
+        if from_date:
+            where_conditions.append("FECHA_PICKING >= ?")
+            params.append(from_date)
+        
+        if to_date:
+            where_conditions.append("FECHA_PICKING <= ?")
+            params.append(to_date)
+        
+        where_clause = ""
+        if where_conditions:
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Total solo a pedido: COUNT(*) recorre todas las filas del filtro
+        total = None
+        if include_total:
             count_sql = f"SELECT COUNT(*) FROM STL_DISPATCHES {where_clause}"
             cursor.execute(count_sql, params)
             total = cursor.fetchone()[0]
+        
+        # Página siguiente al cursor (keyset) en lugar de descartar filas con ROWS m TO n
+        if page_cursor:
+            condition, cursor_params = DISPATCHES_ORDER.after(page_cursor)
+            where_conditions.append(condition)
+            params.extend(cursor_params)
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Obtener datos
+        rows_clause, rows_params = DISPATCHES_ORDER.rows(limit, 0 if page_cursor else skip)
+        sql = f"""
+        SELECT ID, NUMERO_DESPACHO, NUMERO_BUSQUEDA, FECHA_CREACION,
+               FECHA_PICKING, FECHA_CARGA, CODIGO_CLIENTE, NOMBRE_CLIENTE,
+               TIPO_DESPACHO, CREATED_AT, LAST_SYNC_AT
+        FROM STL_DISPATCHES {where_clause}
+        {DISPATCHES_ORDER.order_by()}
+        {rows_clause}
+        """
+        
+        fetched = conn.execute_cached(sql, params + rows_params).fetchall()
+        rows, next_cursor = DISPATCHES_ORDER.page(fetched, limit, sort_index=4)
+        
+        dispatches = []
+        for row in rows:
+            dispatches.append({
+                "id": row[0],
+                "numeroDespacho": row[1],
+                "numeroBusqueda": row[2],
+                "fechaCreacion": row[3],
+                "fechaPicking": row[4],
+                "fechaCarga": row[5],
+                "codigoCliente": row[6],
+                "nombreCliente": row[7],
+                "tipoDespacho": row[8],
+                "created_at": row[9],
+                "last_sync_at": row[10]
+            })
+        
+        return {
+            "dispatches": dispatches,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "next_cursor": next_cursor
+        }
+    
+    try:
+        return await db_executor.run_with_connection(run_in_db)
             
-            # Obtener datos
-            sql = f"""
-            SELECT ID, NUMERO_DESPACHO, NUMERO_BUSQUEDA, FECHA_CREACION,
-                   FECHA_PICKING, FECHA_CARGA, CODIGO_CLIENTE, NOMBRE_CLIENTE,
-                   TIPO_DESPACHO, CREATED_AT, LAST_SYNC_AT
-            FROM STL_DISPATCHES {where_clause}
-            ORDER BY FECHA_PICKING DESC
-            ROWS {skip + 1} TO {skip + limit}
-            """
-            
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
-            
-            dispatches = []
-            for row in rows:
-                dispatches.append({
-                    "id": row[0],
-                    "numeroDespacho": row[1],
-                    "numeroBusqueda": row[2],
-                    "fechaCreacion": row[3],
-                    "fechaPicking": row[4],
-                    "fechaCarga": row[5],
-                    "codigoCliente": row[6],
-                    "nombreCliente": row[7],
-                    "tipoDespacho": row[8],
-                    "created_at": row[9],
-                    "last_sync_at": row[10]
-                })
-            
-            return {
-                "dispatches": dispatches,
-                "total": total,
-                "skip": skip,
-                "limit": limit
-            }
-            
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error obteniendo dispatches: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error obteniendo dispatches: {str(e)}")
@@ -444,35 +496,37 @@ async def get_dispatches(
 @router.get("/dispatches/{dispatch_id}/lines")
 async def get_dispatch_lines(dispatch_id: int):
     """Obtiene las líneas de un despacho"""
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        sql = """
+        SELECT ID, CODIGO_PRODUCTO, NOMBRE_PRODUCTO, ALMACEN,
+               CANTIDAD_UMB, LINE_NUM, UOM_CODE, UOM_ENTRY
+        FROM STL_DISPATCH_LINES
+        WHERE DISPATCH_ID = ?
+        ORDER BY LINE_NUM
+        """
+        
+        cursor.execute(sql, (dispatch_id,))
+        rows = cursor.fetchall()
+        
+        lines = []
+        for row in rows:
+            lines.append({
+                "id": row[0],
+                "codigoProducto": row[1],
+                "nombreProducto": row[2],
+                "almacen": row[3],
+                "cantidadUMB": float(row[4]) if row[4] else 0,
+                "lineNum": row[5],
+                "uoMCode": row[6],
+                "uoMEntry": row[7]
+            })
+        
+        return {"lines": lines}
+    
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            sql = """
-            SELECT ID, CODIGO_PRODUCTO, NOMBRE_PRODUCTO, ALMACEN,
-                   CANTIDAD_UMB, LINE_NUM, UOM_CODE, UOM_ENTRY
-            FROM STL_DISPATCH_LINES
-            WHERE DISPATCH_ID = ?
-            ORDER BY LINE_NUM
-            """
-            
-            cursor.execute(sql, (dispatch_id,))
-            rows = cursor.fetchall()
-            
-            lines = []
-            for row in rows:
-                lines.append({
-                    "id": row[0],
-                    "codigoProducto": row[1],
-                    "nombreProducto": row[2],
-                    "almacen": row[3],
-                    "cantidadUMB": float(row[4]) if row[4] else 0,
-                    "lineNum": row[5],
-                    "uoMCode": row[6],
-                    "uoMEntry": row[7]
-                })
-            
-            return {"lines": lines}
+        return await db_executor.run_with_connection(run_in_db)
             
     except Exception as e:
         logger.error(f"Error obteniendo líneas de despacho {dispatch_id}: {str(e)}")
@@ -486,75 +540,92 @@ async def get_goods_receipts(
     codigo_suplidor: Optional[str] = None,
     tipo_recepcion: Optional[int] = None,
     from_date: Optional[date] = None,
-    to_date: Optional[date] = None
+    to_date: Optional[date] = None,
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    include_total: bool = False
 ):
     """Obtiene recepciones de mercancía sincronizadas desde SAP-STL"""
-    try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            where_conditions = []
-            params = []
-            
-            if codigo_suplidor:
-                where_conditions.append("CODIGO_SUPLIDOR = ?")
-                params.append(codigo_suplidor)
-            
-            if tipo_recepcion:
-                where_conditions.append("TIPO_RECEPCION = ?")
-                params.append(tipo_recepcion)
-            
-            if from_date:
-                where_conditions.append("FECHA >= ?")
-                params.append(from_date)
-            
-            if to_date:
-                where_conditions.append("FECHA <= ?")
-                params.append(to_date)
-            
-            where_clause = ""
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-            
-            # Contar total
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        where_conditions = []
+        params = []
+        
+        if codigo_suplidor:
+            where_conditions.append("CODIGO_SUPLIDOR = ?")
+            params.append(codigo_suplidor)
+        
+        if tipo_recepcion:
+            where_conditions.append("TIPO_RECEPCION = ?")
+            params.append(tipo_recepcion)
+        
+        if from_date:
+            where_conditions.append("FECHA >= ?")
+            params.append(from_date)
+        
+        if to_date:
+            where_conditions.append("FECHA <= ?")
+            params.append(to_date)
+        
+        where_clause = ""
+        if where_conditions:
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Total solo a pedido: COUNT(*) recorre todas las filas del filtro
+        total = None
+        if include_total:
             count_sql = f"SELECT COUNT(*) FROM STL_GOODS_RECEIPTS {where_clause}"
             cursor.execute(count_sql, params)
             total = cursor.fetchone()[0]
+        
+        # Página siguiente al cursor (keyset) en lugar de descartar filas con ROWS m TO n
+        if page_cursor:
+            condition, cursor_params = GOODS_RECEIPTS_ORDER.after(page_cursor)
+            where_conditions.append(condition)
+            params.extend(cursor_params)
+            where_clause = "WHERE " + " AND ".join(where_conditions)
+        
+        # Obtener datos
+        rows_clause, rows_params = GOODS_RECEIPTS_ORDER.rows(limit, 0 if page_cursor else skip)
+        sql = f"""
+        SELECT ID, NUMERO_DOCUMENTO, NUMERO_BUSQUEDA, FECHA,
+               TIPO_RECEPCION, CODIGO_SUPLIDOR, NOMBRE_SUPLIDOR,
+               CREATED_AT, LAST_SYNC_AT
+        FROM STL_GOODS_RECEIPTS {where_clause}
+        {GOODS_RECEIPTS_ORDER.order_by()}
+        {rows_clause}
+        """
+        
+        fetched = conn.execute_cached(sql, params + rows_params).fetchall()
+        rows, next_cursor = GOODS_RECEIPTS_ORDER.page(fetched, limit, sort_index=3)
+        
+        receipts = []
+        for row in rows:
+            receipts.append({
+                "id": row[0],
+                "numeroDocumento": row[1],
+                "numeroBusqueda": row[2],
+                "fecha": row[3],
+                "tipoRecepcion": row[4],
+                "codigoSuplidor": row[5],
+                "nombreSuplidor": row[6],
+                "created_at": row[7],
+                "last_sync_at": row[8]
+            })
+        
+        return {
+            "goods_receipts": receipts,
+            "total": total,
+            "skip": skip,
+            "limit": limit,
+            "next_cursor": next_cursor
+        }
+    
+    try:
+        return await db_executor.run_with_connection(run_in_db)
             
-            # Obtener datos
-            sql = f"""
-            SELECT ID, NUMERO_DOCUMENTO, NUMERO_BUSQUEDA, FECHA,
-                   TIPO_RECEPCION, CODIGO_SUPLIDOR, NOMBRE_SUPLIDOR,
-                   CREATED_AT, LAST_SYNC_AT
-            FROM STL_GOODS_RECEIPTS {where_clause}
-            ORDER BY FECHA DESC
-            ROWS {skip + 1} TO {skip + limit}
-            """
-            
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
-            
-            receipts = []
-            for row in rows:
-                receipts.append({
-                    "id": row[0],
-                    "numeroDocumento": row[1],
-                    "numeroBusqueda": row[2],
-                    "fecha": row[3],
-                    "tipoRecepcion": row[4],
-                    "codigoSuplidor": row[5],
-                    "nombreSuplidor": row[6],
-                    "created_at": row[7],
-                    "last_sync_at": row[8]
-                })
-            
-            return {
-                "goods_receipts": receipts,
-                "total": total,
-                "skip": skip,
-                "limit": limit
-            }
-            
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error obteniendo goods receipts: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error obteniendo goods receipts: {str(e)}")
@@ -634,49 +705,51 @@ async def create_inventory_transfer(transfer: InventoryTransfer):
 @router.get("/analytics/summary")
 async def get_analytics_summary():
     """Obtiene resumen analítico de datos SAP-STL"""
+    def run_in_db(conn):
+        cursor = conn.cursor()
+        
+        # Contar entidades
+        cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
+        total_items = cursor.fetchone()[0]
+        
+        cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
+        total_dispatches = cursor.fetchone()[0]
+        
+        cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
+        total_receipts = cursor.fetchone()[0]
+        
+        cursor.execute("SELECT COUNT(DISTINCT CODIGO_CLIENTE) FROM STL_DISPATCHES")
+        unique_customers = cursor.fetchone()[0]
+        
+        cursor.execute("SELECT COUNT(DISTINCT CODIGO_SUPLIDOR) FROM STL_GOODS_RECEIPTS")
+        unique_suppliers = cursor.fetchone()[0]
+        
+        # Despachos recientes por tipo
+        cursor.execute("""
+            SELECT TIPO_DESPACHO, COUNT(*) as CANTIDAD
+            FROM STL_DISPATCHES 
+            WHERE FECHA_PICKING >= DATEADD(day, -7, CURRENT_DATE)
+            GROUP BY TIPO_DESPACHO
+            ORDER BY CANTIDAD DESC
+        """)
+        recent_dispatches_by_type = [
+            {"tipo_despacho": row[0], "cantidad": row[1]}
+            for row in cursor.fetchall()
+        ]
+        
+        return {
+            "summary": {
+                "total_items": total_items,
+                "total_dispatches": total_dispatches,
+                "total_goods_receipts": total_receipts,
+                "unique_customers": unique_customers,
+                "unique_suppliers": unique_suppliers
+            },
+            "recent_dispatches_by_type": recent_dispatches_by_type
+        }
+    
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Contar entidades
-            cursor.execute("SELECT COUNT(*) FROM STL_ITEMS")
-            total_items = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM STL_DISPATCHES")
-            total_dispatches = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM STL_GOODS_RECEIPTS")
-            total_receipts = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(DISTINCT CODIGO_CLIENTE) FROM STL_DISPATCHES")
-            unique_customers = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(DISTINCT CODIGO_SUPLIDOR) FROM STL_GOODS_RECEIPTS")
-            unique_suppliers = cursor.fetchone()[0]
-            
-            # Despachos recientes por tipo
-            cursor.execute("""
-                SELECT TIPO_DESPACHO, COUNT(*) as CANTIDAD
-                FROM STL_DISPATCHES 
-                WHERE FECHA_PICKING >= DATEADD(day, -7, CURRENT_DATE)
-                GROUP BY TIPO_DESPACHO
-                ORDER BY CANTIDAD DESC
-            """)
-            recent_dispatches_by_type = [
-                {"tipo_despacho": row[0], "cantidad": row[1]}
-                for row in cursor.fetchall()
-            ]
-            
-            return {
-                "summary": {
-                    "total_items": total_items,
-                    "total_dispatches": total_dispatches,
-                    "total_goods_receipts": total_receipts,
-                    "unique_customers": unique_customers,
-                    "unique_suppliers": unique_suppliers
-                },
-                "recent_dispatches_by_type": recent_dispatches_by_type
-            }
+        return await db_executor.run_with_connection(run_in_db)
             
     except Exception as e:
         logger.error(f"Error obteniendo analytics: {str(e)}")
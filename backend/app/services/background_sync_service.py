@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 from typing import Dict, Any
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from app.core.database import db_executor
 from app.services.sync_config_service import sync_config_service
 from app.services.optimized_sync_service import optimized_sync_service
 
@@ -49,7 +50,7 @@ class BackgroundSyncService:
     async def load_sync_configurations(self):
         """Carga todas las configuraciones y crea jobs automáticos"""
         try:
-            configs = sync_config_service.get_all_configs()
+            configs = await db_executor.run(sync_config_service.get_all_configs)
             
             for config in configs:
                 if config.sync_enabled:
@@ -169,7 +170,7 @@ class BackgroundSyncService:
             
             # Actualizar timestamp de última sincronización
             if success:
-                sync_config_service.update_last_sync(entity_type)
+                await db_executor.run(sync_config_service.update_last_sync, entity_type)
                 
             duration = datetime.now() - start_time
             status = "exitosa" if success else "fallida"
@@ -182,7 +183,7 @@ class BackgroundSyncService:
         """Verifica cambios en la configuración y actualiza jobs"""
         logger.info("Verificando cambios en configuración de sincronización...")
         try:
-            configs = sync_config_service.get_all_configs()
+            configs = await db_executor.run(sync_config_service.get_all_configs)
             current_jobs = set(self.active_jobs.keys())
             
             for config in configs:
@@ -1,10 +1,19 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from app.schemas.dispatch import DispatchResponse, DispatchLineResponse, DispatchFilters
+from app.core.batch_loading import load_children
 from app.core.database import db
+from app.core.keyset import KeysetOrder
+
+DISPATCHES_ORDER = KeysetOrder('FECHA_PICKING')
 
 class DispatchService:
     def get_dispatches(self, filters: DispatchFilters, skip: int = 0, limit: int = 100) -> List[DispatchResponse]:
+        return self.get_dispatches_page(filters, limit, skip=skip)[0]
+    
+    def get_dispatches_page(self, filters: DispatchFilters, limit: int = 100, page_cursor: Optional[str] = None,
+                            skip: int = 0) -> Tuple[List[DispatchResponse], Optional[str]]:
+        """Página de despachos y cursor de la siguiente (None si es la última)"""
         with db.get_connection() as conn:
             cursor = conn.cursor()
             
@@ -38,10 +47,17 @@ class DispatchService:
                 query += " AND SYNC_STATUS = ?"
                 params.append(filters.sync_status)
             
-            query += f" ORDER BY FECHA_PICKING DESC ROWS {skip + 1} TO {skip + limit}"
+            # Página siguiente al cursor (keyset) en lugar de descartar filas con ROWS m TO n
+            if page_cursor:
+                condition, cursor_params = DISPATCHES_ORDER.after(page_cursor)
+                query += f" AND {condition}"
+                params.extend(cursor_params)
             
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            rows_clause, rows_params = DISPATCHES_ORDER.rows(limit, 0 if page_cursor else skip)
+            query += f" {DISPATCHES_ORDER.order_by()} {rows_clause}"
+            
+            fetched = conn.execute_cached(query, params + rows_params).fetchall()
+            results, next_cursor = DISPATCHES_ORDER.page(fetched, limit, sort_index=4)
             
             dispatches = []
             for row in results:
@@ -63,11 +79,12 @@ class DispatchService:
                 )
                 dispatches.append(dispatch)
             
-            # Cargar líneas para cada despacho
+            # Cargar las líneas de toda la página en consultas IN (...) por bloques
+            lines_by_dispatch = self._load_dispatch_lines(cursor, [dispatch.id for dispatch in dispatches])
             for dispatch in dispatches:
-                dispatch.lines = self._get_dispatch_lines(dispatch.id)
+                dispatch.lines = lines_by_dispatch.get(dispatch.id, [])
             
-            return dispatches
+            return dispatches, next_cursor
     
     def get_dispatch_by_id(self, dispatch_id: int) -> Optional[DispatchResponse]:
         with db.get_connection() as conn:
@@ -97,41 +114,36 @@ class DispatchService:
                     updated_at=result[10],
                     sync_status=result[11],
                     last_sync_at=result[12],
-                    lines=self._get_dispatch_lines(result[0])
+                    lines=self._load_dispatch_lines(cursor, [result[0]]).get(result[0], [])
                 )
                 return dispatch
             return None
     
-    def _get_dispatch_lines(self, dispatch_id: int) -> List[DispatchLineResponse]:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            query = """
-                SELECT ID, DISPATCH_ID, CODIGO_PRODUCTO, NOMBRE_PRODUCTO,
-                       ALMACEN, CANTIDAD_UMB, LINE_NUM, UOM_CODE, UOM_ENTRY, CREATED_AT
-                FROM STL_DISPATCH_LINES
-                WHERE DISPATCH_ID = ?
-                ORDER BY LINE_NUM
-            """
-            cursor.execute(query, (dispatch_id,))
-            results = cursor.fetchall()
-            
-            lines = []
-            for row in results:
-                line = DispatchLineResponse(
-                    id=row[0],
-                    dispatch_id=row[1],
-                    codigo_producto=row[2],
-                    nombre_producto=row[3],
-                    almacen=row[4],
-                    cantidad_umb=row[5],
-                    line_num=row[6],
-                    uom_code=row[7],
-                    uom_entry=row[8],
-                    created_at=row[9]
-                )
-                lines.append(line)
-            
-            return lines
+    def _load_dispatch_lines(self, cursor, dispatch_ids: List[int]) -> Dict[int, List[DispatchLineResponse]]:
+        """Líneas de varios despachos agrupadas por DISPATCH_ID"""
+        query = """
+            SELECT ID, DISPATCH_ID, CODIGO_PRODUCTO, NOMBRE_PRODUCTO,
+                   ALMACEN, CANTIDAD_UMB, LINE_NUM, UOM_CODE, UOM_ENTRY, CREATED_AT
+            FROM STL_DISPATCH_LINES
+            WHERE DISPATCH_ID IN ({placeholders})
+            ORDER BY DISPATCH_ID, LINE_NUM
+        """
+        return load_children(cursor, query, dispatch_ids, key_index=1, row_factory=self._line_from_row)
+    
+    @staticmethod
+    def _line_from_row(row) -> DispatchLineResponse:
+        return DispatchLineResponse(
+            id=row[0],
+            dispatch_id=row[1],
+            codigo_producto=row[2],
+            nombre_producto=row[3],
+            almacen=row[4],
+            cantidad_umb=row[5],
+            line_num=row[6],
+            uom_code=row[7],
+            uom_entry=row[8],
+            created_at=row[9]
+        )
     
     def count_dispatches(self, filters: DispatchFilters) -> int:
         with db.get_connection() as conn:
@@ -5,7 +5,7 @@ import logging
 from typing import Dict, Any
 from datetime import datetime
 
-from app.core.database import FirebirdConnection
+from app.core.database import db
 from app.models.manual_dispatch_models import DispatchManual, DispatchSyncResponse
 
 logger = logging.getLogger(__name__)
@@ -15,7 +15,7 @@ class ManualDispatchService:
     """Servicio para sincronizar manualmente despachos desde SAP"""
     
     def __init__(self):
-        self.db = FirebirdConnection()
+        self.db = db
     
     def _parse_date(self, date_str: str) -> str:
         """Extrae solo la fecha YYYY-MM-DD de una fecha ISO"""
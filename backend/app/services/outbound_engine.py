@@ -0,0 +1,164 @@
+"""
+Motor de envío de documentos a SAP-STL (DeliveryNotes, GoodsReceipts).
+
+- Concurrencia acotada por endpoint: hasta `max_concurrency` POST simultáneos.
+- Orden por carril: los documentos con la misma clave de orden (p.ej. el cliente) se
+  envían uno tras otro en el orden recibido (secuencia_vcl); carriles distintos avanzan
+  en paralelo. Con `max_concurrency=1` el envío es estrictamente secuencial.
+- Escritura del estado por lotes: un escritor toma los resultados a medida que llegan
+  y los confirma en una transacción por lote (hasta `status_batch_size`). Si no hay
+  cola, cada resultado se escribe apenas llega, sin esperar a completar el lote.
+- Métricas por corrida en `last_metrics`: documentos, rendimiento, latencia del POST
+  (p50/p95/máx) y lotes de escritura.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from app.core.database import DatabaseExecutor, db_executor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutboundJob:
+    """Documento a enviar: ID interno, datos agrupados y clave de orden (carril)"""
+    doc_id: Any
+    data: Dict[str, Any]
+    lane: Hashable = None
+    result: Optional[Dict[str, Any]] = None
+    written: bool = False
+    latency: float = 0.0
+
+
+@dataclass
+class _RunMetrics:
+    latencies: List[float] = field(default_factory=list)
+    batches: int = 0
+    write_seconds: float = 0.0
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class OutboundEngine:
+    """Envía documentos con concurrencia acotada y escribe sus estados por lotes.
+
+    `write_back(conn, jobs)` es bloqueante (fdb): actualiza el estado de un lote de
+    documentos sin confirmar; el motor hace el commit de la transacción del lote.
+    """
+
+    def __init__(self, name: str, write_back: Callable[[Any, List[OutboundJob]], None], max_concurrency: int,
+                 status_batch_size: int, executor: Optional[DatabaseExecutor] = None):
+        self.name = name
+        self.write_back = write_back
+        self.max_concurrency = max(1, max_concurrency)
+        self.status_batch_size = max(1, status_batch_size)
+        self.executor = executor or db_executor
+        self.last_metrics: Dict[str, Any] = {}
+
+    async def run(self, jobs: List[OutboundJob], send: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                  write: bool = True) -> List[OutboundJob]:
+        """Envía todos los trabajos con `send(data)`, que retorna `{'success', 'code', 'message', 'response'}`.
+
+        Con `write=False` (dry run) no toca la base de datos.
+        """
+        started = time.perf_counter()
+        metrics = _RunMetrics()
+        limiter = asyncio.Semaphore(self.max_concurrency)
+        queue: asyncio.Queue = asyncio.Queue()
+
+        lanes: Dict[Hashable, List[OutboundJob]] = {}
+        for position, job in enumerate(jobs):
+            # Sin clave de orden cada documento es su propio carril
+            lanes.setdefault(job.lane if job.lane is not None else ('__doc__', position), []).append(job)
+
+        async def run_lane(lane_jobs: List[OutboundJob]):
+            for job in lane_jobs:
+                async with limiter:
+                    metrics.in_flight += 1
+                    metrics.max_in_flight = max(metrics.max_in_flight, metrics.in_flight)
+                    sent = time.perf_counter()
+                    try:
+                        job.result = await send(job.data)
+                    except Exception as e:
+                        logger.error(f"{self.name}: error enviando documento {job.doc_id}: {str(e)}")
+                        job.result = {'success': False, 'code': 500, 'message': f'Error: {str(e)}', 'response': None}
+                    finally:
+                        job.latency = time.perf_counter() - sent
+                        metrics.latencies.append(job.latency)
+                        metrics.in_flight -= 1
+                if write:
+                    await queue.put(job)
+
+        writer = asyncio.create_task(self._write_results(queue, metrics)) if write else None
+        try:
+            await asyncio.gather(*(run_lane(lane_jobs) for lane_jobs in lanes.values()))
+        finally:
+            if writer:
+                await queue.put(None)
+                await writer
+
+        elapsed = time.perf_counter() - started
+        self.last_metrics = {
+            'documents': len(jobs),
+            'success': sum(1 for job in jobs if job.result and job.result['success']),
+            'failed': sum(1 for job in jobs if not job.result or not job.result['success']),
+            'lanes': len(lanes),
+            'max_concurrency': self.max_concurrency,
+            'max_in_flight': metrics.max_in_flight,
+            'duration_seconds': round(elapsed, 3),
+            'documents_per_second': round(len(jobs) / elapsed, 2) if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'p50': round(_percentile(metrics.latencies, 50) * 1000, 1),
+                'p95': round(_percentile(metrics.latencies, 95) * 1000, 1),
+                'max': round(max(metrics.latencies, default=0.0) * 1000, 1),
+            },
+            'status_batches': metrics.batches,
+            'status_write_seconds': round(metrics.write_seconds, 3),
+        }
+        logger.info(f"{self.name}: {self.last_metrics}")
+        return jobs
+
+    async def _write_results(self, queue: asyncio.Queue, metrics: _RunMetrics):
+        """Escritor único: agrupa lo que haya en cola (hasta status_batch_size) por transacción"""
+        done = False
+        while not done:
+            job = await queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.status_batch_size and not queue.empty():
+                job = queue.get_nowait()
+                if job is None:
+                    done = True
+                    break
+                batch.append(job)
+            await self._write_batch(batch, metrics)
+
+    async def _write_batch(self, batch: List[OutboundJob], metrics: _RunMetrics):
+        started = time.perf_counter()
+
+        def task(conn):
+            self.write_back(conn, batch)
+            conn.commit()
+
+        try:
+            await self.executor.run_with_connection(task)
+            for job in batch:
+                job.written = True
+        except Exception as e:
+            ids = [job.doc_id for job in batch]
+            logger.error(f"{self.name}: error escribiendo el estado de {ids}: {str(e)}")
+        finally:
+            metrics.batches += 1
+            metrics.write_seconds += time.perf_counter() - started
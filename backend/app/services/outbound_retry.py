@@ -0,0 +1,187 @@
+"""
+Ledger de reintentos para el envío de documentos a SAP-STL (pedidos y recepciones).
+
+Un documento que SAP rechaza sigue con estatus_erp = 2 y, sin control, se reenvía en
+cada corrida programada. El ledger (STL_OUTBOUND_RETRY) registra por documento los
+intentos fallidos, la clase del último error y cuándo vuelve a ser elegible:
+
+- Backoff exponencial: OUTBOUND_RETRY_BASE_SECONDS * 2^(intentos - 1), con un tope
+  de OUTBOUND_RETRY_MAX_SECONDS y un poco de jitter para no reenviar todo a la vez.
+- Dead-letter: un documento rechazado por SAP (4xx) OUTBOUND_RETRY_MAX_ATTEMPTS veces
+  queda en STATUS = 'DEAD' y no se vuelve a enviar hasta reiniciarlo (`reset`). Los
+  errores transitorios (red, 5xx, 429) y de autenticación solo aplican backoff: no
+  dependen del documento.
+- Un envío exitoso elimina la fila del documento.
+
+Las consultas de pendientes agregan `eligibility_filter` para omitir en la propia base
+los documentos que aún no son elegibles; así los sanos usan toda la capacidad de envío.
+Si la tabla no existe (migración 005 sin aplicar) el ledger queda inactivo y se envía
+como antes, sin backoff: un error en cada consulta detendría todos los envíos.
+"""
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT = 'TRANSIENT'
+AUTH = 'AUTH'
+REJECTED = 'REJECTED'
+
+STATUS_RETRY = 'RETRY'
+STATUS_DEAD = 'DEAD'
+
+
+def classify_error(code: Optional[int]) -> str:
+    """Clase del error según el código HTTP retornado por el envío"""
+    if code in (401, 403):
+        return AUTH
+    if code is None or code in (408, 429) or code >= 500:
+        return TRANSIENT
+    return REJECTED
+
+
+def retry_delay(attempts: int) -> float:
+    """Segundos hasta el próximo intento tras `attempts` fallos consecutivos"""
+    delay = settings.OUTBOUND_RETRY_BASE_SECONDS * (2 ** min(max(attempts, 1) - 1, 30))
+    delay = min(delay, settings.OUTBOUND_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.9, 1.0)
+
+
+class OutboundRetryLedger:
+    """Estado de reintentos de un tipo de documento ('DELIVERY', 'RECEIPT')"""
+
+    def __init__(self, doc_type: str, db=None):
+        self.doc_type = doc_type
+        self.db = db
+        self._table_exists = False
+        self._warned = False
+
+    def table_exists(self, conn) -> bool:
+        """Si STL_OUTBOUND_RETRY existe; una vez encontrada no se vuelve a consultar"""
+        if not self._table_exists:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_OUTBOUND_RETRY'")
+            self._table_exists = cursor.fetchone() is not None
+            if not self._table_exists and not self._warned:
+                logger.error(f"Tabla STL_OUTBOUND_RETRY no encontrada (migración 005 pendiente): "
+                             f"{self.doc_type} se envía sin backoff ni dead-letter")
+                self._warned = True
+        return self._table_exists
+
+    def eligibility_filter(self, id_column: str) -> str:
+        """Condición SQL para las consultas de pendientes: excluye DEAD y los que esperan backoff.
+
+        Depende de una llamada previa a `table_exists`; sin la tabla no filtra nada.
+        """
+        if not self._table_exists:
+            return "1 = 1"
+        return f"""NOT EXISTS (
+                SELECT 1 FROM STL_OUTBOUND_RETRY l
+                WHERE l.DOC_TYPE = '{self.doc_type}' AND l.DOC_ID = {id_column}
+                  AND (l.STATUS = '{STATUS_DEAD}' OR l.NEXT_ATTEMPT_AT > CURRENT_TIMESTAMP))"""
+
+    def record(self, conn, outcomes: List[tuple]) -> Dict[str, int]:
+        """Registra el resultado de un lote de envíos en la transacción de `conn` (sin commit).
+
+        `outcomes` son tuplas (doc_id, result) con el resultado de `send_*_to_sap`.
+        """
+        stats = {'cleared': 0, 'scheduled': 0, 'dead': 0}
+        if not outcomes or not self.table_exists(conn):
+            return stats
+
+        doc_ids = list({doc_id for doc_id, _ in outcomes})
+        placeholders = ', '.join('?' for _ in doc_ids)
+        cursor = conn.execute_cached(f"""
+            SELECT DOC_ID, ATTEMPTS, FIRST_FAILED_AT
+            FROM STL_OUTBOUND_RETRY
+            WHERE DOC_TYPE = ? AND DOC_ID IN ({placeholders})
+        """, [self.doc_type] + doc_ids)
+        existing = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        now = datetime.now()
+        cleared, updates, inserts = [], [], []
+        for doc_id, result in outcomes:
+            if result['success']:
+                if doc_id in existing:
+                    cleared.append((self.doc_type, doc_id))
+                    existing.pop(doc_id)
+                continue
+
+            attempts, first_failed_at = existing.get(doc_id, (0, None))
+            attempts += 1
+            error_class = classify_error(result.get('code'))
+            status = STATUS_DEAD if error_class == REJECTED and attempts >= settings.OUTBOUND_RETRY_MAX_ATTEMPTS else STATUS_RETRY
+            next_attempt = None if status == STATUS_DEAD else now + timedelta(seconds=retry_delay(attempts))
+            row = (attempts, status, error_class, result.get('code'), str(result.get('message'))[:200],
+                   first_failed_at or now, now, next_attempt, self.doc_type, doc_id)
+            (updates if doc_id in existing else inserts).append(row)
+            existing[doc_id] = (attempts, first_failed_at or now)
+
+            if status == STATUS_DEAD:
+                stats['dead'] += 1
+                logger.warning(f"{self.doc_type} {doc_id} enviado a dead-letter tras {attempts} rechazos: {result.get('message')}")
+            else:
+                stats['scheduled'] += 1
+
+        if cleared:
+            conn.executemany_cached("DELETE FROM STL_OUTBOUND_RETRY WHERE DOC_TYPE = ? AND DOC_ID = ?", cleared)
+        if updates:
+            conn.executemany_cached("""
+                UPDATE STL_OUTBOUND_RETRY
+                SET ATTEMPTS = ?, STATUS = ?, LAST_ERROR_CLASS = ?, LAST_CODE = ?, LAST_MESSAGE = ?,
+                    FIRST_FAILED_AT = ?, LAST_ATTEMPT_AT = ?, NEXT_ATTEMPT_AT = ?
+                WHERE DOC_TYPE = ? AND DOC_ID = ?
+            """, updates)
+        if inserts:
+            conn.executemany_cached("""
+                INSERT INTO STL_OUTBOUND_RETRY
+                    (ATTEMPTS, STATUS, LAST_ERROR_CLASS, LAST_CODE, LAST_MESSAGE,
+                     FIRST_FAILED_AT, LAST_ATTEMPT_AT, NEXT_ATTEMPT_AT, DOC_TYPE, DOC_ID)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, inserts)
+        stats['cleared'] = len(cleared)
+        return stats
+
+    def entries(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Documentos en el ledger (opcionalmente solo RETRY o DEAD), los más recientes primero"""
+        query = """
+            SELECT DOC_ID, ATTEMPTS, STATUS, LAST_ERROR_CLASS, LAST_CODE, LAST_MESSAGE,
+                   FIRST_FAILED_AT, LAST_ATTEMPT_AT, NEXT_ATTEMPT_AT
+            FROM STL_OUTBOUND_RETRY
+            WHERE DOC_TYPE = ?
+        """
+        params = [self.doc_type]
+        if status:
+            query += " AND STATUS = ?"
+            params.append(status.upper())
+        query += " ORDER BY LAST_ATTEMPT_AT DESC"
+
+        with self.db.get_connection() as conn:
+            if not self.table_exists(conn):
+                return []
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            columns = [column[0].lower() for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def reset(self, doc_ids: Optional[List[int]] = None) -> int:
+        """Elimina del ledger los documentos dados (o todos los DEAD) para que vuelvan a enviarse"""
+        with self.db.get_connection() as conn:
+            if not self.table_exists(conn):
+                return 0
+            cursor = conn.cursor()
+            if doc_ids:
+                cursor.executemany("DELETE FROM STL_OUTBOUND_RETRY WHERE DOC_TYPE = ? AND DOC_ID = ?",
+                                   [(self.doc_type, doc_id) for doc_id in doc_ids])
+                removed = len(doc_ids)
+            else:
+                cursor.execute("DELETE FROM STL_OUTBOUND_RETRY WHERE DOC_TYPE = ? AND STATUS = ?",
+                               (self.doc_type, STATUS_DEAD))
+                removed = cursor.rowcount
+            conn.commit()
+        logger.info(f"Ledger de reintentos {self.doc_type}: {removed} documentos reiniciados")
+        return removed
@@ -0,0 +1,172 @@
+"""
+Digest del contenido de las respuestas SAP-STL para omitir sincronizaciones sin cambios.
+
+El cliente calcula el SHA-256 del cuerpo de cada GET mientras lo recibe y lo compara con
+el de la última corrida aplicada para el mismo endpoint y filtros (p.ej.
+`/Transaction/Orders?tipoDespacho=1`), guardado en STL_SYNC_PAYLOAD_DIGEST. Si coincide,
+no se construyen modelos ni se toca la base: el pipeline registra la corrida con
+`payload_unchanged = 1`.
+
+- En streaming, con un digest previo la respuesta se lee por adelantado (hasta
+  SYNC_PAYLOAD_DIGEST_BUFFER_BYTES) para poder decidir antes de emitir el primer
+  elemento; si no cabe, se sigue en streaming normal.
+- El digest solo se guarda tras aplicar la corrida sin errores y se borra antes de la
+  primera escritura de una corrida con cambios: una corrida interrumpida nunca deja un
+  digest que haga omitir la siguiente.
+- El pipeline lo activa con la ContextVar PAYLOAD_DIGEST (no cambia la firma de los
+  métodos del cliente). Las pasadas delta no lo usan: sus filtros cambian en cada corrida.
+"""
+import hashlib
+import logging
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlencode
+
+from app.core.config import settings
+from app.core.json_stream import aiter_list
+
+logger = logging.getLogger(__name__)
+
+
+def digest_key(endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Endpoint con sus filtros en orden estable"""
+    key = '/' + endpoint.lstrip('/')
+    if params:
+        separator = '&' if '?' in key else '?'
+        key += separator + urlencode(sorted((name, str(value)) for name, value in params.items()))
+    return key
+
+
+class PayloadDigestStore:
+    """Lectura y escritura de STL_SYNC_PAYLOAD_DIGEST (una fila por endpoint y filtros)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, key: str) -> Optional[str]:
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DIGEST FROM STL_SYNC_PAYLOAD_DIGEST WHERE DIGEST_KEY = ?", (key,))
+            row = cursor.fetchone()
+        return row[0].strip() if row and row[0] else None
+
+    def save(self, entity: str, key: str, digest: str, body_bytes: int):
+        params = (entity.upper(), digest, body_bytes, datetime.now(), key)
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE STL_SYNC_PAYLOAD_DIGEST
+                SET ENTITY_TYPE = ?, DIGEST = ?, BODY_BYTES = ?, UPDATED_AT = ?
+                WHERE DIGEST_KEY = ?
+            """, params)
+            if cursor.rowcount == 0:
+                cursor.execute("""
+                    INSERT INTO STL_SYNC_PAYLOAD_DIGEST (ENTITY_TYPE, DIGEST, BODY_BYTES, UPDATED_AT, DIGEST_KEY)
+                    VALUES (?, ?, ?, ?, ?)
+                """, params)
+            conn.commit()
+
+    def clear(self, key: str):
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM STL_SYNC_PAYLOAD_DIGEST WHERE DIGEST_KEY = ?", (key,))
+            conn.commit()
+
+    def clear_entities(self, cursor, entities: List[str]):
+        """Borra en la transacción de `cursor` (sin commit) los digests de las entidades y de sus
+        particiones; sin la tabla (migración 006 pendiente) no hay nada que borrar"""
+        cursor.execute("SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_SYNC_PAYLOAD_DIGEST'")
+        if not cursor.fetchone():
+            return
+        for entity in entities:
+            cursor.execute("DELETE FROM STL_SYNC_PAYLOAD_DIGEST WHERE ENTITY_TYPE = ? OR ENTITY_TYPE LIKE ?",
+                           (entity.upper(), f"{entity.upper()}:%"))
+
+
+class PayloadDigest:
+    """Digest de la respuesta de una corrida: lo calcula el cliente y lo guarda el pipeline"""
+
+    def __init__(self, entity: str, store: PayloadDigestStore, executor, compare: bool = True):
+        self.entity = entity
+        self.store = store
+        self.executor = executor
+        self.compare = compare      # False: solo calcula y guarda (p.ej. pasada forzada)
+        self.key: Optional[str] = None
+        self.previous: Optional[str] = None
+        self.value: Optional[str] = None
+        self.body_bytes = 0
+        self.unchanged = False
+        self._invalidated = False
+        self._hash = hashlib.sha256()
+
+    async def begin(self, endpoint: str, params: Optional[Dict[str, Any]] = None):
+        """Fija la clave de la petición y carga el digest de la última corrida aplicada"""
+        self.key = digest_key(endpoint, params)
+        if not self.compare:
+            return
+        try:
+            self.previous = await self.executor.run(self.store.load, self.key)
+        except Exception as e:
+            logger.warning(f"No se pudo leer el digest de {self.key}: {str(e)}")
+
+    def update(self, data: bytes):
+        self._hash.update(data)
+        self.body_bytes += len(data)
+
+    def finish(self) -> bool:
+        """Cierra el digest; True si el contenido es idéntico al de la corrida anterior"""
+        self.value = self._hash.hexdigest()
+        self.unchanged = self.previous is not None and self.value == self.previous
+        if self.unchanged:
+            logger.info(f"Contenido sin cambios en {self.key} ({self.body_bytes} bytes), se omite la sincronización")
+        return self.unchanged
+
+    async def read_ahead(self, chunks: AsyncIterator[str]) -> Optional[AsyncIterator[str]]:
+        """Envuelve los fragmentos de texto de la respuesta calculando el digest.
+
+        Con digest previo lee por adelantado: si la respuesta completa cabe en el buffer
+        y no cambió retorna None (no hay nada que procesar).
+        """
+        iterator = chunks.__aiter__()
+        buffered = []
+        if self.previous:
+            async for chunk in iterator:
+                self.update(chunk.encode())
+                buffered.append(chunk)
+                if self.body_bytes > settings.SYNC_PAYLOAD_DIGEST_BUFFER_BYTES:
+                    break
+            else:
+                if self.finish():
+                    return None
+                return aiter_list(buffered)
+        return self._passthrough(buffered, iterator)
+
+    async def _passthrough(self, buffered: List[str], iterator: AsyncIterator[str]) -> AsyncIterator[str]:
+        for chunk in buffered:
+            yield chunk
+        async for chunk in iterator:
+            self.update(chunk.encode())
+            yield chunk
+        self.finish()
+
+    async def invalidate(self):
+        """Borra el digest guardado antes de la primera escritura de la corrida"""
+        if self.key and not self._invalidated:
+            self._invalidated = True
+            self.previous = None
+            try:
+                await self.executor.run(self.store.clear, self.key)
+            except Exception as e:
+                # Sin poder borrarlo tampoco se guarda el nuevo (p.ej. migración 006 pendiente)
+                logger.warning(f"No se pudo borrar el digest de {self.key}: {str(e)}")
+                self.key = None
+
+    async def commit(self):
+        """Guarda el digest de la corrida aplicada con éxito"""
+        if self.key and self.value:
+            await self.executor.run(self.store.save, self.entity, self.key, self.value, self.body_bytes)
+
+
+# Digest activo para las peticiones GET de la corrida en curso (lo fija el pipeline)
+PAYLOAD_DIGEST: ContextVar[Optional[PayloadDigest]] = ContextVar('payload_digest', default=None)
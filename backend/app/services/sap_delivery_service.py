@@ -3,9 +3,12 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime
 from collections import defaultdict
 
-from app.core.database import FirebirdConnection
+from app.core.config import settings
+from app.core.database import db, db_executor
 from app.services.sap_stl_client import sap_stl_client
-from app.models.sap_stl_models import DispatchSTL, DispatchLineSTL
+from app.models.sap_stl_models import DispatchSTL
+from app.services.outbound_engine import OutboundEngine, OutboundJob
+from app.services.outbound_retry import OutboundRetryLedger
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +17,11 @@ class SAPDeliveryService:
     """Servicio para enviar pedidos (DeliveryNotes) a SAP-STL"""
     
     def __init__(self):
-        self.db = FirebirdConnection()
+        self.db = db
+        self.retries = OutboundRetryLedger('DELIVERY', db)
+        self.engine = OutboundEngine('DeliveryNotes', self.write_pedido_statuses,
+                                     max_concurrency=settings.OUTBOUND_DELIVERY_CONCURRENCY,
+                                     status_batch_size=settings.OUTBOUND_STATUS_BATCH_SIZE)
     
     def _format_sap_datetime(self, dt: datetime) -> Optional[str]:
         """Formatea datetime al formato esperado por SAP: 2025-07-01T00:00:00Z"""
@@ -24,7 +31,12 @@ class SAPDeliveryService:
     
     async def get_pending_deliveries(self) -> List[Dict[str, Any]]:
         """Obtiene los pedidos pendientes de enviar a SAP desde vw_pedidos_to_sap"""
-        query = """
+        try:
+            # Verifica el ledger antes de armar el filtro: sin la tabla se consulta sin él
+            await db_executor.run_with_connection(self.retries.table_exists)
+        except Exception as e:
+            logger.error(f"Error verificando el ledger de reintentos: {str(e)}")
+        query = f"""
             SELECT numerodespacho,
                    numerobusqueda,
                    fechacreacion,
@@ -52,22 +64,13 @@ class SAPDeliveryService:
                    secuencia_vcl
             FROM vw_pedidos_to_sap p
             WHERE p.estatus = 3 AND p.estatus_erp = 2
+              AND {self.retries.eligibility_filter('p.id_pedido')}
             ORDER BY secuencia_vcl
         """
         
         try:
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                
-                columns = [desc[0].lower() for desc in cursor.description]
-                rows = cursor.fetchall()
-                
-                results = []
-                for row in rows:
-                    results.append(dict(zip(columns, row)))
-                
-                return results
+            # En el pool de hilos fdb para no bloquear el event loop
+            return await db_executor.fetchall(query, as_dict=True)
                 
         except Exception as e:
             logger.error(f"Error obteniendo pedidos pendientes: {str(e)}")
@@ -111,20 +114,9 @@ class SAPDeliveryService:
     async def send_delivery_to_sap(self, delivery_data: Dict[str, Any], dry_run: bool = False) -> Dict[str, Any]:
         """Envía un pedido a SAP y retorna el resultado"""
         try:
-            # Preparar el modelo de datos para SAP
-            lines = [DispatchLineSTL(**line) for line in delivery_data['lines']]
-            
-            dispatch = DispatchSTL(
-                numeroDespacho=delivery_data['numeroDespacho'],
-                numeroBusqueda=delivery_data['numeroBusqueda'],
-                fechaCreacion=delivery_data['fechaCreacion'],
-                fechaPicking=delivery_data['fechaPicking'],
-                fechaCarga=delivery_data['fechaCarga'],
-                codigoCliente=delivery_data['codigoCliente'],
-                nombreCliente=delivery_data['nombreCliente'],
-                tipoDespacho=delivery_data['tipoDespacho'],
-                lines=lines
-            )
+            # Preparar el modelo de datos para SAP: cabecera y líneas se validan en un solo paso
+            # (la clave interna id_pedido se ignora)
+            dispatch = DispatchSTL.model_validate(delivery_data)
             
             logger.info(f"{'[DRY RUN] ' if dry_run else ''}Procesando DeliveryNote - Pedido ID: {delivery_data['id_pedido']}")
             
@@ -161,47 +153,72 @@ class SAPDeliveryService:
                 'response': None
             }
     
+    def _clean_message(self, message: Any) -> str:
+        """Limpia el mensaje para evitar errores de conversión en Firebird"""
+        return str(message).replace('T00:00:00Z', '').replace('2025-07-', '').replace('2025-01-', '')[:200]
+
+    def write_pedido_statuses(self, conn, jobs: List[OutboundJob]):
+        """Actualiza el estado de un lote de pedidos en la transacción de `conn` (sin commit)"""
+        succeeded, failed = [], []
+        for job in jobs:
+            row = (self._clean_message(job.result['message']), job.result['code'], job.doc_id)
+            (succeeded if job.result['success'] else failed).append(row)
+
+        if succeeded:
+            # Si fue exitoso, actualizar estatus_erp = 3
+            conn.executemany_cached("""
+                UPDATE pedidos
+                SET estatus_erp = 3,
+                    mensaje_erp = ?,
+                    numero_solucion_erp = ?
+                WHERE id_pedido = ?
+            """, succeeded)
+        if failed:
+            # Si falló, solo actualizar mensaje y código
+            conn.executemany_cached("""
+                UPDATE pedidos
+                SET mensaje_erp = ?,
+                    numero_solucion_erp = ?
+                WHERE id_pedido = ?
+            """, failed)
+
+        # Ledger de reintentos: backoff / dead-letter de los fallidos, limpia los exitosos
+        retry_stats = self.retries.record(conn, [(job.doc_id, job.result) for job in jobs])
+
+        # Webhook para notificaciones externas (bot Telegram, etc.) en la misma transacción
+        self._queue_webhook_notifications(conn, [{
+            'event_type': 'DELIVERY_NOTES',
+            'success': job.result['success'],
+            'data': {
+                'id_pedido': job.doc_id,
+                'numeroBusqueda': job.data.get('numeroBusqueda'),
+                'tipoDespacho': job.data.get('tipoDespacho'),
+                'code': job.result['code'],
+                'message': job.result['message'],
+                'timestamp': datetime.now().isoformat()
+            }
+        } for job in jobs])
+        logger.info(f"Estados actualizados - Exitosos: {[row[2] for row in succeeded]}, Fallidos: {[row[2] for row in failed]}, Reintentos: {retry_stats}")
+
     def update_pedido_status(self, id_pedido: int, result: Dict[str, Any]) -> bool:
         """Actualiza el estado del pedido en la base de datos según el resultado"""
         try:
             with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Limpiar mensaje para evitar errores de conversión en Firebird
-                clean_message = str(result['message']).replace('T00:00:00Z', '').replace('2025-07-', '').replace('2025-01-', '')[:200]
-                
-                if result['success']:
-                    # Si fue exitoso, actualizar estatus_erp = 3
-                    query = """
-                        UPDATE pedidos
-                        SET estatus_erp = 3,
-                            mensaje_erp = ?,
-                            numero_solucion_erp = ?
-                        WHERE id_pedido = ?
-                    """
-                    params = (clean_message, result['code'], id_pedido)
-                else:
-                    # Si falló, solo actualizar mensaje y código
-                    query = """
-                        UPDATE pedidos
-                        SET mensaje_erp = ?,
-                            numero_solucion_erp = ?
-                        WHERE id_pedido = ?
-                    """
-                    params = (clean_message, result['code'], id_pedido)
-                
-                cursor.execute(query, params)
+                self.write_pedido_statuses(conn, [OutboundJob(id_pedido, {}, result=result)])
                 conn.commit()
-                
                 logger.info(f"Pedido {id_pedido} actualizado - Éxito: {result['success']}")
                 return True
-                
+
         except Exception as e:
             logger.error(f"Error actualizando estado del pedido {id_pedido}: {str(e)}")
             return False
     
     async def process_pending_deliveries(self, dry_run: bool = True) -> Dict[str, Any]:
-        """Procesa todos los pedidos pendientes de enviar a SAP"""
+        """Procesa todos los pedidos pendientes de enviar a SAP.
+
+        Los pedidos de un mismo cliente se envían en orden de secuencia_vcl; clientes
+        distintos van en paralelo (OUTBOUND_DELIVERY_CONCURRENCY).
+        """
         logger.info(f"{'[DRY RUN] ' if dry_run else ''}Iniciando procesamiento de pedidos pendientes para SAP")
         
         # Obtener pedidos pendientes
@@ -220,103 +237,58 @@ class SAPDeliveryService:
         grouped_deliveries = self._group_deliveries_by_order(pending_rows)
         
         logger.info(f"Se encontraron {len(grouped_deliveries)} pedidos para procesar")
-        
+
+        jobs = [OutboundJob(id_pedido, delivery_data, lane=delivery_data['codigoCliente'])
+                for id_pedido, delivery_data in grouped_deliveries.items()]
+        # Enviar a SAP (o simular si es dry_run); el estado solo se escribe si NO es dry_run
+        await self.engine.run(jobs, lambda data: self.send_delivery_to_sap(data, dry_run=dry_run), write=not dry_run)
+
         results = {
-            'processed': 0,
+            'processed': len(jobs),
             'success': 0,
             'failed': 0,
-            'details': []
+            'details': [],
+            'metrics': self.engine.last_metrics
         }
-        
-        # Procesar cada pedido
-        for id_pedido, delivery_data in grouped_deliveries.items():
-            try:
-                # Enviar a SAP (o simular si es dry_run)
-                result = await self.send_delivery_to_sap(delivery_data, dry_run=dry_run)
-                
-                # Solo actualizar base de datos si NO es dry_run
-                updated = False
-                if not dry_run:
-                    updated = self.update_pedido_status(id_pedido, result)
-                
-                # Registrar resultado
-                results['processed'] += 1
-                if result['success']:
-                    results['success'] += 1
-                else:
-                    results['failed'] += 1
-                
-                # Webhook para notificaciones externas (bot Telegram, etc.)
-                if not dry_run:
-                    try:
-                        await self._send_webhook_notification({
-                            'event_type': 'DELIVERY_NOTES',
-                            'success': result['success'],
-                            'data': {
-                                'id_pedido': id_pedido,
-                                'numeroBusqueda': delivery_data['numeroBusqueda'],
-                                'tipoDespacho': delivery_data['tipoDespacho'],
-                                'code': result['code'],
-                                'message': result['message'],
-                                'timestamp': datetime.now().isoformat()
-                            }
-                        })
-                    except Exception as e:
-                        logger.error(f"Error enviando webhook: {e}")
-                
-                results['details'].append({
-                    'id_pedido': id_pedido,
-                    'numeroBusqueda': delivery_data['numeroBusqueda'],
-                    'TipoDespacho': delivery_data['tipoDespacho'],
-                    'success': result['success'],
-                    'message': result['message'],
-                    'updated_db': updated,
-                    'json_data': result.get('response', {}).get('json_to_send') if dry_run else None
-                })
-                
-            except Exception as e:
-                logger.error(f"Error procesando pedido {id_pedido}: {str(e)}")
+        for job in jobs:
+            result = job.result
+            if result['success']:
+                results['success'] += 1
+            else:
                 results['failed'] += 1
-                results['details'].append({
-                    'id_pedido': id_pedido,
-                    'numeroBusqueda': delivery_data.get('numeroBusqueda'),
-                    'TipoDespacho': delivery_data.get('tipoDespacho'),
-                    'success': False,
-                    'message': f'Error: {str(e)}',
-                    'updated_db': False
-                })
+            results['details'].append({
+                'id_pedido': job.doc_id,
+                'numeroBusqueda': job.data['numeroBusqueda'],
+                'TipoDespacho': job.data['tipoDespacho'],
+                'success': result['success'],
+                'message': result['message'],
+                'updated_db': job.written,
+                'json_data': (result.get('response') or {}).get('json_to_send') if dry_run else None
+            })
         
         logger.info(f"{'[DRY RUN] ' if dry_run else ''}Procesamiento completado - Total: {results['processed']}, "
                    f"Exitosos: {results['success']}, Fallidos: {results['failed']}")
         
         return results
     
-    async def _send_webhook_notification(self, data: Dict[str, Any]):
-        """Envía webhook a servicios externos (bot Telegram, etc.)"""
-        try:
-            # Guardar en cola de webhooks en la base de datos
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Verificar si existe tabla de webhooks
-                try:
-                    # cursor.execute("""
-                    #     INSERT INTO STL_TELEGRAM_QUEUE 
-                    #     (CHAT_ID, MESSAGE_TYPE, MESSAGE_TEXT, PRIORITY)
-                    #     SELECT 0, ?, ?, 1 FROM RDB$DATABASE
-                    #     WHERE EXISTS (SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_TELEGRAM_QUEUE')
-                    # """, (
-                    #     data['event_type'],
-                    #     f"Evento {data['event_type']}: {'Éxito' if data['success'] else 'Error'} - ID: {data['data'].get('id_pedido', 'N/A')}"
-                    # ))
-                    # conn.commit()
-                    logger.debug(f"Webhook guardado en cola: {data['event_type']}")
-                except Exception:
-                    # Si no existe la tabla, solo logear
-                    logger.debug(f"Webhook event: {data['event_type']} - Success: {data['success']}")
-                    
-        except Exception as e:
-            logger.debug(f"Webhook notification failed (normal si no hay bot): {e}")
+    def _queue_webhook_notifications(self, conn, events: List[Dict[str, Any]]):
+        """Encola webhooks para servicios externos (bot Telegram, etc.) en la transacción del lote"""
+        for data in events:
+            # Verificar si existe tabla de webhooks
+            try:
+                # conn.cursor().execute("""
+                #     INSERT INTO STL_TELEGRAM_QUEUE 
+                #     (CHAT_ID, MESSAGE_TYPE, MESSAGE_TEXT, PRIORITY)
+                #     SELECT 0, ?, ?, 1 FROM RDB$DATABASE
+                #     WHERE EXISTS (SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_TELEGRAM_QUEUE')
+                # """, (
+                #     data['event_type'],
+                #     f"Evento {data['event_type']}: {'Éxito' if data['success'] else 'Error'} - ID: {data['data'].get('id_pedido', 'N/A')}"
+                # ))
+                logger.debug(f"Webhook guardado en cola: {data['event_type']}")
+            except Exception:
+                # Si no existe la tabla, solo logear
+                logger.debug(f"Webhook event: {data['event_type']} - Success: {data['success']}")
 
 
 # Instancia global del servicio
@@ -3,9 +3,12 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime
 from collections import defaultdict
 
-from app.core.database import FirebirdConnection
+from app.core.config import settings
+from app.core.database import db, db_executor
 from app.services.sap_stl_client import sap_stl_client
-from app.models.sap_stl_models import GoodsReceiptSTL, GoodsReceiptLineSTL
+from app.models.sap_stl_models import GoodsReceiptSTL
+from app.services.outbound_engine import OutboundEngine, OutboundJob
+from app.services.outbound_retry import OutboundRetryLedger
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +17,11 @@ class SAPGoodsReceiptService:
     """Servicio para enviar recepciones (GoodsReceipts) a SAP-STL"""
     
     def __init__(self):
-        self.db = FirebirdConnection()
+        self.db = db
+        self.retries = OutboundRetryLedger('RECEIPT', db)
+        self.engine = OutboundEngine('GoodsReceipts', self.write_recepcion_statuses,
+                                     max_concurrency=settings.OUTBOUND_RECEIPT_CONCURRENCY,
+                                     status_batch_size=settings.OUTBOUND_STATUS_BATCH_SIZE)
     
     def _format_sap_datetime(self, dt: datetime) -> Optional[str]:
         """Formatea datetime al formato esperado por SAP: 2025-07-03T00:00:00Z"""
@@ -24,7 +31,12 @@ class SAPGoodsReceiptService:
     
     async def get_pending_receipts(self) -> List[Dict[str, Any]]:
         """Obtiene las recepciones pendientes de enviar a SAP desde vw_recepcion_to_sap"""
-        query = """
+        try:
+            # Verifica el ledger antes de armar el filtro: sin la tabla se consulta sin él
+            await db_executor.run_with_connection(self.retries.table_exists)
+        except Exception as e:
+            logger.error(f"Error verificando el ledger de reintentos: {str(e)}")
+        query = f"""
             SELECT numerodocumento,
                    numerobusqueda,
                    fecha,
@@ -54,24 +66,15 @@ class SAPGoodsReceiptService:
                    caja_recibida,
                    cantidad_solicitada,
                    cantidad_diferencia
-            FROM vw_recepcion_to_sap
-            WHERE estatus = 3 AND estatus_erp = 2
+            FROM vw_recepcion_to_sap r
+            WHERE r.estatus = 3 AND r.estatus_erp = 2
+              AND {self.retries.eligibility_filter('r.id_recepcion')}
             ORDER BY secuencia_vcl
         """
         
         try:
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                
-                columns = [desc[0].lower() for desc in cursor.description]
-                rows = cursor.fetchall()
-                
-                results = []
-                for row in rows:
-                    results.append(dict(zip(columns, row)))
-                
-                return results
+            # En el pool de hilos fdb para no bloquear el event loop
+            return await db_executor.fetchall(query, as_dict=True)
                 
         except Exception as e:
             logger.error(f"Error obteniendo recepciones pendientes: {str(e)}")
@@ -115,18 +118,9 @@ class SAPGoodsReceiptService:
     async def send_receipt_to_sap(self, receipt_data: Dict[str, Any], dry_run: bool = False) -> Dict[str, Any]:
         """Envía una recepción a SAP y retorna el resultado"""
         try:
-            # Preparar el modelo de datos para SAP
-            lines = [GoodsReceiptLineSTL(**line) for line in receipt_data['lines']]
-            
-            receipt = GoodsReceiptSTL(
-                numeroDocumento=receipt_data['numeroDocumento'],
-                numeroBusqueda=receipt_data['numeroBusqueda'],
-                fecha=receipt_data['fecha'],
-                tipoRecepcion=receipt_data['tipoRecepcion'],
-                codigoSuplidor=receipt_data['codigoSuplidor'],
-                nombreSuplidor=receipt_data['nombreSuplidor'],
-                lines=lines
-            )
+            # Preparar el modelo de datos para SAP: cabecera y líneas se validan en un solo paso
+            # (la clave interna id_recepcion se ignora)
+            receipt = GoodsReceiptSTL.model_validate(receipt_data)
             
             logger.info(f"{'[DRY RUN] ' if dry_run else ''}Procesando GoodsReceipt - Recepción ID: {receipt_data['id_recepcion']}")
             
@@ -163,47 +157,72 @@ class SAPGoodsReceiptService:
                 'response': None
             }
     
+    def _clean_message(self, message: Any) -> str:
+        """Limpia el mensaje para evitar errores de conversión en Firebird"""
+        return str(message).replace('T00:00:00Z', '').replace('2025-07-', '').replace('2025-01-', '')[:200]
+
+    def write_recepcion_statuses(self, conn, jobs: List[OutboundJob]):
+        """Actualiza el estado de un lote de recepciones en la transacción de `conn` (sin commit)"""
+        succeeded, failed = [], []
+        for job in jobs:
+            row = (self._clean_message(job.result['message']), job.result['code'], job.doc_id)
+            (succeeded if job.result['success'] else failed).append(row)
+
+        if succeeded:
+            # Si fue exitoso, actualizar estatus_erp = 3
+            conn.executemany_cached("""
+                UPDATE recepciones
+                SET estatus_erp = 3,
+                    mensaje_erp = ?,
+                    numero_solucion_erp = ?
+                WHERE id_recepcion = ?
+            """, succeeded)
+        if failed:
+            # Si falló, solo actualizar mensaje y código
+            conn.executemany_cached("""
+                UPDATE recepciones
+                SET mensaje_erp = ?,
+                    numero_solucion_erp = ?
+                WHERE id_recepcion = ?
+            """, failed)
+
+        # Ledger de reintentos: backoff / dead-letter de los fallidos, limpia los exitosos
+        retry_stats = self.retries.record(conn, [(job.doc_id, job.result) for job in jobs])
+
+        # Webhook para notificaciones externas (bot Telegram, etc.) en la misma transacción
+        self._queue_webhook_notifications(conn, [{
+            'event_type': 'GOODS_RECEIPTS',
+            'success': job.result['success'],
+            'data': {
+                'id_recepcion': job.doc_id,
+                'numeroBusqueda': job.data.get('numeroBusqueda'),
+                'tipoRecepcion': job.data.get('tipoRecepcion'),
+                'code': job.result['code'],
+                'message': job.result['message'],
+                'timestamp': datetime.now().isoformat()
+            }
+        } for job in jobs])
+        logger.info(f"Estados actualizados - Exitosos: {[row[2] for row in succeeded]}, Fallidos: {[row[2] for row in failed]}, Reintentos: {retry_stats}")
+
     def update_recepcion_status(self, id_recepcion: int, result: Dict[str, Any]) -> bool:
         """Actualiza el estado de la recepción en la base de datos según el resultado"""
         try:
             with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Limpiar mensaje para evitar errores de conversión en Firebird
-                clean_message = str(result['message']).replace('T00:00:00Z', '').replace('2025-07-', '').replace('2025-01-', '')[:200]
-                
-                if result['success']:
-                    # Si fue exitoso, actualizar estatus_erp = 3
-                    query = """
-                        UPDATE recepciones
-                        SET estatus_erp = 3,
-                            mensaje_erp = ?,
-                            numero_solucion_erp = ?
-                        WHERE id_recepcion = ?
-                    """
-                    params = (clean_message, result['code'], id_recepcion)
-                else:
-                    # Si falló, solo actualizar mensaje y código
-                    query = """
-                        UPDATE recepciones
-                        SET mensaje_erp = ?,
-                            numero_solucion_erp = ?
-                        WHERE id_recepcion = ?
-                    """
-                    params = (clean_message, result['code'], id_recepcion)
-                
-                cursor.execute(query, params)
+                self.write_recepcion_statuses(conn, [OutboundJob(id_recepcion, {}, result=result)])
                 conn.commit()
-                
                 logger.info(f"Recepción {id_recepcion} actualizada - Éxito: {result['success']}")
                 return True
-                
+
         except Exception as e:
             logger.error(f"Error actualizando estado de la recepción {id_recepcion}: {str(e)}")
             return False
     
     async def process_pending_receipts(self, dry_run: bool = True) -> Dict[str, Any]:
-        """Procesa todas las recepciones pendientes de enviar a SAP"""
+        """Procesa todas las recepciones pendientes de enviar a SAP.
+
+        Las recepciones de un mismo suplidor se envían en orden de secuencia_vcl;
+        suplidores distintos van en paralelo (OUTBOUND_RECEIPT_CONCURRENCY).
+        """
         logger.info(f"{'[DRY RUN] ' if dry_run else ''}Iniciando procesamiento de recepciones pendientes para SAP")
         
         # Obtener recepciones pendientes
@@ -222,101 +241,57 @@ class SAPGoodsReceiptService:
         grouped_receipts = self._group_receipts_by_id(pending_rows)
         
         logger.info(f"Se encontraron {len(grouped_receipts)} recepciones para procesar")
-        
+
+        jobs = [OutboundJob(id_recepcion, receipt_data, lane=receipt_data['codigoSuplidor'])
+                for id_recepcion, receipt_data in grouped_receipts.items()]
+        # Enviar a SAP (o simular si es dry_run); el estado solo se escribe si NO es dry_run
+        await self.engine.run(jobs, lambda data: self.send_receipt_to_sap(data, dry_run=dry_run), write=not dry_run)
+
         results = {
-            'processed': 0,
+            'processed': len(jobs),
             'success': 0,
             'failed': 0,
-            'details': []
+            'details': [],
+            'metrics': self.engine.last_metrics
         }
-        
-        # Procesar cada recepción
-        for id_recepcion, receipt_data in grouped_receipts.items():
-            try:
-                # Enviar a SAP (o simular si es dry_run)
-                result = await self.send_receipt_to_sap(receipt_data, dry_run=dry_run)
-                
-                # Solo actualizar base de datos si NO es dry_run
-                updated = False
-                if not dry_run:
-                    updated = self.update_recepcion_status(id_recepcion, result)
-                
-                # Registrar resultado
-                results['processed'] += 1
-                if result['success']:
-                    results['success'] += 1
-                else:
-                    results['failed'] += 1
-                
-                # Webhook para notificaciones externas (bot Telegram, etc.)
-                if not dry_run:
-                    try:
-                        await self._send_webhook_notification({
-                            'event_type': 'GOODS_RECEIPTS',
-                            'success': result['success'],
-                            'data': {
-                                'id_recepcion': id_recepcion,
-                                'numeroBusqueda': receipt_data['numeroBusqueda'],
-                                'tipoRecepcion': receipt_data['tipoRecepcion'],
-                                'code': result['code'],
-                                'message': result['message'],
-                                'timestamp': datetime.now().isoformat()
-                            }
-                        })
-                    except Exception as e:
-                        logger.error(f"Error enviando webhook: {e}")
-                
-                results['details'].append({
-                    'id_recepcion': id_recepcion,
-                    'numeroBusqueda': receipt_data['numeroBusqueda'],
-                    'success': result['success'],
-                    'message': result['message'],
-                    'updated_db': updated,
-                    'json_data': result.get('response', {}).get('json_to_send') if dry_run else None
-                })
-                
-            except Exception as e:
-                logger.error(f"Error procesando recepción {id_recepcion}: {str(e)}")
+        for job in jobs:
+            result = job.result
+            if result['success']:
+                results['success'] += 1
+            else:
                 results['failed'] += 1
-                results['details'].append({
-                    'id_recepcion': id_recepcion,
-                    'numeroBusqueda': receipt_data.get('numeroBusqueda'),
-                    'success': False,
-                    'message': f'Error: {str(e)}',
-                    'updated_db': False
-                })
+            results['details'].append({
+                'id_recepcion': job.doc_id,
+                'numeroBusqueda': job.data['numeroBusqueda'],
+                'success': result['success'],
+                'message': result['message'],
+                'updated_db': job.written,
+                'json_data': (result.get('response') or {}).get('json_to_send') if dry_run else None
+            })
         
         logger.info(f"{'[DRY RUN] ' if dry_run else ''}Procesamiento completado - Total: {results['processed']}, "
                    f"Exitosos: {results['success']}, Fallidos: {results['failed']}")
         
         return results
     
-    async def _send_webhook_notification(self, data: Dict[str, Any]):
-        """Envía webhook a servicios externos (bot Telegram, etc.)"""
-        try:
-            # Guardar en cola de webhooks en la base de datos
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Verificar si existe tabla de webhooks
-                try:
-                    # cursor.execute("""
-                    #     INSERT INTO STL_TELEGRAM_QUEUE 
-                    #     (CHAT_ID, MESSAGE_TYPE, MESSAGE_TEXT, PRIORITY)
-                    #     SELECT 0, ?, ?, 1 FROM RDB$DATABASE
-                    #     WHERE EXISTS (SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_TELEGRAM_QUEUE')
-                    # """, (
-                    #     data['event_type'],
-                    #     f"Evento {data['event_type']}: {'Éxito' if data['success'] else 'Error'} - ID: {data['data'].get('id_recepcion', 'N/A')}"
-                    # ))
-                    # conn.commit()
-                    logger.debug(f"Webhook guardado en cola: {data['event_type']}")
-                except Exception:
-                    # Si no existe la tabla, solo logear
-                    logger.debug(f"Webhook event: {data['event_type']} - Success: {data['success']}")
-                    
-        except Exception as e:
-            logger.debug(f"Webhook notification failed (normal si no hay bot): {e}")
+    def _queue_webhook_notifications(self, conn, events: List[Dict[str, Any]]):
+        """Encola webhooks para servicios externos (bot Telegram, etc.) en la transacción del lote"""
+        for data in events:
+            # Verificar si existe tabla de webhooks
+            try:
+                # conn.cursor().execute("""
+                #     INSERT INTO STL_TELEGRAM_QUEUE 
+                #     (CHAT_ID, MESSAGE_TYPE, MESSAGE_TEXT, PRIORITY)
+                #     SELECT 0, ?, ?, 1 FROM RDB$DATABASE
+                #     WHERE EXISTS (SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'STL_TELEGRAM_QUEUE')
+                # """, (
+                #     data['event_type'],
+                #     f"Evento {data['event_type']}: {'Éxito' if data['success'] else 'Error'} - ID: {data['data'].get('id_recepcion', 'N/A')}"
+                # ))
+                logger.debug(f"Webhook guardado en cola: {data['event_type']}")
+            except Exception:
+                # Si no existe la tabla, solo logear
+                logger.debug(f"Webhook event: {data['event_type']} - Success: {data['success']}")
 
 
 # Instancia global del servicio
@@ -1,6 +1,8 @@
+import asyncio
 import httpx
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, AsyncIterator
+from datetime import datetime, timedelta, timezone
 import logging
 
 from app.core.config import settings
@@ -9,7 +11,14 @@ from app.models.sap_stl_models import (
     GoodsReceiptSTL, InventoryGoodsIssueSTL, InventoryGoodsReceiptSTL, 
     InventoryTransfer
 )
+from app.models.sap_stl_codec import decode_list, encode
+from app.core.json_stream import aiter_list, iter_json_array
 from app.services.mock_sap_stl_service import mock_sap_stl_service
+from app.services.payload_digest import PAYLOAD_DIGEST
+from app.services.sap_transport import (
+    AdaptiveLimiter, CallOutcome, CircuitBreaker, SAPUnavailableError, TransportMetrics,
+    build_http_client, http2_available, is_overload, report_request_error
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,21 +30,23 @@ class SAPSTLClient:
         self.password = settings.SAP_STL_PASSWORD
         self.token: Optional[str] = None
         self.token_expiry: Optional[datetime] = None
-        # Timeout aumentado a 120s para operaciones pesadas como sync masivo
-        self.client = httpx.AsyncClient(
-            timeout=httpx.Timeout(
-                connect=10.0,   # Tiempo para establecer conexión
-                read=120.0,     # Tiempo para leer respuesta (aumentado de 30s a 120s)
-                write=10.0,     # Tiempo para enviar datos
-                pool=10.0       # Tiempo para obtener conexión del pool
-            )
-        )
+        # Pool keep-alive compartido, HTTP/2 opcional y latencia por endpoint
+        self.metrics = TransportMetrics()
+        self.client = build_http_client(self.metrics)
+        # Un solo login a la vez: los llamadores concurrentes esperan el token renovado
+        self._auth_lock = asyncio.Lock()
+        self.auth_stats = {'logins': 0, 'proactive_refreshes': 0, 'coalesced': 0}
+        # Todas las llamadas pasan por el límite adaptativo y el circuit breaker
+        self.limiter = AdaptiveLimiter(settings.SAP_STL_CONCURRENCY_INITIAL, settings.SAP_STL_CONCURRENCY_MIN,
+                                       settings.SAP_STL_CONCURRENCY_MAX, settings.SAP_STL_LATENCY_TARGET_MS)
+        self.breaker = CircuitBreaker(settings.SAP_STL_BREAKER_FAILURES, settings.SAP_STL_BREAKER_RESET_SECONDS)
         
         # Configuración para modo simulación
         self.use_mock_data = getattr(settings, 'USE_MOCK_SAP_DATA', False)
     
     async def login(self) -> bool:
         """Autenticación con la API STL"""
+        self.auth_stats['logins'] += 1
         try:
             logger.info(f"Intentando login en {self.base_url}/Auth/Login con usuario: {self.username}")
             
@@ -96,36 +107,63 @@ class SAPSTLClient:
             headers["Authorization"] = f"Bearer {self.token}"
         return headers
     
-    async def _ensure_authenticated(self) -> bool:
-        """Asegura que tenemos un token válido"""
-        if not self.token:
+    def _token_expiring(self) -> bool:
+        """True si el token vence dentro del margen de renovación (SAP_STL_TOKEN_REFRESH_MARGIN_SECONDS)"""
+        if not self.token_expiry:
+            return False
+        # Comparar en el mismo formato: UTC si la expiración trae timezone, hora local si no
+        now = datetime.now(timezone.utc) if self.token_expiry.tzinfo is not None else datetime.now()
+        return now + timedelta(seconds=settings.SAP_STL_TOKEN_REFRESH_MARGIN_SECONDS) >= self.token_expiry
+    
+    async def _refresh_token(self, stale_token: Optional[str]) -> bool:
+        """Login single-flight: si otro llamador renovó el token mientras se esperaba el lock, se reutiliza"""
+        async with self._auth_lock:
+            if self.token and self.token != stale_token and not self._token_expiring():
+                self.auth_stats['coalesced'] += 1
+                return True
+            if stale_token and self._token_expiring():
+                self.auth_stats['proactive_refreshes'] += 1
             return await self.login()
-        
-        if self.token_expiry:
-            # Asegurarse de que ambas fechas estén en el mismo formato
-            now = datetime.now()
-            if self.token_expiry.tzinfo is not None:
-                # Si token_expiry tiene timezone, convertir now a UTC
-                from datetime import timezone
-                now = now.replace(tzinfo=timezone.utc)
-            elif now.tzinfo is not None:
-                # Si now tiene timezone pero token_expiry no, quitar timezone de now
-                now = now.replace(tzinfo=None)
-            
-            if now >= self.token_expiry:
-                return await self.login()
-        
-        return True
     
-    async def _make_request(self, method: str, endpoint: str, **kwargs):
-        """Realiza petición HTTP con manejo de autenticación"""
+    async def _ensure_authenticated(self) -> bool:
+        """Asegura que tenemos un token válido (se renueva antes de que expire)"""
+        if self.token and not self._token_expiring():
+            return True
+        return await self._refresh_token(self.token)
+    
+    @asynccontextmanager
+    async def _call_slot(self, description: str):
+        """Turno para llamar a SAP: breaker + límite adaptativo; registra el resultado al salir"""
+        if not self.breaker.allow():
+            raise SAPUnavailableError(f"Circuito abierto, SAP-STL no disponible: {description}")
+        await self.limiter.acquire()
+        outcome = CallOutcome()
+        cancelled = False
         try:
-            logger.info(f"Haciendo petición {method} a {endpoint}")
-            
+            yield outcome
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # Sin código HTTP (timeout, error de red, login fallido) cuenta como sobrecarga
+            overloaded = not cancelled and is_overload(outcome.status_code)
+            if cancelled:
+                self.breaker.abandon()
+            else:
+                self.breaker.record(overloaded)
+            await self.limiter.release(outcome.latency_ms(), overloaded)
+    
+    async def _send(self, method: str, endpoint: str, **kwargs) -> Optional[httpx.Response]:
+        """Núcleo de las llamadas no streaming: autenticación, reintento ante 401, breaker y límite.
+        
+        Retorna None si no se pudo autenticar; lanza SAPUnavailableError si el circuito está abierto.
+        """
+        async with self._call_slot(f"{method} {endpoint}") as outcome:
             if not await self._ensure_authenticated():
                 logger.error("No se pudo autenticar con API SAP-STL")
                 return None
             
+            used_token = self.token
             headers = self._get_headers()
             if 'headers' in kwargs:
                 headers.update(kwargs['headers'])
@@ -135,21 +173,44 @@ class SAPSTLClient:
             logger.info(f"URL completa: {url}")
             
             response = await self.client.request(method, url, **kwargs)
+            outcome.received(response)
             logger.info(f"Respuesta: Status {response.status_code}")
             
             if response.status_code == 401:
                 # Token expirado, reautenticar
                 logger.info("Token expirado, reautenticando...")
-                self.token = None
-                if await self.login():
-                    headers = self._get_headers()
-                    kwargs['headers'] = headers
-                    response = await self.client.request(method, url, **kwargs)
-                    logger.info(f"Respuesta después de reauth: Status {response.status_code}")
-                else:
+                if not await self._refresh_token(used_token):
                     return None
+                headers.update(self._get_headers())
+                kwargs['headers'] = headers
+                response = await self.client.request(method, url, **kwargs)
+                outcome.received(response)
+                logger.info(f"Respuesta después de reauth: Status {response.status_code}")
+            
+            return response
+    
+    async def _make_request(self, method: str, endpoint: str, raw: bool = False, **kwargs):
+        """Realiza petición HTTP con manejo de autenticación (`raw`: retorna el cuerpo en bytes)"""
+        try:
+            logger.info(f"Haciendo petición {method} a {endpoint}")
+            
+            digest = PAYLOAD_DIGEST.get() if method == "GET" else None
+            if digest is not None:
+                await digest.begin(endpoint, kwargs.get('params'))
+            
+            response = await self._send(method, endpoint, **kwargs)
+            if response is None:
+                report_request_error(f"{endpoint}: sin autenticación")
+                return None
             
             if response.status_code in [200, 201]:
+                if digest is not None:
+                    digest.update(response.content)
+                    if digest.finish():
+                        return b'' if raw else []
+                if raw:
+                    logger.info(f"Contenido recibido: {len(response.content)} bytes")
+                    return response.content
                 content = response.json() if response.content else {}
                 if isinstance(content, list):
                     logger.info(f"Contenido recibido: {len(content)} elementos")
@@ -160,12 +221,139 @@ class SAPSTLClient:
                 return content
             else:
                 logger.error(f"Error en API SAP-STL: {response.status_code} - {response.text}")
+                report_request_error(f"{endpoint}: HTTP {response.status_code}")
                 return None
-                
+        
+        except SAPUnavailableError as e:
+            logger.error(str(e))
+            report_request_error(f"{endpoint}: {str(e)}")
+            return None
         except Exception as e:
             logger.error(f"Excepción en petición SAP-STL: {str(e)}", exc_info=True)
+            report_request_error(f"{endpoint}: {str(e)}")
             return None
     
+    async def _post_transaction(self, endpoint: str, label: str, body: bytes) -> Dict[str, Any]:
+        """POST de un documento (DeliveryNotes, GoodsReceipt) ya serializado y retorna la respuesta completa"""
+        try:
+            response = await self._send("POST", endpoint, content=body)
+            if response is None:
+                return {
+                    'success': False,
+                    'status_code': 401,
+                    'data': None,
+                    'message': 'No se pudo autenticar con API SAP-STL'
+                }
+            
+            success = response.status_code in [200, 201, 204]  # Solo códigos de éxito reales
+            
+            # Log detallado para debugging
+            logger.info(f"SAP {label} Response - Status: {response.status_code}, Success: {success}")
+            if response.text:
+                logger.info(f"SAP {label} Response Text: {response.text}")
+            else:
+                logger.info(f"SAP {label} Response: Sin contenido")
+            
+            return {
+                'success': success,
+                'status_code': response.status_code,
+                'data': response.json() if response.content else None,
+                'message': response.text if response.status_code not in [200, 201, 204] else 'OK'
+            }
+        except SAPUnavailableError as e:
+            logger.error(f"{label} no enviado: {str(e)}")
+            return {
+                'success': False,
+                'status_code': 503,
+                'data': None,
+                'message': str(e)
+            }
+        except Exception as e:
+            logger.error(f"Error creando {label}: {str(e)}")
+            return {
+                'success': False,
+                'status_code': 500,
+                'data': None,
+                'message': str(e)
+            }
+    
+    async def _stream_request(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Any]:
+        """GET en modo streaming: emite los elementos del arreglo JSON a medida que llegan.
+        
+        Si el API responde con error no emite nada; si la conexión se corta a mitad de
+        la descarga la excepción se propaga para que el consumidor descarte el lote parcial.
+        El turno del límite adaptativo se ocupa durante toda la descarga.
+        """
+        logger.info(f"Haciendo petición GET (streaming) a {endpoint}")
+        
+        digest = PAYLOAD_DIGEST.get()
+        if digest is not None:
+            await digest.begin(endpoint, params)
+        
+        try:
+            async with self._call_slot(f"GET {endpoint}") as outcome:
+                if not await self._ensure_authenticated():
+                    logger.error("No se pudo autenticar con API SAP-STL")
+                    report_request_error(f"{endpoint}: sin autenticación")
+                    return
+                
+                url = f"{self.base_url}/{endpoint.lstrip('/')}"
+                for attempt in range(2):
+                    used_token = self.token
+                    async with self.client.stream("GET", url, params=params, headers=self._get_headers()) as response:
+                        outcome.received(response)
+                        logger.info(f"Respuesta: Status {response.status_code}")
+                        
+                        if response.status_code == 401 and attempt == 0:
+                            # Token expirado, reautenticar y reintentar una vez
+                            logger.info("Token expirado, reautenticando...")
+                            if not await self._refresh_token(used_token):
+                                report_request_error(f"{endpoint}: sin autenticación")
+                                return
+                            continue
+                        
+                        if response.status_code not in [200, 201]:
+                            await response.aread()
+                            logger.error(f"Error en API SAP-STL: {response.status_code} - {response.text}")
+                            report_request_error(f"{endpoint}: HTTP {response.status_code}")
+                            return
+                        
+                        chunks = response.aiter_text()
+                        if digest is not None:
+                            chunks = await digest.read_ahead(chunks)
+                            if chunks is None:
+                                return
+                        count = 0
+                        async for element in iter_json_array(chunks):
+                            count += 1
+                            yield element
+                        logger.info(f"Contenido recibido (streaming): {count} elementos de {endpoint}")
+                        return
+        except SAPUnavailableError as e:
+            logger.error(str(e))
+            report_request_error(f"{endpoint}: {str(e)}")
+    
+    async def _stream_models(self, endpoint: str, model, mock_data: Optional[List[dict]] = None,
+                             params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Any]:
+        """Convierte cada elemento recibido en el modelo Pydantic indicado"""
+        source = aiter_list(mock_data) if mock_data is not None else self._stream_request(endpoint, params)
+        async for data in source:
+            yield model.model_validate(data)
+    
+    async def _get_models(self, endpoint: str, model, params: Optional[Dict[str, Any]] = None) -> Optional[List[Any]]:
+        """GET de un arreglo validado en bloque desde los bytes de la respuesta (None si no hay datos)"""
+        content = await self._make_request("GET", endpoint, raw=True, params=params)
+        if not content:
+            return None
+        models = decode_list(model, content)
+        if models is None:
+            logger.warning(f"La respuesta de {endpoint} no es un arreglo JSON")
+        elif not models:
+            logger.warning(f"API retornó lista vacía para {endpoint}")
+        else:
+            logger.info(f"Contenido recibido: {len(models)} elementos")
+        return models or None
+    
     # Endpoints de MasterData
     async def get_items(self) -> Optional[List[ItemSTL]]:
         """Obtiene todos los artículos"""
@@ -175,18 +363,19 @@ class SAPSTLClient:
             return [ItemSTL(**item) for item in mock_data]
         
         logger.info(f"Iniciando get_items desde {self.base_url}/MasterData/Items")
-        data = await self._make_request("GET", "/MasterData/Items")
+        items = await self._get_models("/MasterData/Items", ItemSTL)
         
-        if data:
-            logger.info(f"Items recibidos: {len(data) if isinstance(data, list) else 'No es lista'}")
-            if isinstance(data, list) and data:
-                logger.info(f"Primer item: {data[0]}")
+        if items:
+            logger.info(f"Items recibidos: {len(items)}")
+            logger.info(f"Primer item: {items[0]}")
         else:
             logger.warning("No se recibieron datos de items")
-        
-        if data and isinstance(data, list):
-            return [ItemSTL(**item) for item in data]
-        return None
+        return items
+    
+    def iter_items(self) -> AsyncIterator[ItemSTL]:
+        """Artículos en modo streaming (sin cargar la respuesta completa en memoria)"""
+        mock_data = mock_sap_stl_service.get_mock_items() if self.use_mock_data else None
+        return self._stream_models("/MasterData/Items", ItemSTL, mock_data)
     
     async def get_item_by_code(self, item_code: str) -> Optional[ItemSTL]:
         """Obtiene un artículo específico por código"""
@@ -196,7 +385,8 @@ class SAPSTLClient:
         return None
     
     # Endpoints de Transaction
-    async def get_orders(self, tipo_despacho: Optional[int] = None) -> Optional[List[DispatchSTL]]:
+    async def get_orders(self, tipo_despacho: Optional[int] = None,
+                         delta_params: Optional[Dict[str, Any]] = None) -> Optional[List[DispatchSTL]]:
         """Obtiene órdenes/despachos"""
         if self.use_mock_data:
             logger.info("Usando datos simulados para órdenes/despachos")
@@ -210,10 +400,21 @@ class SAPSTLClient:
         if tipo_despacho is not None:
             endpoint += f"?tipoDespacho={tipo_despacho}"
         
-        data = await self._make_request("GET", endpoint)
-        if data and isinstance(data, list):
-            return [DispatchSTL(**dispatch) for dispatch in data]
-        return None
+        return await self._get_models(endpoint, DispatchSTL, delta_params)
+    
+    def iter_orders(self, tipo_despacho: Optional[int] = None,
+                    delta_params: Optional[Dict[str, Any]] = None) -> AsyncIterator[DispatchSTL]:
+        """Órdenes/despachos en modo streaming"""
+        mock_data = None
+        if self.use_mock_data:
+            mock_data = mock_sap_stl_service.get_mock_orders()
+            if tipo_despacho is not None:
+                mock_data = [order for order in mock_data if order.get('tipoDespacho') == tipo_despacho]
+        
+        endpoint = "/Transaction/Orders"
+        if tipo_despacho is not None:
+            endpoint += f"?tipoDespacho={tipo_despacho}"
+        return self._stream_models(endpoint, DispatchSTL, mock_data, delta_params)
     
     async def get_order_by_id(self, tipo_despacho: int, doc_entry: int) -> Optional[DispatchSTL]:
         """Obtiene una orden específica"""
@@ -224,38 +425,10 @@ class SAPSTLClient:
     
     async def create_delivery_note(self, dispatch: DispatchSTL) -> Dict[str, Any]:
         """Crea una nota de entrega y retorna la respuesta completa"""
-        try:
-            response = await self.client.post(
-                f"{self.base_url}/Transaction/DeliveryNotes",
-                json=dispatch.dict(),
-                headers=self._get_headers()
-            )
-            
-            success = response.status_code in [200, 201, 204]  # Solo códigos de éxito reales
-            
-            # Log detallado para debugging
-            logger.info(f"SAP DeliveryNote Response - Status: {response.status_code}, Success: {success}")
-            if response.text:
-                logger.info(f"SAP DeliveryNote Response Text: {response.text}")
-            else:
-                logger.info("SAP DeliveryNote Response: Sin contenido")
-            
-            return {
-                'success': success,
-                'status_code': response.status_code,
-                'data': response.json() if response.content else None,
-                'message': response.text if response.status_code not in [200, 201, 204] else 'OK'
-            }
-        except Exception as e:
-            logger.error(f"Error creando DeliveryNote: {str(e)}")
-            return {
-                'success': False,
-                'status_code': 500,
-                'data': None,
-                'message': str(e)
-            }
+        return await self._post_transaction("/Transaction/DeliveryNotes", "DeliveryNote", encode(dispatch))
     
-    async def get_procurement_orders(self, tipo_recepcion: Optional[int] = None) -> Optional[List[GoodsReceiptSTL]]:
+    async def get_procurement_orders(self, tipo_recepcion: Optional[int] = None,
+                                     delta_params: Optional[Dict[str, Any]] = None) -> Optional[List[GoodsReceiptSTL]]:
         """Obtiene órdenes de compra"""
         if self.use_mock_data:
             logger.info("Usando datos simulados para órdenes de compra")
@@ -269,10 +442,21 @@ class SAPSTLClient:
         if tipo_recepcion is not None:
             endpoint += f"?tipoRecepcion={tipo_recepcion}"
         
-        data = await self._make_request("GET", endpoint)
-        if data and isinstance(data, list):
-            return [GoodsReceiptSTL(**receipt) for receipt in data]
-        return None
+        return await self._get_models(endpoint, GoodsReceiptSTL, delta_params)
+    
+    def iter_procurement_orders(self, tipo_recepcion: Optional[int] = None,
+                                delta_params: Optional[Dict[str, Any]] = None) -> AsyncIterator[GoodsReceiptSTL]:
+        """Órdenes de compra en modo streaming"""
+        mock_data = None
+        if self.use_mock_data:
+            mock_data = mock_sap_stl_service.get_mock_procurement_orders()
+            if tipo_recepcion is not None:
+                mock_data = [order for order in mock_data if order.get('tipoRecepcion') == tipo_recepcion]
+        
+        endpoint = "/Transaction/ProcurementOrders"
+        if tipo_recepcion is not None:
+            endpoint += f"?tipoRecepcion={tipo_recepcion}"
+        return self._stream_models(endpoint, GoodsReceiptSTL, mock_data, delta_params)
     
     async def get_procurement_order_by_id(self, tipo_recepcion: int, doc_entry: int) -> Optional[GoodsReceiptSTL]:
         """Obtiene una orden de compra específica"""
@@ -281,7 +465,8 @@ class SAPSTLClient:
             return GoodsReceiptSTL(**data)
         return None
     
-    async def get_goods_receipts(self, tipo_recepcion: Optional[int] = None) -> Optional[List[GoodsReceiptSTL]]:
+    async def get_goods_receipts(self, tipo_recepcion: Optional[int] = None,
+                                 delta_params: Optional[Dict[str, Any]] = None) -> Optional[List[GoodsReceiptSTL]]:
         """Obtiene recepciones de mercancía"""
         if self.use_mock_data:
             logger.info("Usando datos simulados para recepciones de mercancía")
@@ -295,43 +480,25 @@ class SAPSTLClient:
         if tipo_recepcion is not None:
             endpoint += f"?tipoRecepcion={tipo_recepcion}"
         
-        data = await self._make_request("GET", endpoint)
-        if data and isinstance(data, list):
-            return [GoodsReceiptSTL(**receipt) for receipt in data]
-        return None
+        return await self._get_models(endpoint, GoodsReceiptSTL, delta_params)
+    
+    def iter_goods_receipts(self, tipo_recepcion: Optional[int] = None,
+                            delta_params: Optional[Dict[str, Any]] = None) -> AsyncIterator[GoodsReceiptSTL]:
+        """Recepciones de mercancía en modo streaming"""
+        mock_data = None
+        if self.use_mock_data:
+            mock_data = mock_sap_stl_service.get_mock_goods_receipts()
+            if tipo_recepcion is not None:
+                mock_data = [receipt for receipt in mock_data if receipt.get('tipoRecepcion') == tipo_recepcion]
+        
+        endpoint = "/Transaction/GoodsReceipt"
+        if tipo_recepcion is not None:
+            endpoint += f"?tipoRecepcion={tipo_recepcion}"
+        return self._stream_models(endpoint, GoodsReceiptSTL, mock_data, delta_params)
     
     async def create_goods_receipt(self, receipt: GoodsReceiptSTL) -> Dict[str, Any]:
         """Crea una recepción de mercancía y retorna la respuesta completa"""
-        try:
-            response = await self.client.post(
-                f"{self.base_url}/Transaction/GoodsReceipt",
-                json=receipt.dict(),
-                headers=self._get_headers()
-            )
-            
-            success = response.status_code in [200, 201, 204]  # Solo códigos de éxito reales
-            
-            # Log detallado para debugging
-            logger.info(f"SAP GoodsReceipt Response - Status: {response.status_code}, Success: {success}")
-            if response.text:
-                logger.info(f"SAP GoodsReceipt Response Text: {response.text}")
-            else:
-                logger.info("SAP GoodsReceipt Response: Sin contenido")
-            
-            return {
-                'success': success,
-                'status_code': response.status_code,
-                'data': response.json() if response.content else None,
-                'message': response.text if response.status_code not in [200, 201, 204] else 'OK'
-            }
-        except Exception as e:
-            logger.error(f"Error creando GoodsReceipt: {str(e)}")
-            return {
-                'success': False,
-                'status_code': 500,
-                'data': None,
-                'message': str(e)
-            }
+        return await self._post_transaction("/Transaction/GoodsReceipt", "GoodsReceipt", encode(receipt))
     
     async def create_goods_return(self, receipt: GoodsReceiptSTL) -> Optional[List[GoodsReceiptSTL]]:
         """Crea una devolución de mercancía"""
@@ -355,6 +522,19 @@ class SAPSTLClient:
         data = await self._make_request("POST", "/Transaction/InventoryTransfer", json=transfer.dict())
         return data is not None
     
+    def transport_stats(self) -> Dict[str, Any]:
+        """Configuración del transporte, concurrencia, circuito, login y latencia por endpoint"""
+        return {
+            'http2': settings.SAP_STL_HTTP2 and http2_available(),
+            'max_connections': settings.SAP_STL_MAX_CONNECTIONS,
+            'max_keepalive': settings.SAP_STL_MAX_KEEPALIVE,
+            'token_expiry': self.token_expiry.isoformat() if self.token_expiry else None,
+            'auth': dict(self.auth_stats),
+            'concurrency': self.limiter.snapshot(),
+            'circuit': self.breaker.snapshot(),
+            'endpoints': self.metrics.snapshot()
+        }
+    
     async def close(self):
         """Cierra el cliente HTTP"""
         if self.client:
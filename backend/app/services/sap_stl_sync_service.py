@@ -4,7 +4,7 @@ from typing import Optional, Dict, Any, List
 import logging
 from contextlib import asynccontextmanager
 
-from app.core.database import FirebirdConnection
+from app.core.database import db
 from app.services.sap_stl_client import sap_stl_client
 from app.models.sap_stl_models import (
     ItemSTL, DispatchSTL, GoodsReceiptSTL, DispatchLineSTL, GoodsReceiptLineSTL
@@ -15,23 +15,18 @@ logger = logging.getLogger(__name__)
 
 class SAPSTLSyncService:
     def __init__(self):
-        self.db = FirebirdConnection()
+        self.db = db
         
     @asynccontextmanager
     async def get_db_connection(self):
         """Context manager para conexiones de base de datos"""
-        conn = None
         try:
-            conn = self.db.get_connection()
-            yield conn
+            # Conexión prestada por el pool compartido (rollback/devolución automáticos)
+            with self.db.get_connection() as conn:
+                yield conn
         except Exception as e:
-            if conn:
-                conn.rollback()
             logger.error(f"Error en conexión DB: {str(e)}")
             raise
-        finally:
-            if conn:
-                conn.close()
     
     async def log_sync_operation(self, entity_type: str, entity_id: str, entity_document: str, operation: str, 
                                 status: str, error_message: str = None, processing_time: int = None):
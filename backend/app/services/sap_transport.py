@@ -0,0 +1,288 @@
+"""
+Transporte HTTP compartido del cliente SAP-STL.
+
+- Un solo `httpx.AsyncClient` con el pool dimensionado de forma explícita
+  (SAP_STL_MAX_CONNECTIONS / SAP_STL_MAX_KEEPALIVE / SAP_STL_KEEPALIVE_EXPIRY) para que
+  las sincronizaciones y los envíos concurrentes reutilicen conexiones keep-alive.
+- HTTP/2 opcional (SAP_STL_HTTP2, requiere el paquete `h2`) y respuestas comprimidas
+  (gzip/deflate) negociadas con Accept-Encoding.
+- Histogramas de latencia por endpoint: tiempo hasta recibir los encabezados de la
+  respuesta (en streaming no incluye la descarga del cuerpo), medido con event hooks.
+- Límite de concurrencia adaptativo (AIMD) para todas las llamadas: crece de a uno por
+  ventana mientras SAP responde bajo SAP_STL_LATENCY_TARGET_MS y se reduce a la mitad
+  ante 5xx, 429, timeouts o latencias por encima del objetivo.
+- Circuit breaker: tras SAP_STL_BREAKER_FAILURES fallos seguidos las llamadas fallan de
+  inmediato durante SAP_STL_BREAKER_RESET_SECONDS; luego se deja pasar una petición de
+  prueba (half-open) que cierra el circuito si responde bien.
+"""
+import asyncio
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_MS: Tuple[int, ...] = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_STARTED = 'stl_started'
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+_NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_key(method: str, url: httpx.URL) -> str:
+    """Clave del histograma: método y ruta, con los segmentos numéricos como {id}"""
+    return f"{method} {_NUMERIC_SEGMENT.sub('/{id}', url.path)}"
+
+
+class LatencyHistogram:
+    """Histograma de latencias (ms) con cubetas fijas y conteo de códigos HTTP"""
+
+    def __init__(self, buckets: Tuple[int, ...] = LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.status: Counter = Counter()
+
+    def observe(self, elapsed_ms: float, status_code: int):
+        self.counts[bisect_left(self.buckets, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.status[status_code] += 1
+
+    def quantile(self, q: float) -> float:
+        """Cota superior de la cubeta que contiene el cuantil q (la última usa el máximo)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return float(min(self.buckets[index], self.max_ms)) if index < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {f"<={bound}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets[f">{self.buckets[-1]}"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 1) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.50), 1),
+            'p95_ms': round(self.quantile(0.95), 1),
+            'p99_ms': round(self.quantile(0.99), 1),
+            'max_ms': round(self.max_ms, 1),
+            'buckets_ms': buckets,
+            'status': dict(self.status),
+        }
+
+
+class TransportMetrics:
+    """Latencia por endpoint registrada con los event hooks del cliente httpx"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, LatencyHistogram] = {}
+
+    async def on_request(self, request: httpx.Request):
+        request.extensions[_STARTED] = time.perf_counter()
+
+    async def on_response(self, response: httpx.Response):
+        request = response.request
+        started = request.extensions.get(_STARTED)
+        if started is None:
+            return
+        key = endpoint_key(request.method, request.url)
+        histogram = self.endpoints.get(key)
+        if histogram is None:
+            histogram = self.endpoints[key] = LatencyHistogram()
+        histogram.observe((time.perf_counter() - started) * 1000, response.status_code)
+
+    def event_hooks(self) -> Dict[str, list]:
+        return {'request': [self.on_request], 'response': [self.on_response]}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {key: histogram.snapshot() for key, histogram in sorted(self.endpoints.items())}
+
+
+# Errores de las peticiones de la tarea en curso: el cliente retorna vacío ante un error y
+# quien necesita distinguir "sin datos" de "falló" (p.ej. las particiones del pipeline)
+# fija una lista aquí
+REQUEST_ERRORS: ContextVar[Optional[List[str]]] = ContextVar('request_errors', default=None)
+
+
+def report_request_error(message: str):
+    errors = REQUEST_ERRORS.get()
+    if errors is not None:
+        errors.append(message)
+
+
+class SAPUnavailableError(Exception):
+    """El circuito está abierto: SAP-STL no responde y la llamada no se intenta"""
+    pass
+
+
+def is_overload(status_code: Optional[int]) -> bool:
+    """Respuestas que indican que SAP está saturado o caído (None = timeout / error de red)"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class CallOutcome:
+    """Resultado de una llamada: código HTTP y latencia hasta los encabezados"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status_code: Optional[int] = None
+        self.elapsed_ms: Optional[float] = None
+
+    def received(self, response: httpx.Response):
+        self.status_code = response.status_code
+        self.elapsed_ms = (time.perf_counter() - self.started) * 1000
+
+    def latency_ms(self) -> float:
+        return self.elapsed_ms if self.elapsed_ms is not None else (time.perf_counter() - self.started) * 1000
+
+
+class AdaptiveLimiter:
+    """Límite de peticiones simultáneas con ajuste AIMD según latencia y errores"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target_ms: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target_ms = latency_target_ms
+        self.in_flight = 0
+        self.stats = {'increases': 0, 'decreases': 0, 'waits': 0}
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Se crea dentro del event loop (el cliente es una instancia global creada al importar)
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            if self.in_flight >= int(self.limit):
+                self.stats['waits'] += 1
+            while self.in_flight >= int(self.limit):
+                await condition.wait()
+            self.in_flight += 1
+
+    async def release(self, elapsed_ms: float, overloaded: bool):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or elapsed_ms > self.latency_target_ms:
+                # Una sola reducción por ventana (la latencia de la petición) aunque fallen varias a la vez
+                if self.limit > self.minimum and now - self._last_decrease >= elapsed_ms / 1000:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+                    self.stats['decreases'] += 1
+                    logger.warning(f"SAP-STL saturado (latencia {elapsed_ms:.0f} ms), concurrencia reducida a {int(self.limit)}")
+            elif (self.in_flight + 1) * 2 >= self.limit and self.limit < self.maximum:
+                # Aumento aditivo (+1 por ventana de peticiones exitosas), solo si el límite se está usando
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.stats['increases'] += 1
+            condition.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'limit': int(self.limit), 'in_flight': self.in_flight, 'minimum': self.minimum,
+                'maximum': self.maximum, 'latency_target_ms': self.latency_target_ms, **self.stats}
+
+
+class CircuitBreaker:
+    """Falla rápido mientras SAP está caído y lo sondea con una petición half-open"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """True si la petición puede salir; en half-open solo una prueba a la vez"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = HALF_OPEN
+            logger.info("Circuito SAP-STL en half-open: enviando petición de prueba")
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, overloaded: bool):
+        self._probe_in_flight = False
+        if not overloaded:
+            if self.state != CLOSED:
+                logger.info("Circuito SAP-STL cerrado: SAP responde de nuevo")
+            self.state = CLOSED
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.error(f"Circuito SAP-STL abierto tras {self.failures} fallos; reintento en {self.reset_seconds}s")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """La petición se canceló sin resultado: libera la prueba half-open sin contarla"""
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'state': self.state, 'consecutive_failures': self.failures, 'rejected': self.rejected}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_http_client(metrics: TransportMetrics) -> httpx.AsyncClient:
+    """Cliente httpx compartido con límites de pool, keep-alive y HTTP/2 opcional"""
+    http2 = settings.SAP_STL_HTTP2
+    if http2 and not http2_available():
+        logger.warning("SAP_STL_HTTP2 activo pero falta el paquete h2 (pip install 'httpx[http2]'); se usa HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        # Timeout aumentado a 120s para operaciones pesadas como sync masivo
+        timeout=httpx.Timeout(
+            connect=10.0,   # Tiempo para establecer conexión
+            read=120.0,     # Tiempo para leer respuesta (aumentado de 30s a 120s)
+            write=10.0,     # Tiempo para enviar datos
+            pool=10.0       # Tiempo para obtener conexión del pool
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.SAP_STL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.SAP_STL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.SAP_STL_KEEPALIVE_EXPIRY
+        ),
+        http2=http2,
+        headers={"Accept-Encoding": "gzip, deflate"},
+        event_hooks=metrics.event_hooks()
+    )
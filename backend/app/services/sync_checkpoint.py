@@ -0,0 +1,127 @@
+"""
+Checkpoints de sincronización para commits por bloques y reanudación.
+
+El pipeline confirma cada SYNC_COMMIT_CHUNK_SIZE registros y, en la misma transacción,
+registra en STL_SYNC_CHECKPOINT cuántos registros de la corrida quedaron aplicados y la
+clave natural del último. Si el proceso se reinicia a mitad de una sincronización, la
+siguiente corrida con el mismo alcance (modo y filtros) omite esos registros en lugar
+de volver a empezar. Al terminar la corrida el checkpoint se elimina.
+
+La reanudación asume que el API entrega los documentos en el mismo orden; se valida
+con la clave del último registro aplicado y, si no coincide, se aplica todo.
+"""
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_key(key: tuple) -> str:
+    return json.dumps(list(key), default=str)
+
+
+@dataclass
+class Checkpoint:
+    """Progreso confirmado de una corrida"""
+    entity: str
+    scope: str
+    chunk_index: int = 0
+    records_applied: int = 0
+    last_key: Optional[str] = None
+
+
+class SyncCheckpointStore:
+    """Lectura y escritura de STL_SYNC_CHECKPOINT (una fila por entidad).
+
+    `save` y `clear` usan el cursor de la transacción del bloque para que el checkpoint
+    se confirme junto con los datos.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, entity: str, scope: str) -> Optional[Checkpoint]:
+        """Checkpoint reanudable para la entidad y el alcance dados (None si no hay o expiró)"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT SCOPE, CHUNK_INDEX, RECORDS_APPLIED, LAST_KEY, UPDATED_AT
+                FROM STL_SYNC_CHECKPOINT
+                WHERE ENTITY_TYPE = ?
+            """, (entity.upper(),))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        stored_scope, chunk_index, records_applied, last_key, updated_at = row
+        if stored_scope != scope:
+            logger.info(f"Checkpoint de {entity} ignorado: otro alcance ({stored_scope})")
+            return None
+        if updated_at and datetime.now() - updated_at > timedelta(hours=settings.SYNC_CHECKPOINT_MAX_AGE_HOURS):
+            logger.info(f"Checkpoint de {entity} ignorado: expirado ({updated_at})")
+            return None
+        return Checkpoint(entity, scope, chunk_index or 0, records_applied or 0, last_key)
+
+    def save(self, cursor, checkpoint: Checkpoint):
+        now = datetime.now()
+        params = (checkpoint.scope, checkpoint.chunk_index, checkpoint.records_applied, checkpoint.last_key, now)
+        cursor.execute("""
+            UPDATE STL_SYNC_CHECKPOINT
+            SET SCOPE = ?, CHUNK_INDEX = ?, RECORDS_APPLIED = ?, LAST_KEY = ?, UPDATED_AT = ?
+            WHERE ENTITY_TYPE = ?
+        """, params + (checkpoint.entity.upper(),))
+        if cursor.rowcount == 0:
+            cursor.execute("""
+                INSERT INTO STL_SYNC_CHECKPOINT (SCOPE, CHUNK_INDEX, RECORDS_APPLIED, LAST_KEY, UPDATED_AT, ENTITY_TYPE)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, params + (checkpoint.entity.upper(),))
+
+    def clear(self, cursor, entity: str):
+        cursor.execute("DELETE FROM STL_SYNC_CHECKPOINT WHERE ENTITY_TYPE = ?", (entity.upper(),))
+
+
+class ResumeFilter:
+    """Omite los registros ya confirmados por la corrida interrumpida.
+
+    Los registros omitidos se retienen hasta llegar a la posición del checkpoint: si la
+    clave en esa posición no coincide (el API cambió el orden o el contenido) se
+    devuelven para aplicarlos igual.
+    """
+
+    def __init__(self, checkpoint: Checkpoint, key_of: Callable[[Any], tuple]):
+        self.remaining = checkpoint.records_applied
+        self.last_key = checkpoint.last_key
+        self.key_of = key_of
+        self.held: List[Any] = []
+        self.skipped = 0
+
+    @property
+    def active(self) -> bool:
+        return self.remaining > 0
+
+    def filter(self, records: List[Any]) -> List[Any]:
+        if not self.active:
+            return records
+        take = min(self.remaining, len(records))
+        self.held.extend(records[:take])
+        self.remaining -= take
+        rest = records[take:]
+        if self.active:
+            return rest
+        held, self.held = self.held, []
+        if held and serialize_key(self.key_of(held[-1])) == self.last_key:
+            self.skipped = len(held)
+            return rest
+        logger.warning(f"El checkpoint no coincide con los datos recibidos, se aplican los {len(held)} registros retenidos")
+        return held + rest
+
+    def finish(self) -> List[Any]:
+        """Registros retenidos si el API entregó menos registros que los del checkpoint"""
+        held, self.held, self.remaining = self.held, [], 0
+        if held:
+            logger.warning(f"La descarga terminó antes de la posición del checkpoint, se aplican {len(held)} registros")
+        return held
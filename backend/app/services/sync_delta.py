@@ -0,0 +1,206 @@
+"""
+Sincronización incremental (delta) SAP-STL -> Firebird.
+
+- Marca de agua (watermark) por entidad en STL_SYNC_CONFIG: una fecha o el numeroBusqueda
+  más alto aplicado con éxito.
+- Estrategia de filtro por entidad: si el endpoint acepta un parámetro de filtro se pide
+  solo lo posterior a la marca; si no, se hace la descarga completa de siempre.
+- Cada SYNC_FULL_RECONCILE_HOURS se fuerza una pasada completa para recoger cambios en
+  documentos anteriores a la marca.
+
+Configuración de filtros (SAP_STL_DELTA_FILTERS), por ejemplo::
+
+    dispatches=fechaDesde:date,goods_receipts=numeroDesde:number
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.services.sync_pipeline import parse_iso_date
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_DATE = 'DATE'
+WATERMARK_NUMBER = 'NUMBER'
+
+
+class FilterStrategy:
+    """Cómo pedirle al API solo los documentos posteriores a la marca"""
+    supports_delta = False
+    kind: Optional[str] = None
+
+    def params(self, watermark: Any) -> Dict[str, Any]:
+        return {}
+
+
+class FullPullStrategy(FilterStrategy):
+    """El endpoint no filtra: siempre se descarga la lista completa"""
+
+
+class QueryParamStrategy(FilterStrategy):
+    """Filtro por parámetro de query (p.ej. ?fechaDesde=2025-07-01T00:00:00)"""
+    supports_delta = True
+
+    def __init__(self, param: str, kind: str):
+        self.param = param
+        self.kind = kind
+
+    def params(self, watermark: Any) -> Dict[str, Any]:
+        if self.kind == WATERMARK_DATE:
+            return {self.param: watermark.strftime('%Y-%m-%dT%H:%M:%S')}
+        return {self.param: watermark}
+
+
+def parse_filter_config(raw: str) -> Dict[str, FilterStrategy]:
+    """Interpreta SAP_STL_DELTA_FILTERS (`entidad=parametro:date|number`, separados por coma)"""
+    strategies: Dict[str, FilterStrategy] = {}
+    for entry in (raw or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            entity, definition = entry.split('=', 1)
+            param, kind = definition.split(':', 1)
+            kind = kind.strip().upper()
+            if kind not in (WATERMARK_DATE, WATERMARK_NUMBER):
+                raise ValueError(kind)
+        except ValueError:
+            logger.warning(f"Filtro delta inválido ignorado: '{entry}'")
+            continue
+        strategies[entity.strip()] = QueryParamStrategy(param.strip(), kind)
+    return strategies
+
+
+@dataclass
+class SyncPlan:
+    """Qué tipo de pasada se hace para una entidad y con qué parámetros"""
+    entity: str
+    mode: str                                   # 'full' | 'delta'
+    reason: str
+    kind: Optional[str] = None                  # Tipo de marca que se va a registrar
+    watermark: Any = None                       # Marca vigente al iniciar
+    params: Dict[str, Any] = field(default_factory=dict)
+    new_watermark: Any = None                   # Máximo observado en esta pasada
+    attr: Optional[str] = None                  # Atributo del modelo SAP que alimenta la marca
+
+    def observe(self, records: Iterable[Any]):
+        """Actualiza el máximo observado con los registros recibidos"""
+        if not self.attr:
+            return
+        for record in records:
+            value = _watermark_value(getattr(record, self.attr, None), self.kind)
+            if value is not None and (self.new_watermark is None or value > self.new_watermark):
+                self.new_watermark = value
+
+
+def _watermark_value(value: Any, kind: Optional[str]):
+    if value is None or value == '':
+        return None
+    if kind == WATERMARK_DATE:
+        return parse_iso_date(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _serialize(value: Any, kind: str) -> str:
+    if kind == WATERMARK_DATE:
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    return str(value)
+
+
+def _deserialize(raw: Optional[str], kind: Optional[str]):
+    if not raw or not kind:
+        return None
+    try:
+        if kind == WATERMARK_DATE:
+            return datetime.strptime(raw, '%Y-%m-%dT%H:%M:%S')
+        return int(raw)
+    except ValueError:
+        logger.warning(f"Marca de agua ilegible '{raw}' ({kind}), se hará pasada completa")
+        return None
+
+
+class DeltaSyncPlanner:
+    """Decide entre pasada delta o completa y persiste la marca al terminar con éxito.
+
+    Los métodos son bloqueantes (fdb): el pipeline los llama a través del executor.
+    """
+
+    def __init__(self, db, strategies: Optional[Dict[str, FilterStrategy]] = None):
+        self.db = db
+        self.strategies = strategies if strategies is not None else parse_filter_config(settings.SAP_STL_DELTA_FILTERS)
+
+    def strategy_for(self, entity: str) -> FilterStrategy:
+        return self.strategies.get(entity, FullPullStrategy())
+
+    def _load(self, entity: str):
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT WATERMARK_KIND, WATERMARK_VALUE, LAST_FULL_SYNC_AT
+                FROM STL_SYNC_CONFIG
+                WHERE ENTITY_TYPE = ?
+            """, (entity.upper(),))
+            return cursor.fetchone()
+
+    def plan(self, entity: str, watermark_attrs: Dict[str, str], force_full: bool = False) -> SyncPlan:
+        strategy = self.strategy_for(entity)
+        # Con filtro se usa su tipo de marca; sin filtro se registra igual (fecha preferida)
+        kind = strategy.kind or (WATERMARK_DATE if WATERMARK_DATE in watermark_attrs else WATERMARK_NUMBER)
+        attr = watermark_attrs.get(kind)
+
+        if not settings.SYNC_DELTA_ENABLED or not attr:
+            return SyncPlan(entity, 'full', 'delta deshabilitado', kind, attr=attr)
+
+        try:
+            row = self._load(entity)
+        except Exception as e:
+            logger.warning(f"No se pudo leer la marca de agua de {entity}, pasada completa: {e}")
+            return SyncPlan(entity, 'full', 'marca no disponible', kind, attr=attr)
+
+        stored_kind, raw_value, last_full = row if row else (None, None, None)
+        watermark = _deserialize(raw_value, stored_kind) if stored_kind == kind else None
+
+        if force_full:
+            reason = 'pasada completa solicitada'
+        elif not strategy.supports_delta:
+            reason = 'el endpoint no admite filtro'
+        elif watermark is None:
+            reason = 'sin marca previa'
+        elif not last_full or datetime.now() - last_full >= timedelta(hours=settings.SYNC_FULL_RECONCILE_HOURS):
+            reason = 'reconciliación periódica'
+        else:
+            return SyncPlan(entity, 'delta', f'desde {_serialize(watermark, kind)}', kind, watermark,
+                            strategy.params(watermark), attr=attr)
+        return SyncPlan(entity, 'full', reason, kind, watermark, attr=attr)
+
+    def complete(self, plan: SyncPlan):
+        """Persiste la nueva marca (nunca retrocede) y la hora de la última pasada completa"""
+        value = plan.new_watermark
+        if plan.watermark is not None and (value is None or value < plan.watermark):
+            value = plan.watermark
+        if value is None and plan.mode != 'full':
+            return
+
+        now = datetime.now()
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            if plan.mode == 'full':
+                cursor.execute("""
+                    UPDATE STL_SYNC_CONFIG
+                    SET WATERMARK_KIND = ?, WATERMARK_VALUE = ?, LAST_FULL_SYNC_AT = ?, UPDATED_AT = ?
+                    WHERE ENTITY_TYPE = ?
+                """, (plan.kind, _serialize(value, plan.kind) if value is not None else None, now, now,
+                      plan.entity.upper()))
+            else:
+                cursor.execute("""
+                    UPDATE STL_SYNC_CONFIG
+                    SET WATERMARK_KIND = ?, WATERMARK_VALUE = ?, UPDATED_AT = ?
+                    WHERE ENTITY_TYPE = ?
+                """, (plan.kind, _serialize(value, plan.kind), now, plan.entity.upper()))
+            conn.commit()
+        logger.info(f"Marca de agua de {plan.entity} ({plan.mode}): {value}")
@@ -0,0 +1,110 @@
+"""
+Orquestador de sincronización multi-entidad.
+
+Las descargas del API SAP-STL de todas las entidades corren en paralelo (acotadas por
+SYNC_MAX_CONCURRENT_FETCHES); las escrituras en Firebird respetan `EntitySpec.depends_on`
+(p.ej. items antes que despachos y recepciones, cuyas líneas referencian productos).
+En streaming la descarga de una entidad con dependencias empieza cuando éstas quedaron
+aplicadas, para no retener en memoria la respuesta completa mientras espera.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.services.sync_pipeline import EntitySpec, EntitySyncPipeline
+
+logger = logging.getLogger(__name__)
+
+
+class SyncOrchestrator:
+    def __init__(self, pipeline: EntitySyncPipeline, specs: Dict[str, EntitySpec]):
+        self.pipeline = pipeline
+        self.specs = specs
+
+    def resolve_order(self, entities: List[str]) -> List[str]:
+        """Orden topológico de las entidades pedidas (las dependencias no pedidas se ignoran)"""
+        unknown = [name for name in entities if name not in self.specs]
+        if unknown:
+            raise ValueError(f"Entidades no registradas: {', '.join(unknown)}")
+
+        selected = set(entities)
+        order: List[str] = []
+        visiting = set()
+
+        def visit(name: str):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependencia circular en la entidad {name}")
+            visiting.add(name)
+            for dependency in self.specs[name].depends_on:
+                if dependency in selected:
+                    visit(dependency)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in entities:
+            visit(name)
+        return order
+
+    async def run(self, entities: Optional[List[str]] = None,
+                  filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                  max_concurrency: Optional[int] = None, force_full: bool = False) -> Dict[str, Any]:
+        """Sincroniza las entidades indicadas (todas si es None) y retorna un reporte combinado"""
+        start_time = datetime.now()
+        order = self.resolve_order(list(entities) if entities else list(self.specs))
+        filters = filters or {}
+        fetch_limiter = asyncio.Semaphore(max_concurrency or settings.SYNC_MAX_CONCURRENT_FETCHES)
+        applied = {name: asyncio.Event() for name in order}
+        report: Dict[str, Any] = {}
+
+        logger.info(f"Iniciando sincronización orquestada: {', '.join(order)}")
+
+        async def run_entity(name: str):
+            spec = self.specs[name]
+            dependencies = [applied[dep] for dep in spec.depends_on if dep in applied]
+
+            async def wait_for_dependencies():
+                for event in dependencies:
+                    await event.wait()
+
+            started = time.perf_counter()
+            try:
+                stats = await self.pipeline.run(
+                    spec,
+                    wait_for=wait_for_dependencies if dependencies else None,
+                    fetch_limiter=fetch_limiter,
+                    force_full=force_full,
+                    **filters.get(name, {})
+                )
+            except Exception as e:
+                # pipeline.run ya captura sus errores; esto cubre fallas inesperadas
+                logger.error(f"Error en sincronización orquestada de {name}: {str(e)}")
+                stats = {'errors': 1}
+            finally:
+                # Liberar a los dependientes aunque esta entidad haya fallado
+                applied[name].set()
+
+            report[name] = {
+                'stats': stats,
+                'mode': self.pipeline.last_modes.get(name, 'full'),
+                'duration_seconds': round(time.perf_counter() - started, 3),
+                'stages': {stage: round(seconds, 3)
+                           for stage, seconds in self.pipeline.last_metrics.get(name, {}).items()}
+            }
+
+        await asyncio.gather(*(run_entity(name) for name in order))
+
+        duration = datetime.now() - start_time
+        total_errors = sum(entry['stats'].get('errors', 0) for entry in report.values())
+        logger.info(f"Sincronización orquestada completada en {duration.total_seconds():.2f}s - Errores: {total_errors}")
+        return {
+            'started_at': start_time.isoformat(),
+            'duration_seconds': round(duration.total_seconds(), 3),
+            'order': order,
+            'entities': {name: report[name] for name in order},
+            'errors': total_errors
+        }
@@ -0,0 +1,1385 @@
+"""
+Pipeline genérico de sincronización SAP-STL -> Firebird.
+
+Cada entidad se describe con un EntitySpec (tabla, clave natural, campos hasheados,
+líneas hijas y generador) y se procesa con las mismas etapas:
+
+    fetch -> normalize -> fingerprint -> diff -> apply
+
+Las escrituras se hacen por lotes (executemany) y cada etapa queda cronometrada en
+`EntitySyncPipeline.last_metrics`. La corrida se confirma cada SYNC_COMMIT_CHUNK_SIZE
+registros con un checkpoint (app.services.sync_checkpoint) para reanudarla si el
+proceso se reinicia.
+
+Los cambios se detectan con huellas de 64 bits (app.core.fingerprint) guardadas en
+DATA_FP; las filas que aún solo tienen DATA_HASH (MD5 del esquema anterior) se
+comparan con ese esquema y, si no cambiaron, se migran reescribiendo solo DATA_FP.
+DATA_FP y DOC_FP los agrega la migración 003: sin esas columnas la sincronización no
+arranca y el error nombra la migración.
+
+Los documentos con líneas llevan además DOC_FP, una huella agregada de la cabecera y
+todas sus líneas: si coincide, el documento completo se omite sin consultar ni
+calcular sus líneas; el diff por línea solo corre para los documentos que cambiaron.
+
+Antes de todo eso, si el cuerpo de la respuesta es idéntico al de la última corrida
+aplicada (app.services.payload_digest) la corrida se omite sin construir modelos ni
+tocar la base, y queda registrada con `payload_unchanged = 1`.
+
+Las entidades con `shard` (pedidos por tipoDespacho, órdenes de compra por
+tipoRecepcion) hacen sus pasadas completas como una descarga por tipo en paralelo
+(hasta SYNC_SHARD_CONCURRENCY): cada tipo se transmite al pipeline apenas llega, con
+su propio checkpoint y digest, y un tipo lento o fallido no detiene a los demás.
+
+Lo guardado se busca en un índice compacto en memoria (app.core.key_index) en lugar
+de precargarlo con IN (...) por bloques: lo cargan las pasadas completas y las demás
+corridas lo reutilizan mientras siga válido. El índice de cada tabla se conserva
+entre corridas: cada escritura del pipeline lo actualiza con las
+filas tocadas (releídas por ID) y se valida al inicio con una marca (generador de
+IDs, generador de bajas y MAX(UPDATED_AT) por índice, sin scan; ver migración 008);
+si la tabla cambió por fuera, pasó
+SYNC_KEY_INDEX_MAX_AGE_MINUTES, o una corrida falló o escribió sin el índice, se
+descarta y se recarga con un solo scan. Las corridas sobre una misma tabla escriben
+de a una (TableWrites) y una clave que falta en el índice se confirma con una consulta
+por clave antes de insertarla.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.batch_loading import IN_CLAUSE_CHUNK_SIZE, chunked
+from app.core.config import settings
+from app.core.database import DatabaseExecutor, db_executor
+from app.core.fingerprint import document_fingerprint, fingerprint_record, is_current, legacy_hash
+from app.core.key_index import CompactKeyIndex, encode_key
+from app.core.json_stream import iter_batches
+from app.services.payload_digest import PAYLOAD_DIGEST, PayloadDigest, PayloadDigestStore
+from app.services.sap_transport import REQUEST_ERRORS
+from app.services.sync_checkpoint import Checkpoint, ResumeFilter, SyncCheckpointStore, serialize_key
+from app.services.sync_snapshot import SyncSnapshotStore
+
+logger = logging.getLogger(__name__)
+
+# Marca de fin de la descarga en la cola del modo streaming
+_END_OF_STREAM = object()
+
+# Filas por fetchmany al cargar el índice de claves
+KEY_INDEX_FETCH_SIZE = 5000
+
+# Migración que agrega DATA_FP / DOC_FP; sin ella el pipeline no escribe
+FINGERPRINT_MIGRATION = 'sql/migrations/003_compact_fingerprints.sql'
+
+# Migración del índice DESC de UPDATED_AT y los generadores de bajas; sin ella la marca usa COUNT(*)
+KEY_INDEX_MARKER_MIGRATION = 'sql/migrations/008_key_index_marker.sql'
+
+
+def parse_iso_date(iso_string_or_datetime) -> Optional[datetime]:
+    """Convierte string ISO o datetime a datetime para Firebird"""
+    if not iso_string_or_datetime:
+        return None
+
+    # Si ya es datetime, retornarlo directamente
+    if isinstance(iso_string_or_datetime, datetime):
+        return iso_string_or_datetime
+
+    # Si es string, parsearlo
+    if isinstance(iso_string_or_datetime, str):
+        try:
+            # Manejar diferentes formatos ISO
+            if 'T' in iso_string_or_datetime:
+                if iso_string_or_datetime.endswith('Z'):
+                    # Formato: 2025-07-02T00:00:00Z
+                    return datetime.strptime(iso_string_or_datetime, '%Y-%m-%dT%H:%M:%SZ')
+                else:
+                    # Formato: 2025-07-02T00:00:00
+                    return datetime.strptime(iso_string_or_datetime, '%Y-%m-%dT%H:%M:%S')
+            else:
+                # Formato: 2025-07-02
+                return datetime.strptime(iso_string_or_datetime, '%Y-%m-%d')
+        except ValueError as e:
+            logger.error(f"Error parseando fecha ISO '{iso_string_or_datetime}': {str(e)}")
+            return None
+
+    logger.warning(f"Tipo de fecha no esperado: {type(iso_string_or_datetime)}")
+    return None
+
+
+def execute_batched(conn, cursor, sql: str, rows: List[tuple], key_index: int = 0,
+                    batch_size: Optional[int] = None) -> Tuple[int, List[int]]:
+    """Ejecuta `sql` con executemany en lotes; si un lote falla, lo deshace hasta su
+    savepoint y reintenta fila por fila (cada una con su savepoint) para aislar los
+    registros con error.
+    La sentencia se prepara una vez por conexión (caché de sentencias del pool).
+    Retorna (filas_ok, posiciones_de_filas_con_error)"""
+    batch_size = batch_size or settings.SYNC_BATCH_SIZE
+    ok = 0
+    failed: List[int] = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        conn.savepoint('SP_SYNC_BATCH')
+        try:
+            conn.executemany_cached(sql, batch)
+            ok += len(batch)
+            continue
+        except Exception as e:
+            # executemany no es atómico: deshacer las filas del lote que sí se aplicaron
+            conn.rollback(savepoint='SP_SYNC_BATCH')
+            logger.warning(f"Lote de {len(batch)} filas falló ({str(e)}), reintentando fila por fila")
+
+        for offset, row in enumerate(batch):
+            conn.savepoint('SP_SYNC_ROW')
+            try:
+                conn.execute_cached(sql, row)
+                ok += 1
+            except Exception as e:
+                # Deshacer también lo que hayan escrito los triggers de la fila
+                conn.rollback(savepoint='SP_SYNC_ROW')
+                logger.error(f"Error procesando registro {row[key_index]}: {str(e)}")
+                failed.append(start + offset)
+    return ok, failed
+
+
+def stored_datetime(text: str) -> Optional[datetime]:
+    """Fecha guardada como texto (FECHA_CREACION y FECHA_CARGA de STL_DISPATCHES son VARCHAR):
+    '2025-07-02 08:30:00', con fracción de segundos ('.0000') o en ISO ('T', 'Z')"""
+    text = text.strip().replace('T', ' ').rstrip('Z').split('.')[0]
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def same_value(new: Any, old: Any) -> bool:
+    """Compara un valor del API con el guardado en Firebird (NUMERIC llega como Decimal)"""
+    if new == old:
+        return True
+    if isinstance(old, Decimal) and isinstance(new, (int, float)) and not isinstance(new, bool):
+        return old == Decimal(str(new))
+    if isinstance(new, datetime) and isinstance(old, str):
+        # Columna VARCHAR con una fecha: se comparan como fecha, no como texto
+        return stored_datetime(old) == new.replace(microsecond=0)
+    if isinstance(old, str) and isinstance(new, str):
+        # Columnas CHAR vienen rellenas con espacios
+        return old.rstrip() == new.rstrip()
+    return False
+
+
+@dataclass(frozen=True)
+class Column:
+    """Columna de la tabla destino y atributo del modelo SAP que la alimenta"""
+    name: str
+    attr: str
+    convert: Optional[Callable[[Any], Any]] = None
+    updatable: bool = True
+
+
+@dataclass(frozen=True)
+class LinesSpec:
+    """Líneas hijas de un documento (reconciliadas por LINE_NUM dentro de la cabecera)"""
+    table: str
+    parent_column: str
+    key_column: str
+    key_attr: str
+    columns: Tuple[Column, ...]
+    hashed_fields: Tuple[str, ...]
+    records_attr: str = 'lines'
+
+
+@dataclass(frozen=True)
+class ShardSpec:
+    """Partición de la descarga por un filtro del endpoint (p.ej. tipoDespacho)"""
+    filter: str                       # Argumento de fetch/stream (tipo_despacho, tipo_recepcion)
+    column: str                       # Columna de la tabla para descubrir los valores ya sincronizados
+    configured: Tuple[int, ...] = ()  # Valores conocidos de antemano (SYNC_SHARD_*_TYPES)
+
+
+def parse_shard_values(raw: str) -> Tuple[int, ...]:
+    """Interpreta SYNC_SHARD_*_TYPES (enteros separados por coma)"""
+    values = []
+    for entry in (raw or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            values.append(int(entry))
+        except ValueError:
+            logger.warning(f"Tipo de partición inválido ignorado: '{entry}'")
+    return tuple(values)
+
+
+@dataclass(frozen=True)
+class EntitySpec:
+    """Descripción declarativa de una entidad sincronizable"""
+    name: str                         # Nombre lógico (coincide con STL_SYNC_CONFIG.ENTITY_TYPE)
+    label: str                        # Texto para logs
+    table: str
+    generator: str                    # Generador de IDs de la tabla (reserva de bloques)
+    key_columns: Tuple[str, ...]      # Clave natural en la tabla
+    key_attrs: Tuple[str, ...]        # Clave natural en el modelo SAP
+    columns: Tuple[Column, ...]       # Columnas escritas (incluye la clave natural)
+    hashed_fields: Tuple[str, ...]    # Atributos que definen DATA_FP (y el DATA_HASH anterior)
+    fetch: Callable[..., Awaitable[Optional[List[Any]]]]
+    stream: Optional[Callable[..., AsyncIterator[Any]]] = None  # Variante streaming de fetch
+    depends_on: Tuple[str, ...] = ()  # Entidades que deben quedar aplicadas antes (orquestador)
+    # Atributos del modelo SAP para la marca de agua incremental: {'DATE': ..., 'NUMBER': ...}
+    watermark_attrs: Dict[str, str] = field(default_factory=dict)
+    lookup_column: Optional[str] = None   # Columna indexada para precargar con IN (...); None = scan completo
+    lines: Optional[LinesSpec] = None
+    normalize: Optional[Callable[[Any], Any]] = None  # Ajuste opcional del registro antes de hashear
+    shard: Optional[ShardSpec] = None     # Descarga en paralelo por tipo (pasadas completas)
+    delete_generator: Optional[str] = None  # Generador de bajas (trigger, migración 008) para la marca
+
+
+class NormalizedRecord:
+    """Registro listo para el diff: clave, valores por columna, huellas y líneas (modelos SAP por clave)"""
+    __slots__ = ('key', 'values', 'data_fp', 'source', 'lines', 'doc_fp', 'doc_current', 'failed')
+
+    def __init__(self, key: tuple, values: tuple, data_fp: int, source: Any, lines: Optional[dict],
+                 doc_fp: Optional[int] = None):
+        self.key = key
+        self.values = values
+        self.data_fp = data_fp
+        self.source = source
+        self.lines = lines
+        self.doc_fp = doc_fp
+        self.doc_current = False    # DOC_FP igual al guardado: no se tocan las líneas
+        self.failed = False         # Algún error en cabecera o líneas: no se guarda DOC_FP
+
+
+class WarmKeyIndex:
+    """Índice de claves de una tabla conservado entre corridas, con la marca que lo valida"""
+
+    def __init__(self, table: str, index: CompactKeyIndex, marker: tuple, scanned_at: Optional[float] = None,
+                 persisted: bool = False):
+        self.table = table
+        self.index = index
+        self.marker = marker
+        # Momento del último scan completo en Firebird (se conserva al cargarlo del snapshot)
+        self.scanned_at = time.time() if scanned_at is None else scanned_at
+        # Filas escritas desde el último guardado del snapshot, por clave
+        self.changes: Dict[tuple, tuple] = {}
+        self.persisted = persisted  # El snapshot tiene todas las filas (si no, se vuelca completo)
+        # Marca leída en la transacción de la última confirmación de la corrida en curso
+        self.written_marker: Optional[tuple] = None
+        # False si se descartó o pudo perder escrituras: no se vuelve a marcar
+        self.valid = True
+        # Las particiones de una misma tabla lo consultan y actualizan desde varios hilos
+        self.lock = threading.Lock()
+
+
+class TableWrites:
+    """Ventana de escritura de una corrida sobre su tabla.
+
+    Se abre justo antes de la primera escritura (después de `wait_for`): toma el lock de
+    la tabla y prepara el índice de claves, y los retiene hasta el final de la corrida.
+    Así dos corridas sobre la misma tabla (recepciones y órdenes de compra) no se cruzan
+    entre la validación del índice y su nueva marca.
+    """
+
+    def __init__(self, table_lock: asyncio.Lock, build: bool):
+        self.table_lock = table_lock
+        self.build = build              # La corrida puede construir el índice (pasada completa)
+        self.opening = asyncio.Lock()   # Las particiones de la corrida abren la misma ventana
+        self.opened = False
+        self.key_index: Optional[WarmKeyIndex] = None
+
+
+def record_key(spec: EntitySpec, record: Any) -> tuple:
+    """Clave natural de un modelo SAP (con el ajuste `normalize` de la entidad)"""
+    if spec.normalize:
+        record = spec.normalize(record)
+    return tuple(getattr(record, attr) for attr in spec.key_attrs)
+
+
+def new_stats(spec: EntitySpec) -> Dict[str, int]:
+    stats = {'inserted': 0, 'updated': 0, 'skipped': 0, 'fingerprints_migrated': 0, 'payload_unchanged': 0}
+    if spec.lines:
+        stats.update({'lines_inserted': 0, 'lines_updated': 0, 'lines_skipped': 0, 'documents_skipped': 0})
+    stats['errors'] = 0
+    return stats
+
+
+class EntitySyncPipeline:
+    """Ejecuta fetch -> normalize -> fingerprint -> diff -> apply para cualquier EntitySpec"""
+
+    def __init__(self, db, batch_size: Optional[int] = None, executor: Optional[DatabaseExecutor] = None,
+                 planner=None, checkpoints: Optional[SyncCheckpointStore] = None,
+                 payload_digests: Optional[PayloadDigestStore] = None,
+                 snapshots: Optional[SyncSnapshotStore] = None):
+        self.db = db
+        # Todo el trabajo fdb corre en el pool de hilos, nunca en el event loop
+        self.executor = executor or db_executor
+        self.batch_size = batch_size
+        # DeltaSyncPlanner opcional: decide pasada delta/completa y persiste la marca de agua
+        self.planner = planner
+        # Checkpoints por bloque confirmado (None = sin reanudación)
+        self.checkpoints = checkpoints
+        # Digest del contenido por endpoint y filtros (None = nunca se omite una corrida)
+        self.payload_digests = payload_digests
+        # Snapshot local del índice de claves (None = se recarga de Firebird al reiniciar)
+        self.snapshots = snapshots
+        self.last_metrics: Dict[str, Dict[str, float]] = {}
+        self.last_modes: Dict[str, str] = {}
+        # Valores de partición por entidad: (momento del descubrimiento, valores)
+        self._shard_values: Dict[str, Tuple[float, List[Any]]] = {}
+        # Índices de claves en memoria por tabla (ver WarmKeyIndex)
+        self._key_indexes: Dict[str, WarmKeyIndex] = {}
+        self._key_indexes_lock = threading.Lock()
+        # Lock de escritura por tabla (ver TableWrites)
+        self._table_locks: Dict[str, asyncio.Lock] = {}
+        # Tablas con las columnas de huella ya verificadas / ya reportadas sin ellas
+        self._fingerprint_tables: Set[str] = set()
+        self._fingerprint_reported: Set[str] = set()
+        # Tablas con el generador de bajas ya verificado / ya reportadas sin él
+        self._delete_generators: Set[str] = set()
+        self._delete_generators_reported: Set[str] = set()
+
+    @staticmethod
+    def _timed(timings: Dict[str, float], stage: str, started: float):
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - started)
+
+    # ------------------------------------------------------------------ run
+    async def run(self, spec: EntitySpec, wait_for: Optional[Callable[[], Awaitable[None]]] = None,
+                  fetch_limiter: Optional[asyncio.Semaphore] = None, force_full: bool = False,
+                  **filters) -> Dict[str, int]:
+        """Sincroniza la entidad completa y retorna las estadísticas.
+
+        `wait_for` se espera antes de la primera escritura (dependencias entre entidades;
+        en streaming, antes de la descarga) y `fetch_limiter` acota las descargas simultáneas; ambos los usa el orquestador.
+        `force_full` ignora la marca de agua y hace la pasada completa.
+        """
+        start_time = datetime.now()
+        stats = new_stats(spec)
+        timings: Dict[str, float] = {}
+        writes = None
+
+        try:
+            logger.info(f"Iniciando sincronización OPTIMIZADA de {spec.label}")
+            # Antes de descargar: sin la migración 003 no se puede escribir nada
+            await self.executor.run_with_connection(
+                lambda conn: self.require_fingerprint_columns(conn.cursor(), spec))
+            plan = await self._plan(spec, filters, force_full)
+            writes = self._table_writes(spec, filters, plan)
+            if plan and plan.params:
+                filters = {**filters, 'delta_params': plan.params}
+
+            shards, discovery = self._plan_shards(spec, filters, plan)
+            if shards:
+                received = await self._run_sharded(spec, shards, filters, stats, timings, wait_for, fetch_limiter,
+                                                   force_full, plan, writes)
+            else:
+                try:
+                    received = await self._run_once(spec, filters, stats, timings, wait_for, fetch_limiter,
+                                                    force_full, plan, writes)
+                finally:
+                    if discovery:
+                        await self._discover_shards(spec)
+
+            # La marca solo avanza si todo lo recibido quedó aplicado
+            if plan and received and not stats['errors']:
+                await self._complete_plan(plan)
+
+        except Exception as e:
+            logger.error(f"Error en sincronización de {spec.label}: {str(e)}")
+            stats['errors'] += 1
+
+        finally:
+            if writes:
+                await self._close_writes(spec, writes)
+            self.last_metrics[spec.name] = timings
+            duration = datetime.now() - start_time
+            stages = ', '.join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+            logger.info(f"Sincronización {spec.label} completada en {duration.total_seconds():.2f}s - Stats: {stats} - Etapas: {stages}")
+        return stats
+
+    async def _run_once(self, spec: EntitySpec, filters: dict, stats: Dict[str, int], timings: Dict[str, float],
+                        wait_for: Optional[Callable[[], Awaitable[None]]], fetch_limiter: Optional[asyncio.Semaphore],
+                        force_full: bool, plan, writes: Optional[TableWrites] = None) -> int:
+        """Una descarga (completa, delta o de una partición) aplicada; retorna los registros recibidos"""
+        checkpoint = await self._load_checkpoint(spec, filters)
+        # El cliente toma el digest de la ContextVar (la tarea de descarga la hereda)
+        digest = self._payload_digest(spec, plan, force_full)
+        digest_token = PAYLOAD_DIGEST.set(digest)
+        try:
+            if spec.stream and settings.SYNC_STREAMING_ENABLED:
+                received = await self._run_streaming(spec, filters, stats, timings, wait_for, fetch_limiter, plan,
+                                                     checkpoint, digest, writes)
+            else:
+                started = time.perf_counter()
+                async with fetch_limiter or nullcontext():
+                    records = await spec.fetch(**filters)
+                self._timed(timings, 'fetch', started)
+                if not records:
+                    if digest and digest.unchanged:
+                        stats['payload_unchanged'] = 1
+                    else:
+                        logger.warning(f"No se obtuvieron {spec.label} del API SAP-STL")
+                    return 0
+
+                logger.info(f"Obtenidos {len(records)} {spec.label} del API SAP-STL")
+                received = len(records)
+                if plan:
+                    plan.observe(records)
+
+                if wait_for:
+                    started = time.perf_counter()
+                    await wait_for()
+                    self._timed(timings, 'wait_dependencies', started)
+
+                key_index = await self._open_writes(spec, writes, timings) if writes else None
+                if digest:
+                    await digest.invalidate()
+                await self.executor.run(self._apply_and_commit, spec, records, stats, timings, checkpoint, key_index)
+        except Exception:
+            # El rollback descarta escrituras que el índice ya registró
+            if writes and writes.key_index:
+                self._discard_key_index(writes.key_index.table, writes.key_index)
+            raise
+        finally:
+            PAYLOAD_DIGEST.reset(digest_token)
+
+        # El digest solo se guarda si todo lo recibido quedó aplicado
+        if digest and received and not stats['errors']:
+            await self._store_digest(digest)
+        return received
+
+    # -------------------------------------------------------------- shards
+    def _plan_shards(self, spec: EntitySpec, filters: dict, plan) -> Tuple[Optional[List[Any]], bool]:
+        """Valores de partición para esta corrida y si toca una pasada sin particionar de descubrimiento.
+
+        Las particiones solo cubren los tipos conocidos (configurados o ya sincronizados):
+        cada SYNC_SHARD_DISCOVERY_HOURS (y en la primera corrida del proceso) se hace una
+        pasada sin particionar para traer tipos nuevos.
+        """
+        if not spec.shard or not settings.SYNC_SHARDED_FETCH_ENABLED:
+            return None, False
+        if filters.get(spec.shard.filter) is not None or (plan and plan.mode == 'delta'):
+            return None, False
+        discovered = self._shard_values.get(spec.name)
+        if discovered is None or time.monotonic() - discovered[0] >= settings.SYNC_SHARD_DISCOVERY_HOURS * 3600:
+            logger.info(f"Sincronización {spec.label}: pasada sin particionar para descubrir tipos")
+            return None, True
+        values = sorted(set(spec.shard.configured) | set(discovered[1]))
+        return values or None, False
+
+    async def _discover_shards(self, spec: EntitySpec):
+        """Tipos ya sincronizados en la tabla; si la consulta falla se usan solo los configurados"""
+        def distinct_values():
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT DISTINCT {spec.shard.column} FROM {spec.table} "
+                               f"WHERE {spec.shard.column} IS NOT NULL")
+                return [row[0] for row in cursor.fetchall()]
+
+        try:
+            values = await self.executor.run(distinct_values)
+        except Exception as e:
+            logger.warning(f"No se pudieron descubrir los tipos de {spec.label}: {str(e)}")
+            values = []
+        self._shard_values[spec.name] = (time.monotonic(), values)
+        logger.info(f"Particiones de {spec.label}: {sorted(set(spec.shard.configured) | set(values))}")
+
+    async def _run_sharded(self, spec: EntitySpec, shards: List[Any], filters: dict, stats: Dict[str, int],
+                           timings: Dict[str, float], wait_for: Optional[Callable[[], Awaitable[None]]],
+                           fetch_limiter: Optional[asyncio.Semaphore], force_full: bool, plan,
+                           writes: Optional[TableWrites] = None) -> int:
+        """Descarga y aplica cada tipo por separado, hasta SYNC_SHARD_CONCURRENCY a la vez.
+
+        Cada partición se transmite y confirma por su cuenta (checkpoint y digest propios):
+        un tipo lento o fallido no detiene a los demás, pero la marca de agua solo avanza
+        si todas terminaron sin errores.
+        """
+        limiter = asyncio.Semaphore(max(1, settings.SYNC_SHARD_CONCURRENCY))
+        results: Dict[Any, Dict[str, int]] = {}
+        received_total = 0
+
+        async def run_shard(value):
+            nonlocal received_total
+            shard_spec = replace(spec, name=f"{spec.name}:{value}", shard=None)
+            shard_stats = new_stats(spec)
+            shard_timings: Dict[str, float] = {}
+            started = time.perf_counter()
+            # El cliente retorna vacío ante un error de la API: se registra para no confundirlo con un tipo sin datos
+            request_errors: List[str] = []
+            REQUEST_ERRORS.set(request_errors)
+            async with limiter:
+                try:
+                    received_total += await self._run_once(shard_spec, {**filters, spec.shard.filter: value},
+                                                           shard_stats, shard_timings, wait_for, fetch_limiter,
+                                                           force_full, plan, writes)
+                    if request_errors:
+                        logger.error(f"Error en la partición {value} de {spec.label}: {request_errors[-1]}")
+                        shard_stats['errors'] += 1
+                except Exception as e:
+                    logger.error(f"Error en la partición {value} de {spec.label}: {str(e)}")
+                    shard_stats['errors'] += 1
+            results[value] = shard_stats
+            for stage, seconds in shard_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            logger.info(f"Partición {spec.shard.filter}={value} de {spec.label} en "
+                        f"{time.perf_counter() - started:.2f}s - Stats: {shard_stats}")
+
+        logger.info(f"Sincronización {spec.label} en {len(shards)} particiones por {spec.shard.filter}")
+        await asyncio.gather(*(run_shard(value) for value in shards))
+
+        for shard_stats in results.values():
+            for name, value in shard_stats.items():
+                stats[name] = stats.get(name, 0) + value
+        stats['shards'] = len(shards)
+        stats['shards_failed'] = sum(1 for shard_stats in results.values() if shard_stats['errors'])
+        return received_total
+
+    async def _plan(self, spec: EntitySpec, filters: dict, force_full: bool):
+        """Plan delta/completo; las corridas filtradas (p.ej. por tipo) no usan ni mueven la marca"""
+        if not self.planner or not spec.watermark_attrs:
+            self.last_modes[spec.name] = 'full'
+            return None
+        if any(value is not None for value in filters.values()):
+            self.last_modes[spec.name] = 'filtered'
+            return None
+        plan = await self.executor.run(self.planner.plan, spec.name, spec.watermark_attrs, force_full)
+        self.last_modes[spec.name] = plan.mode
+        logger.info(f"Sincronización {spec.label}: pasada {plan.mode} ({plan.reason})")
+        return plan
+
+    async def _load_checkpoint(self, spec: EntitySpec, filters: dict) -> Checkpoint:
+        """Checkpoint de la corrida: el guardado si hay uno reanudable para el mismo alcance, o uno nuevo"""
+        scope = json.dumps({'mode': self.last_modes.get(spec.name), **filters}, sort_keys=True, default=str)
+        if self.checkpoints and settings.SYNC_COMMIT_CHUNK_SIZE:
+            try:
+                stored = await self.executor.run(self.checkpoints.load, spec.name, scope)
+                if stored and stored.records_applied:
+                    logger.info(f"Reanudando sincronización de {spec.label} desde el registro "
+                                f"{stored.records_applied} (bloque {stored.chunk_index})")
+                    return stored
+            except Exception as e:
+                logger.warning(f"No se pudo leer el checkpoint de {spec.label}: {str(e)}")
+        return Checkpoint(spec.name, scope)
+
+    def _payload_digest(self, spec: EntitySpec, plan, force_full: bool) -> Optional[PayloadDigest]:
+        """Digest de contenido de la corrida; las pasadas delta no lo usan y las forzadas no omiten"""
+        if not self.payload_digests or not settings.SYNC_PAYLOAD_DIGEST_ENABLED:
+            return None
+        if plan and plan.mode == 'delta':
+            return None
+        return PayloadDigest(spec.name, self.payload_digests, self.executor, compare=not force_full)
+
+    async def _store_digest(self, digest: PayloadDigest):
+        """Guarda el digest; si falla, la próxima corrida simplemente no podrá omitirse"""
+        try:
+            await digest.commit()
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el digest de {digest.key}: {str(e)}")
+
+    async def _complete_plan(self, plan):
+        """Persiste la marca; si falla, la próxima corrida simplemente vuelve a pedir desde la anterior"""
+        try:
+            await self.executor.run(self.planner.complete, plan)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la marca de agua de {plan.entity}: {str(e)}")
+
+    # ------------------------------------------------------------ key index
+    def _table_writes(self, spec: EntitySpec, filters: dict, plan) -> TableWrites:
+        """Ventana de escritura de la corrida: solo las pasadas completas sin filtros construyen
+        el índice de claves, las demás usan el que esté en memoria o en el snapshot"""
+        build = (plan is None or plan.mode == 'full') and not any(value is not None for value in filters.values())
+        return TableWrites(self._table_locks.setdefault(spec.table, asyncio.Lock()), build)
+
+    async def _open_writes(self, spec: EntitySpec, writes: TableWrites,
+                           timings: Dict[str, float]) -> Optional[WarmKeyIndex]:
+        """Abre la ventana (una vez por corrida) y retorna su índice de claves"""
+        async with writes.opening:
+            if not writes.opened:
+                started = time.perf_counter()
+                await writes.table_lock.acquire()
+                writes.opened = True
+                self._timed(timings, 'wait_table', started)
+                writes.key_index = await self._key_index(spec, writes.build, timings)
+        return writes.key_index
+
+    async def _close_writes(self, spec: EntitySpec, writes: TableWrites):
+        """Deja el índice para la próxima corrida (o lo descarta) y libera la tabla"""
+        if not writes.opened:
+            return
+        try:
+            if writes.key_index:
+                await self._release_key_index(spec, writes.key_index)
+        finally:
+            writes.table_lock.release()
+
+    async def _key_index(self, spec: EntitySpec, build: bool, timings: Dict[str, float]) -> Optional[WarmKeyIndex]:
+        """Índice de claves de la corrida, validado con la tabla ya tomada por la ventana"""
+        if not settings.SYNC_KEY_INDEX_ENABLED:
+            return None
+        if not build and spec.table not in self._key_indexes and not self._snapshot_available(spec.table):
+            return None
+        started = time.perf_counter()
+        try:
+            entry = await self.executor.run(self._prepare_key_index, spec, build)
+        except Exception as e:
+            logger.warning(f"No se pudo preparar el índice de claves de {spec.label}: {str(e)}")
+            self._discard_key_index(spec.table)
+            return None
+        if entry:
+            entry.written_marker = None
+        self._timed(timings, 'key_index', started)
+        return entry
+
+    def _prepare_key_index(self, spec: EntitySpec, build: bool) -> Optional[WarmKeyIndex]:
+        """Valida el índice en memoria contra la marca de la tabla; si no sirve lo toma del snapshot
+        o lo recarga de Firebird (o lo descarta)"""
+        max_age = settings.SYNC_KEY_INDEX_MAX_AGE_MINUTES * 60
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            marker = self.key_index_marker(cursor, spec)
+            with self._key_indexes_lock:
+                entry = self._key_indexes.get(spec.table)
+            if entry:
+                if entry.marker == marker and time.time() - entry.scanned_at < max_age:
+                    return entry
+                self._discard_key_index(spec.table, entry)
+
+            started = time.perf_counter()
+            entry = self._load_snapshot(spec, marker, max_age)
+            source = 'snapshot'
+            if entry is None:
+                if not build:
+                    return None
+                # El snapshot guardado ya no sirve: se vuelca completo al liberar el índice nuevo
+                self._discard_snapshot(spec.table)
+                entry = WarmKeyIndex(spec.table, CompactKeyIndex(self.load_key_index_rows(cursor, spec)), marker)
+                source = 'Firebird'
+        with self._key_indexes_lock:
+            self._key_indexes[spec.table] = entry
+        logger.info(f"Índice de claves de {spec.table}: {len(entry.index)} filas, "
+                    f"{entry.index.nbytes() / 1024 / 1024:.1f} MB, cargado de {source} "
+                    f"en {time.perf_counter() - started:.2f}s")
+        return entry
+
+    def _snapshot_available(self, table: str) -> bool:
+        return bool(self.snapshots and settings.SYNC_SNAPSHOT_ENABLED and self.snapshots.available(table))
+
+    def _load_snapshot(self, spec: EntitySpec, marker: tuple, max_age: float) -> Optional[WarmKeyIndex]:
+        """Índice del snapshot si coincide con la marca y su último scan no está vencido"""
+        if not self._snapshot_available(spec.table):
+            return None
+        try:
+            loaded = self.snapshots.load(spec.table, marker)
+        except Exception as e:
+            logger.warning(f"No se pudo leer el snapshot de {spec.table}: {str(e)}")
+            return None
+        if loaded is None or time.time() - loaded[1] >= max_age:
+            return None
+        return WarmKeyIndex(spec.table, loaded[0], marker, scanned_at=loaded[1], persisted=True)
+
+    def key_index_marker(self, cursor, spec: EntitySpec) -> tuple:
+        """Marca de la tabla: generador de IDs (altas), generador de bajas y MAX(UPDATED_AT)
+        (cambios), en una consulta que no recorre la tabla (índice DESC de la migración 008).
+        Sin esa migración las bajas se cuentan con COUNT(*), que sí hace un scan completo;
+        esa marca tiene otra forma y nunca coincide con la indexada."""
+        if self._has_delete_generator(cursor, spec):
+            cursor.execute(f"SELECT GEN_ID({spec.generator}, 0), GEN_ID({spec.delete_generator}, 0), "
+                           f"(SELECT MAX(UPDATED_AT) FROM {spec.table}) FROM RDB$DATABASE")
+            generator, deletes, updated_at = cursor.fetchone()
+            return generator, deletes, updated_at
+        cursor.execute(f"SELECT GEN_ID({spec.generator}, 0) FROM RDB$DATABASE")
+        generator = cursor.fetchone()[0]
+        cursor.execute(f"SELECT COUNT(*), MAX(UPDATED_AT) FROM {spec.table}")
+        count, updated_at = cursor.fetchone()
+        return 'COUNT', generator, count, updated_at
+
+    def _has_delete_generator(self, cursor, spec: EntitySpec) -> bool:
+        """Verifica (una vez por tabla) que exista el generador de bajas; si falta, avisa una vez"""
+        if not spec.delete_generator:
+            return False
+        if spec.table in self._delete_generators:
+            return True
+        cursor.execute("SELECT 1 FROM RDB$GENERATORS WHERE RDB$GENERATOR_NAME = ?", (spec.delete_generator,))
+        if cursor.fetchone():
+            self._delete_generators.add(spec.table)
+            return True
+        if spec.table not in self._delete_generators_reported:
+            logger.warning(f"{spec.table}: falta {spec.delete_generator}; la marca del índice de claves "
+                           f"usa COUNT(*) (scan completo) hasta aplicar {KEY_INDEX_MARKER_MIGRATION}")
+            self._delete_generators_reported.add(spec.table)
+        return False
+
+    def load_key_index_rows(self, cursor, spec: EntitySpec):
+        """Scan completo de la tabla en bloques (clave, ID, DATA_FP, DATA_HASH, DOC_FP), sin armar una lista"""
+        cursor.execute(self._existing_select(spec))
+        while True:
+            rows = cursor.fetchmany(KEY_INDEX_FETCH_SIZE)
+            if not rows:
+                break
+            yield from self._index_rows(spec, rows)
+
+    @staticmethod
+    def _index_rows(spec: EntitySpec, rows):
+        """Filas de `_existing_select` -> (clave, ID, DATA_FP, DATA_HASH, DOC_FP)"""
+        key_width = len(spec.key_columns)
+        for row in rows:
+            yield (tuple(row[1:1 + key_width]), row[0]) + tuple(row[1 + key_width:])
+
+    async def _release_key_index(self, spec: EntitySpec, entry: WarmKeyIndex):
+        """Fija la marca leída junto con la última confirmación de la corrida (ChunkedApply)
+        para que la próxima pueda reutilizar el índice, y guarda en el snapshot las filas que
+        cambiaron.
+
+        Si durante la corrida el índice se descartó o reemplazó, o se escribió en la tabla
+        sin él, se descarta: nunca se vuelve a marcar un índice que pudo perder escrituras.
+        """
+        with self._key_indexes_lock:
+            keep = entry.valid and self._key_indexes.get(entry.table) is entry
+            if keep and entry.written_marker is not None:
+                entry.marker = entry.written_marker
+            entry.written_marker = None
+        if not keep:
+            self._discard_key_index(entry.table, entry)
+            return
+        if self.snapshots and settings.SYNC_SNAPSHOT_ENABLED:
+            await self.executor.run(self._save_snapshot, entry)
+
+    def _save_snapshot(self, entry: WarmKeyIndex):
+        """Escribe en el snapshot las filas cambiadas (o todas, si aún no tiene las de este índice)"""
+        with entry.lock:
+            if entry.persisted:
+                rows = [(encode_key(row[0]),) + tuple(row[1:]) for row in entry.changes.values()]
+            else:
+                rows = list(entry.index.encoded_rows())
+            entry.changes.clear()
+        started = time.perf_counter()
+        try:
+            self.snapshots.save(entry.table, entry.marker, entry.scanned_at, rows, full=not entry.persisted)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el snapshot de {entry.table}: {str(e)}")
+            entry.persisted = False
+            self._discard_snapshot(entry.table)
+            return
+        if not entry.valid:
+            # Se descartó mientras se guardaba (escritura sin índice): el snapshot tampoco sirve
+            self._discard_snapshot(entry.table)
+            return
+        logger.debug(f"Snapshot de {entry.table}: {len(rows)} filas guardadas "
+                     f"({'completo' if not entry.persisted else 'cambios'}) en {time.perf_counter() - started:.2f}s")
+        entry.persisted = True
+
+    def _discard_key_index(self, table: str, entry: Optional[WarmKeyIndex] = None):
+        """Quita el índice de la tabla (solo si sigue siendo `entry`, cuando se indica) y siempre
+        su snapshot: pudo guardarse desde el índice descartado"""
+        with self._key_indexes_lock:
+            if entry is not None:
+                entry.valid = False
+            current = self._key_indexes.get(table)
+            if current is not None and (entry is None or current is entry):
+                current.valid = False
+                del self._key_indexes[table]
+                logger.info(f"Índice de claves de {table} descartado")
+        self._discard_snapshot(table)
+
+    def _discard_snapshot(self, table: str):
+        if not self.snapshots:
+            return
+        try:
+            self.snapshots.discard(table)
+        except Exception as e:
+            logger.warning(f"No se pudo descartar el snapshot de {table}: {str(e)}")
+
+    async def _run_streaming(self, spec: EntitySpec, filters: dict, stats: Dict[str, int], timings: Dict[str, float],
+                             wait_for: Optional[Callable[[], Awaitable[None]]] = None,
+                             fetch_limiter: Optional[asyncio.Semaphore] = None, plan=None,
+                             checkpoint: Optional[Checkpoint] = None,
+                             digest: Optional[PayloadDigest] = None,
+                             writes: Optional[TableWrites] = None) -> int:
+        """Aplica la entidad en bloques de SYNC_STREAM_CHUNK_SIZE mientras se descarga.
+
+        La descarga corre en una tarea aparte que deja los bloques en una cola acotada a 2:
+        así sigue avanzando mientras se escribe el bloque anterior sin retener toda la
+        respuesta en memoria. Con dependencias (`wait_for`) la descarga empieza cuando ya
+        están aplicadas: detenida en `put` retendría la conexión HTTP y un cupo de
+        `fetch_limiter` que la dependencia puede necesitar. Se confirma cada
+        SYNC_COMMIT_CHUNK_SIZE registros: si la descarga se corta a mitad, el rollback de
+        get_connection solo descarta el bloque en curso y el checkpoint permite reanudar.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+        async def produce():
+            try:
+                async with fetch_limiter or nullcontext():
+                    async for batch in iter_batches(spec.stream(**filters), settings.SYNC_STREAM_CHUNK_SIZE):
+                        await queue.put(batch)
+                await queue.put(_END_OF_STREAM)
+            except Exception as e:
+                await queue.put(e)
+
+        if wait_for:
+            started = time.perf_counter()
+            await wait_for()
+            self._timed(timings, 'wait_dependencies', started)
+
+        producer = asyncio.create_task(produce())
+        received = 0
+        try:
+            key_index = await self._open_writes(spec, writes, timings) if writes else None
+            async with self.executor.connection() as conn:
+                cursor = await self.executor.run(conn.cursor)
+                chunks = ChunkedApply(self, conn, cursor, spec, stats, timings,
+                                      checkpoint or Checkpoint(spec.name, ''), key_index)
+                while True:
+                    started = time.perf_counter()
+                    batch = await queue.get()
+                    self._timed(timings, 'fetch', started)
+                    if batch is _END_OF_STREAM:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    if digest and not received:
+                        await digest.invalidate()
+                    received += len(batch)
+                    if plan:
+                        plan.observe(batch)
+                    await self.executor.run(chunks.feed, batch)
+
+                if not received:
+                    if digest and digest.unchanged:
+                        stats['payload_unchanged'] = 1
+                    else:
+                        logger.warning(f"No se obtuvieron {spec.label} del API SAP-STL")
+                    return 0
+
+                await self.executor.run(chunks.finish)
+        finally:
+            if not producer.done():
+                producer.cancel()
+        logger.info(f"Procesados {received} {spec.label} del API SAP-STL (streaming)")
+        return received
+
+    def _apply_and_commit(self, spec: EntitySpec, records: List[Any], stats: Dict[str, int], timings: Dict[str, float],
+                          checkpoint: Optional[Checkpoint] = None, key_index: Optional[WarmKeyIndex] = None):
+        """Aplica una lista completa confirmando por bloques (se ejecuta en el pool de hilos)"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            chunks = ChunkedApply(self, conn, cursor, spec, stats, timings, checkpoint or Checkpoint(spec.name, ''),
+                                  key_index)
+            chunks.feed(records)
+            chunks.finish()
+
+    def apply_records(self, conn, cursor, spec: EntitySpec, records: List[Any], stats: Dict[str, int],
+                      timings: Optional[Dict[str, float]] = None, key_index: Optional[WarmKeyIndex] = None):
+        """Etapas normalize/fingerprint/diff/apply sobre registros ya obtenidos (sin commit).
+
+        Con `key_index` lo guardado sale del índice en memoria y las filas escritas se
+        registran en él; las claves que no tiene se confirman con una consulta por clave
+        antes de insertarlas. Sin índice, el que hubiera en memoria para la tabla se descarta.
+        """
+        timings = {} if timings is None else timings
+        self.require_fingerprint_columns(cursor, spec)
+        started = time.perf_counter()
+        incoming = self.normalize(spec, records, stats)
+        self._timed(timings, 'normalize', started)
+
+        started = time.perf_counter()
+        if key_index:
+            with key_index.lock:
+                existing = key_index.index.lookup(incoming.keys())
+            missing = [key for key in incoming if key not in existing]
+            if missing:
+                # Una fila que el índice no tiene (escrita por fuera) se actualiza en lugar de duplicarse
+                found = self.load_existing(cursor, spec, missing)
+                found = {key: row for key, row in found.items() if key in incoming and key not in existing}
+                if found:
+                    logger.warning(f"Índice de claves de {spec.table} desactualizado: "
+                                   f"{len(found)} claves ya existían en la tabla")
+                    existing.update(found)
+                    key_index.valid = False
+        else:
+            self._discard_key_index(spec.table)
+            existing = self.load_existing(cursor, spec, list(incoming.keys()))
+        self._timed(timings, 'load', started)
+
+        started = time.perf_counter()
+        inserts, updates, migrated = self.diff(spec, incoming, existing, stats)
+        self._timed(timings, 'diff', started)
+
+        started = time.perf_counter()
+        parent_ids = self.apply(conn, cursor, spec, inserts, updates, existing, stats)
+        self.migrate_fingerprints(conn, cursor, spec.table, migrated, stats)
+        self._timed(timings, 'apply', started)
+
+        if spec.lines:
+            self.sync_lines(conn, cursor, spec, incoming, parent_ids, stats, timings)
+
+        if key_index:
+            started = time.perf_counter()
+            touched = {record_id for record_id, _ in updates} | {record_id for _, record_id in migrated}
+            touched.update(parent_ids[record.key] for record in inserts if record.key in parent_ids)
+            if spec.lines:
+                # DOC_FP se reescribe en todo documento que no se omitió completo
+                touched.update(parent_ids[key] for key, record in incoming.items()
+                               if key in parent_ids and not record.doc_current)
+            rows = self.load_rows_by_id(cursor, spec, list(touched))
+            with key_index.lock:
+                key_index.index.update(rows)
+                key_index.changes.update((row[0], row) for row in rows)
+            self._timed(timings, 'key_index', started)
+
+    # ------------------------------------------------------------ normalize
+    def normalize(self, spec: EntitySpec, records: List[Any], stats: Dict[str, int]) -> Dict[tuple, NormalizedRecord]:
+        """Convierte los modelos SAP a filas por columna; si la clave se repite, gana la última"""
+        incoming: Dict[tuple, NormalizedRecord] = {}
+        for record in records:
+            if spec.normalize:
+                record = spec.normalize(record)
+            key = tuple(getattr(record, attr) for attr in spec.key_attrs)
+            if any(part is None for part in key):
+                logger.warning(f"Registro de {spec.label} sin clave completa ignorado: {key}")
+                stats['errors'] += 1
+                continue
+            if key in incoming:
+                stats['skipped'] += 1
+
+            lines = None
+            doc_fp = None
+            if spec.lines:
+                # Valores y huella por línea se calculan después, solo si el documento cambió
+                source_lines = getattr(record, spec.lines.records_attr, None)
+                if source_lines:
+                    lines = {getattr(line, spec.lines.key_attr): line for line in source_lines}
+                doc_fp = self.document_fingerprint(spec, record, lines)
+
+            incoming[key] = NormalizedRecord(
+                key=key,
+                values=self._row_values(spec.columns, record),
+                data_fp=fingerprint_record(spec.hashed_fields, record),
+                source=record,
+                lines=lines,
+                doc_fp=doc_fp
+            )
+        return incoming
+
+    def _row_values(self, columns: Tuple[Column, ...], record: Any) -> tuple:
+        values = []
+        for column in columns:
+            value = getattr(record, column.attr)
+            if column.convert:
+                value = column.convert(value)
+            values.append(value)
+        return tuple(values)
+
+    # ---------------------------------------------------------- fingerprint
+    def legacy_hash(self, hashed_fields: Tuple[str, ...], record: Any) -> str:
+        """DATA_HASH del esquema anterior (solo para filas aún no migradas a DATA_FP)"""
+        return legacy_hash({attr: getattr(record, attr) for attr in hashed_fields})
+
+    def unchanged(self, hashed_fields: Tuple[str, ...], record: Any, fp: int,
+                  stored_fp: Optional[int], stored_hash: Optional[str]) -> Tuple[bool, bool]:
+        """Compara con lo guardado; retorna (sin_cambios, migrar_huella)"""
+        if is_current(stored_fp):
+            return fp == stored_fp, False
+        if stored_hash and self.legacy_hash(hashed_fields, record) == stored_hash.strip():
+            return True, True
+        return False, False
+
+    def document_fingerprint(self, spec: EntitySpec, record: Any, lines: Optional[dict]) -> int:
+        """Huella agregada de la cabecera y todas sus líneas (ordenadas por clave de línea)"""
+        line_spec = spec.lines
+        ordered = [lines[line_key] for line_key in sorted(lines, key=str)] if lines else None
+        return document_fingerprint(spec.hashed_fields, record,
+                                    (line_spec.key_attr,) + line_spec.hashed_fields, ordered)
+
+    # ----------------------------------------------------------------- diff
+    def require_fingerprint_columns(self, cursor, spec: EntitySpec):
+        """Verifica una vez por tabla que existan DATA_FP (y DOC_FP en cabeceras con líneas);
+        si faltan, la sincronización no arranca y el error nombra la migración 003"""
+        required = {spec.table: ('DATA_FP', 'DOC_FP') if spec.lines else ('DATA_FP',)}
+        if spec.lines:
+            required[spec.lines.table] = ('DATA_FP',)
+        for table, columns in required.items():
+            if table in self._fingerprint_tables:
+                continue
+            cursor.execute("SELECT RDB$FIELD_NAME FROM RDB$RELATION_FIELDS WHERE RDB$RELATION_NAME = ?", (table,))
+            present = {row[0].strip() for row in cursor.fetchall()}
+            missing = [column for column in columns if column not in present]
+            if missing:
+                message = (f"{table} no tiene {', '.join(missing)}: aplique {FINGERPRINT_MIGRATION} "
+                           f"(o SCHEMA_MIGRATIONS_ON_STARTUP=true) antes de sincronizar {spec.label}")
+                if table not in self._fingerprint_reported:
+                    logger.error(message)
+                    self._fingerprint_reported.add(table)
+                raise RuntimeError(message)
+            self._fingerprint_tables.add(table)
+
+    @staticmethod
+    def _existing_select(spec: EntitySpec) -> str:
+        doc_fp_column = 'DOC_FP' if spec.lines else 'NULL'
+        return f"SELECT ID, {', '.join(spec.key_columns)}, DATA_FP, DATA_HASH, {doc_fp_column} FROM {spec.table}"
+
+    def load_existing(self, cursor, spec: EntitySpec, keys: List[tuple]) -> Dict[tuple, tuple]:
+        """Precarga (ID, DATA_FP, DATA_HASH, DOC_FP) por clave natural con un scan o con IN (...) por bloques"""
+        select = self._existing_select(spec)
+        key_width = len(spec.key_columns)
+        existing: Dict[tuple, tuple] = {}
+
+        def collect(rows):
+            for row in rows:
+                existing[tuple(row[1:1 + key_width])] = (row[0],) + tuple(row[1 + key_width:])
+
+        if spec.lookup_column is None:
+            cursor.execute(select)
+            collect(cursor.fetchall())
+            return existing
+
+        position = spec.key_columns.index(spec.lookup_column)
+        lookup_values = sorted({key[position] for key in keys})
+        for chunk in chunked(lookup_values, IN_CLAUSE_CHUNK_SIZE):
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"{select} WHERE {spec.lookup_column} IN ({placeholders})", chunk)
+            collect(cursor.fetchall())
+        return existing
+
+    def load_rows_by_id(self, cursor, spec: EntitySpec, ids: List[int]) -> List[tuple]:
+        """(clave, ID, DATA_FP, DATA_HASH, DOC_FP) de las filas indicadas, para actualizar el índice"""
+        select = self._existing_select(spec)
+        rows = []
+        for chunk in chunked(sorted(ids), IN_CLAUSE_CHUNK_SIZE):
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"{select} WHERE ID IN ({placeholders})", chunk)
+            rows.extend(self._index_rows(spec, cursor.fetchall()))
+        return rows
+
+    def diff(self, spec: EntitySpec, incoming: Dict[tuple, NormalizedRecord],
+             existing: Dict[tuple, tuple], stats: Dict[str, int]):
+        """Separa inserts y updates; `migrated` son filas sin cambios cuya huella es del esquema anterior"""
+        inserts: List[NormalizedRecord] = []
+        updates: List[Tuple[int, NormalizedRecord]] = []
+        migrated: List[Tuple[int, int]] = []
+        for key, record in incoming.items():
+            if key not in existing:
+                inserts.append(record)
+                continue
+            record_id, stored_fp, stored_hash, stored_doc_fp = existing[key]
+            if record.doc_fp is not None and record.doc_fp == stored_doc_fp:
+                # Documento completo sin cambios: ni cabecera ni líneas
+                record.doc_current = True
+                stats['skipped'] += 1
+                stats['documents_skipped'] += 1
+                stats['lines_skipped'] += len(record.lines or ())
+                continue
+            unchanged, migrate = self.unchanged(spec.hashed_fields, record.source, record.data_fp,
+                                                stored_fp, stored_hash)
+            if not unchanged:
+                updates.append((record_id, record))
+            else:
+                # Sin cambios - NO tocar el registro para evitar triggers (salvo migrar la huella una vez)
+                stats['skipped'] += 1
+                if migrate:
+                    migrated.append((record.data_fp, record_id))
+        return inserts, updates, migrated
+
+    # ---------------------------------------------------------------- apply
+    def reserve_ids(self, cursor, generator: str, count: int) -> List[int]:
+        """Reserva un bloque de IDs del generador de forma atómica (seguro entre sesiones)"""
+        cursor.execute(f"SELECT GEN_ID({generator}, {int(count)}) FROM RDB$DATABASE")
+        last_id = cursor.fetchone()[0]
+        return list(range(last_id - count + 1, last_id + 1))
+
+    def apply(self, conn, cursor, spec: EntitySpec, inserts: List[NormalizedRecord],
+              updates: List[Tuple[int, NormalizedRecord]], existing: Dict[tuple, tuple],
+              stats: Dict[str, int]) -> Dict[tuple, int]:
+        """Aplica UPDATE/INSERT de cabeceras por lotes y retorna clave -> ID"""
+        now = datetime.now()
+        parent_ids = {key: value[0] for key, value in existing.items()}
+
+        if updates:
+            ok, unchanged, failed = self.update_changed_columns(
+                conn, cursor, spec.table, spec.columns,
+                [(record_id, record.values, record.data_fp) for record_id, record in updates],
+                ", UPDATED_AT = ?, SYNC_STATUS = 'SYNCED', LAST_SYNC_AT = ?", (now, now)
+            )
+            stats['updated'] += ok
+            stats['skipped'] += unchanged
+            stats['errors'] += len(failed)
+            for position in failed:
+                updates[position][1].failed = True
+
+        if inserts:
+            ids = self.reserve_ids(cursor, spec.generator, len(inserts))
+            column_names = ', '.join(column.name for column in spec.columns)
+            placeholders = ', '.join('?' * len(spec.columns))
+            sql = f"""
+                INSERT INTO {spec.table} (
+                    ID, {column_names}, SYNC_STATUS, LAST_SYNC_AT, DATA_FP
+                ) VALUES (?, {placeholders}, 'SYNCED', ?, ?)
+            """
+            rows = [(new_id,) + record.values + (now, record.data_fp) for new_id, record in zip(ids, inserts)]
+            ok, failed = execute_batched(conn, cursor, sql, rows, key_index=1, batch_size=self.batch_size)
+            stats['inserted'] += ok
+            stats['errors'] += len(failed)
+            failed_positions = set(failed)
+            for position, (new_id, record) in enumerate(zip(ids, inserts)):
+                if position not in failed_positions:
+                    parent_ids[record.key] = new_id
+
+        return parent_ids
+
+    def load_current_values(self, cursor, table: str, column_names: List[str], ids: List[int]) -> Dict[int, tuple]:
+        """Valores guardados de las columnas indicadas, por ID (solo para filas que cambiaron)"""
+        current: Dict[int, tuple] = {}
+        for chunk in chunked(sorted(ids), IN_CLAUSE_CHUNK_SIZE):
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"SELECT ID, {', '.join(column_names)} FROM {table} WHERE ID IN ({placeholders})", chunk)
+            for row in cursor.fetchall():
+                current[row[0]] = tuple(row[1:])
+        return current
+
+    def changed_columns(self, cursor, table: str, columns: Tuple[Column, ...],
+                        updates: List[Tuple[int, tuple, int]]) -> Dict[int, Tuple[int, ...]]:
+        """Índices de las columnas actualizables cuyo valor difiere del guardado, por ID"""
+        updatable = [i for i, column in enumerate(columns) if column.updatable]
+        current = self.load_current_values(cursor, table, [columns[i].name for i in updatable],
+                                           [row_id for row_id, _, _ in updates])
+        changed: Dict[int, Tuple[int, ...]] = {}
+        for row_id, values, _ in updates:
+            stored = current.get(row_id)
+            if stored is None:
+                changed[row_id] = tuple(updatable)
+            else:
+                changed[row_id] = tuple(i for i, old in zip(updatable, stored) if not same_value(values[i], old))
+        return changed
+
+    def update_changed_columns(self, conn, cursor, table: str, columns: Tuple[Column, ...],
+                               updates: List[Tuple[int, tuple, int]], extra_assignments: str = '',
+                               extra_values: tuple = ()) -> Tuple[int, int, List[int]]:
+        """UPDATE de solo las columnas que cambiaron, en lotes agrupados por conjunto de columnas.
+
+        `updates` son (ID, valores, huella). Cada UPDATE crea una versión completa del
+        registro en Firebird y dispara los triggers: si ninguna columna cambió de verdad
+        (p.ej. solo el formato de un valor) se escribe únicamente la huella, sin
+        `extra_assignments`. Retorna (actualizadas, solo_huella, posiciones_con_error).
+        """
+        changed = self.changed_columns(cursor, table, columns, updates)
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for position, (row_id, _, _) in enumerate(updates):
+            groups.setdefault(changed[row_id], []).append(position)
+
+        updated = fingerprint_only = 0
+        failed: List[int] = []
+        for column_set, positions in groups.items():
+            if column_set:
+                assignments = ', '.join(f"{columns[i].name} = ?" for i in column_set)
+                sql = f"UPDATE {table} SET {assignments}{extra_assignments}, DATA_FP = ?, DATA_HASH = NULL WHERE ID = ?"
+                rows = [tuple(updates[p][1][i] for i in column_set) + extra_values + (updates[p][2], updates[p][0])
+                        for p in positions]
+            else:
+                sql = f"UPDATE {table} SET DATA_FP = ?, DATA_HASH = NULL WHERE ID = ?"
+                rows = [(updates[p][2], updates[p][0]) for p in positions]
+            ok, group_failed = execute_batched(conn, cursor, sql, rows, key_index=-1, batch_size=self.batch_size)
+            if column_set:
+                updated += ok
+            else:
+                fingerprint_only += ok
+            failed.extend(positions[i] for i in group_failed)
+        logger.debug(f"UPDATE por columnas en {table}: {len(updates)} filas en {len(groups)} grupos")
+        return updated, fingerprint_only, failed
+
+    def migrate_fingerprints(self, conn, cursor, table: str, rows: List[Tuple[int, int]], stats: Dict[str, int]):
+        """Migración perezosa: escribe DATA_FP (y libera DATA_HASH) en filas sin cambios del esquema anterior"""
+        if not rows:
+            return
+        ok, _ = execute_batched(conn, cursor, f"UPDATE {table} SET DATA_FP = ?, DATA_HASH = NULL WHERE ID = ?",
+                                rows, key_index=-1, batch_size=self.batch_size)
+        stats['fingerprints_migrated'] += ok
+
+    # ---------------------------------------------------------------- lines
+    def load_existing_lines(self, cursor, lines: LinesSpec, parent_ids: List[int]) -> Dict[int, Dict[Any, tuple]]:
+        """(ID, DATA_FP, DATA_HASH) de las líneas existentes por cabecera y clave de línea"""
+        existing: Dict[int, Dict[Any, tuple]] = {}
+        for chunk in chunked(sorted(parent_ids), IN_CLAUSE_CHUNK_SIZE):
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"""
+                SELECT {lines.parent_column}, ID, {lines.key_column}, DATA_FP, DATA_HASH
+                FROM {lines.table}
+                WHERE {lines.parent_column} IN ({placeholders})
+            """, chunk)
+            for row in cursor.fetchall():
+                existing.setdefault(row[0], {})[row[2]] = (row[1], row[3], row[4])
+        return existing
+
+    def sync_lines(self, conn, cursor, spec: EntitySpec, incoming: Dict[tuple, NormalizedRecord],
+                   parent_ids: Dict[tuple, int], stats: Dict[str, int], timings: Dict[str, float]):
+        lines = spec.lines
+        started = time.perf_counter()
+        # Solo documentos cuyo DOC_FP cambió (o nuevos)
+        changed = {parent_ids[key]: record for key, record in incoming.items()
+                   if key in parent_ids and not record.doc_current}
+        with_lines = {parent_id: record for parent_id, record in changed.items() if record.lines}
+        existing = self.load_existing_lines(cursor, lines, list(with_lines.keys()))
+        self._timed(timings, 'lines_load', started)
+
+        started = time.perf_counter()
+        inserts, updates, deletes, migrated = [], [], [], []
+        # Documento al que pertenece cada fila, para no guardar DOC_FP si alguna falla
+        update_parents, delete_parents = [], []
+        for parent_id, record in with_lines.items():
+            current = existing.get(parent_id, {})
+            for line_key, line in record.lines.items():
+                values = self._row_values(lines.columns, line)
+                line_fp = fingerprint_record(lines.hashed_fields, line)
+                if line_key in current:
+                    line_id, stored_fp, stored_hash = current[line_key]
+                    unchanged, migrate = self.unchanged(lines.hashed_fields, line, line_fp, stored_fp, stored_hash)
+                    if not unchanged:
+                        updates.append((line_id, values, line_fp))
+                        update_parents.append(parent_id)
+                    else:
+                        stats['lines_skipped'] += 1
+                        if migrate:
+                            migrated.append((line_fp, line_id))
+                else:
+                    inserts.append((parent_id,) + values + (line_fp,))
+
+            # Eliminar líneas que ya no existen en el API
+            for line_key, (line_id, _, _) in current.items():
+                if line_key not in record.lines:
+                    deletes.append((line_id,))
+                    delete_parents.append(parent_id)
+        self._timed(timings, 'lines_diff', started)
+
+        started = time.perf_counter()
+        failed_parents = set()
+        if updates:
+            ok, unchanged, failed = self.update_changed_columns(conn, cursor, lines.table, lines.columns, updates)
+            stats['lines_updated'] += ok
+            stats['lines_skipped'] += unchanged
+            stats['errors'] += len(failed)
+            failed_parents.update(update_parents[position] for position in failed)
+
+        if inserts:
+            column_names = ', '.join(column.name for column in lines.columns)
+            placeholders = ', '.join('?' * len(lines.columns))
+            sql = f"""
+                INSERT INTO {lines.table} (
+                    {lines.parent_column}, {column_names}, DATA_FP
+                ) VALUES (?, {placeholders}, ?)
+            """
+            ok, failed = execute_batched(conn, cursor, sql, inserts, key_index=0, batch_size=self.batch_size)
+            stats['lines_inserted'] += ok
+            stats['errors'] += len(failed)
+            failed_parents.update(inserts[position][0] for position in failed)
+
+        if deletes:
+            _, failed = execute_batched(conn, cursor, f"DELETE FROM {lines.table} WHERE ID = ?", deletes,
+                                        key_index=0, batch_size=self.batch_size)
+            stats['errors'] += len(failed)
+            failed_parents.update(delete_parents[position] for position in failed)
+
+        self.migrate_fingerprints(conn, cursor, lines.table, migrated, stats)
+        self.store_document_fingerprints(conn, cursor, spec, changed, failed_parents)
+        self._timed(timings, 'lines_apply', started)
+
+    def store_document_fingerprints(self, conn, cursor, spec: EntitySpec, changed: Dict[int, NormalizedRecord],
+                                    failed_parents: set):
+        """Guarda DOC_FP de los documentos aplicados sin errores (con error queda el anterior y se reintenta).
+
+        Si esta escritura falla los datos igual quedan correctos: solo se pierde el atajo
+        en la próxima corrida, por eso no cuenta como error de sincronización.
+        """
+        rows = [(record.doc_fp, parent_id) for parent_id, record in changed.items()
+                if record.doc_fp is not None and not record.failed and parent_id not in failed_parents]
+        if rows:
+            execute_batched(conn, cursor, f"UPDATE {spec.table} SET DOC_FP = ? WHERE ID = ?", rows,
+                            key_index=-1, batch_size=self.batch_size)
+
+
+class ChunkedApply:
+    """Aplica una corrida en bloques de SYNC_COMMIT_CHUNK_SIZE registros, cada uno confirmado
+    junto con su checkpoint (0 = una sola transacción). Se usa desde el pool de hilos."""
+
+    def __init__(self, pipeline: EntitySyncPipeline, conn, cursor, spec: EntitySpec, stats: Dict[str, int],
+                 timings: Dict[str, float], checkpoint: Checkpoint, key_index: Optional[WarmKeyIndex] = None):
+        self.pipeline = pipeline
+        self.conn = conn
+        self.cursor = cursor
+        self.spec = spec
+        self.stats = stats
+        self.timings = timings
+        self.key_index = key_index
+        self.commit_size = settings.SYNC_COMMIT_CHUNK_SIZE
+        self.store = pipeline.checkpoints if self.commit_size else None
+        self.checkpoint = checkpoint
+        self.resume = (ResumeFilter(checkpoint, lambda record: record_key(spec, record))
+                       if checkpoint.records_applied else None)
+        self.base_position = 0
+        self.applied = 0
+        self.pending = 0
+        self.last_record = None
+
+    def feed(self, records: List[Any]):
+        if self.resume and self.resume.active:
+            records = self.resume.filter(records)
+            self.base_position = self.resume.skipped
+            if self.resume.skipped:
+                self.stats['resumed'] = self.resume.skipped
+        self._apply(records)
+
+    def finish(self):
+        """Aplica lo retenido por la reanudación, elimina el checkpoint y confirma el último bloque"""
+        if self.resume:
+            self._apply(self.resume.finish())
+        if self.store:
+            try:
+                self.store.clear(self.cursor, self.spec.name)
+            except Exception as e:
+                logger.warning(f"No se pudo eliminar el checkpoint de {self.spec.label}: {str(e)}")
+        if self.key_index:
+            self._mark_key_index()
+        self._commit()
+
+    def _apply(self, records: List[Any]):
+        for part in chunked(records, self.commit_size or len(records) or 1):
+            self.pipeline.apply_records(self.conn, self.cursor, self.spec, part, self.stats, self.timings,
+                                        self.key_index)
+            self.applied += len(part)
+            self.pending += len(part)
+            self.last_record = part[-1]
+            if self.commit_size and self.pending >= self.commit_size:
+                self._save_checkpoint()
+                self._commit()
+
+    def _mark_key_index(self):
+        """Marca leída en la transacción de la última confirmación: incluye todo lo que escribió
+        la corrida, y lo que otra transacción confirme después la deja desactualizada"""
+        try:
+            marker = self.pipeline.key_index_marker(self.cursor, self.spec)
+        except Exception as e:
+            logger.warning(f"No se pudo leer la marca del índice de {self.spec.label}: {str(e)}")
+            self.key_index.valid = False
+            return
+        self.key_index.written_marker = marker
+
+    def _save_checkpoint(self):
+        if not self.store or self.last_record is None:
+            return
+        checkpoint = self.checkpoint
+        checkpoint.chunk_index += 1
+        checkpoint.records_applied = self.base_position + self.applied
+        checkpoint.last_key = serialize_key(record_key(self.spec, self.last_record))
+        try:
+            self.store.save(self.cursor, checkpoint)
+        except Exception as e:
+            # Sin tabla de checkpoints se sigue confirmando por bloques, solo sin reanudación
+            logger.warning(f"No se pudo guardar el checkpoint de {self.spec.label}: {str(e)}")
+            self.store = None
+
+    def _commit(self):
+        started = time.perf_counter()
+        self.conn.commit()
+        self.pending = 0
+        self.pipeline._timed(self.timings, 'commit', started)
@@ -0,0 +1,121 @@
+"""
+Snapshot local del índice de claves de sincronización (app.core.key_index).
+
+El índice en memoria se pierde al reiniciar el proceso y la primera corrida tendría
+que volver a leer las tablas completas de Firebird. Este snapshot lo guarda en un
+archivo SQLite junto a logs/ (SYNC_SNAPSHOT_PATH, por defecto stlw/state/sync_snapshot.db):
+por tabla, las filas (clave codificada, ID, DATA_FP, DATA_HASH, DOC_FP) y la marca de
+Firebird con la que coinciden (generador de IDs, generador de bajas y MAX(UPDATED_AT);
+ver EntitySyncPipeline.key_index_marker).
+
+- Tras cada corrida el pipeline escribe solo las filas que tocó, junto con la nueva
+  marca, en una sola transacción SQLite; el volcado completo solo ocurre después de un
+  scan de Firebird.
+- Al cargar solo sirve si la marca coincide con la actual y el último scan completo
+  no supera SYNC_KEY_INDEX_MAX_AGE_MINUTES; si no, se descarta.
+- Solo se guarda desde un índice que la corrida dejó válido, y se descarta cada vez
+  que el índice en memoria se descarta o se reemplaza (p.ej. tras una escritura sin
+  índice, como sincronizar un solo despacho); el índice nuevo lo vuelve a volcar completo.
+- Un error del archivo solo desactiva el atajo: Firebird sigue siendo la fuente.
+"""
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Set, Tuple
+
+from app.core.key_index import CompactKeyIndex
+
+# stlw/state, junto a stlw/logs
+DEFAULT_SNAPSHOT_PATH = Path(__file__).parent.parent.parent.parent / "state" / "sync_snapshot.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS SNAPSHOT_META (
+    TABLE_NAME TEXT PRIMARY KEY,
+    MARKER TEXT NOT NULL,
+    SCANNED_AT REAL NOT NULL,
+    SAVED_AT REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS SNAPSHOT_ROWS (
+    TABLE_NAME TEXT NOT NULL,
+    KEY BLOB NOT NULL,
+    ID INTEGER NOT NULL,
+    DATA_FP INTEGER,
+    DATA_HASH TEXT,
+    DOC_FP INTEGER,
+    PRIMARY KEY (TABLE_NAME, KEY)
+) WITHOUT ROWID;
+"""
+
+
+def serialize_marker(marker: tuple) -> str:
+    return json.dumps(list(marker), default=str)
+
+
+class SyncSnapshotStore:
+    """Lectura y escritura del archivo SQLite del snapshot (una conexión por operación)"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else DEFAULT_SNAPSHOT_PATH
+        self._ready = False
+        # Tablas sin snapshot válido: descartarlas de nuevo no toca el archivo
+        self._discarded: Set[str] = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        if not self._ready:
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    def available(self, table: str) -> bool:
+        """Si puede haber un snapshot de la tabla (sin abrir el archivo)"""
+        return table not in self._discarded and self.path.exists()
+
+    def load(self, table: str, marker: tuple) -> Optional[Tuple[CompactKeyIndex, float]]:
+        """Índice guardado y momento de su último scan completo; None si no coincide con la marca"""
+        if not self.path.exists():
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT MARKER, SCANNED_AT FROM SNAPSHOT_META WHERE TABLE_NAME = ?",
+                               (table,)).fetchone()
+            if not row or row[0] != serialize_marker(marker):
+                return None
+            rows = conn.execute("SELECT KEY, ID, DATA_FP, DATA_HASH, DOC_FP FROM SNAPSHOT_ROWS "
+                                "WHERE TABLE_NAME = ?", (table,))
+            return CompactKeyIndex.from_encoded(rows), row[1]
+        finally:
+            conn.close()
+
+    def save(self, table: str, marker: tuple, scanned_at: float,
+             rows: Iterable[Tuple[bytes, int, Optional[int], Optional[str], Optional[int]]], full: bool):
+        """Escribe las filas (todas si `full`, si no solo las cambiadas) y la marca, en una transacción"""
+        conn = self._connect()
+        try:
+            with conn:
+                if full:
+                    conn.execute("DELETE FROM SNAPSHOT_ROWS WHERE TABLE_NAME = ?", (table,))
+                conn.executemany("INSERT OR REPLACE INTO SNAPSHOT_ROWS "
+                                 "(TABLE_NAME, KEY, ID, DATA_FP, DATA_HASH, DOC_FP) VALUES (?, ?, ?, ?, ?, ?)",
+                                 ((table,) + tuple(row) for row in rows))
+                conn.execute("INSERT OR REPLACE INTO SNAPSHOT_META (TABLE_NAME, MARKER, SCANNED_AT, SAVED_AT) "
+                             "VALUES (?, ?, ?, ?)", (table, serialize_marker(marker), scanned_at, time.time()))
+        finally:
+            conn.close()
+        self._discarded.discard(table)
+
+    def discard(self, table: str):
+        """Invalida el snapshot de la tabla (las filas se reemplazan en el próximo volcado completo)"""
+        if table in self._discarded:
+            return
+        if self.path.exists():
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM SNAPSHOT_META WHERE TABLE_NAME = ?", (table,))
+            finally:
+                conn.close()
+        self._discarded.add(table)
@@ -91,11 +91,9 @@ class UserService:
     
     def get_all_users(self, skip: int = 0, limit: int = 100) -> List[User]:
         with db.get_connection() as conn:
-            cursor = conn.cursor()
-            # Usar sintaxis de Firebird para paginación
-            query = f"SELECT FIRST {limit} SKIP {skip} ID, USERNAME, EMAIL, HASHED_PASSWORD, IS_ACTIVE, CREATED_AT, UPDATED_AT, ROLE FROM USERS ORDER BY ID"
-            cursor.execute(query)
-            results = cursor.fetchall()
+            # Usar sintaxis de Firebird para paginación (valores como parámetros: misma sentencia preparada)
+            query = "SELECT FIRST (?) SKIP (?) ID, USERNAME, EMAIL, HASHED_PASSWORD, IS_ACTIVE, CREATED_AT, UPDATED_AT, ROLE FROM USERS ORDER BY ID"
+            results = conn.execute_cached(query, (limit, skip)).fetchall()
             
             users = []
             for row in results:
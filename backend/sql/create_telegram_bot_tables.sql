@@ -128,6 +128,10 @@ SET TERM ; ^
 CREATE INDEX IDX_TELEGRAM_USERS_TG_ID ON STL_TELEGRAM_USERS(TELEGRAM_ID);
 CREATE INDEX IDX_TELEGRAM_QUEUE_STATUS ON STL_TELEGRAM_QUEUE(STATUS);
 CREATE INDEX IDX_TELEGRAM_QUEUE_CREATED ON STL_TELEGRAM_QUEUE(CREATED_AT);
+-- Cola pendiente: WHERE STATUS = 'PENDING' ORDER BY PRIORITY DESC, CREATED_AT
+-- (Firebird no mezcla direcciones en un índice: se filtra por el índice y se ordena
+-- solo el conjunto pendiente). En bases con las tablas ya creadas ejecutarlo a mano.
+CREATE INDEX IDX_TELEGRAM_QUEUE_PENDING ON STL_TELEGRAM_QUEUE(STATUS, PRIORITY, CREATED_AT);
 CREATE INDEX IDX_TELEGRAM_COMMANDS_USER ON STL_TELEGRAM_COMMANDS(TELEGRAM_USER_ID);
 CREATE INDEX IDX_TELEGRAM_COMMANDS_CREATED ON STL_TELEGRAM_COMMANDS(CREATED_AT);
 
@@ -0,0 +1,19 @@
+-- Índices compuestos y descendentes para los accesos calientes
+-- (aplicado por app.core.migrations; versión registrada en STL_SCHEMA_VERSION)
+
+-- Clave natural de despachos y recepciones (búsquedas por documento completo)
+CREATE INDEX IDX_STL_DISPATCH_NATURAL_KEY ON STL_DISPATCHES(NUMERO_BUSQUEDA, TIPO_DESPACHO, NUMERO_DESPACHO);
+CREATE INDEX IDX_STL_RECEIPT_NATURAL_KEY ON STL_GOODS_RECEIPTS(NUMERO_BUSQUEDA, TIPO_RECEPCION, NUMERO_DOCUMENTO);
+
+-- Líneas por cabecera y número de línea (reconciliación de líneas en la sincronización)
+CREATE INDEX IDX_STL_DISPATCH_LINES_KEY ON STL_DISPATCH_LINES(DISPATCH_ID, LINE_NUM);
+CREATE INDEX IDX_STL_RECEIPT_LINES_KEY ON STL_GOODS_RECEIPT_LINES(RECEIPT_ID, LINE_NUM);
+
+-- Listados paginados por cursor: ORDER BY <fecha> DESC, ID DESC sin ordenar en memoria
+CREATE DESCENDING INDEX IDX_STL_DISPATCH_PICKING_DESC ON STL_DISPATCHES(FECHA_PICKING, ID);
+CREATE DESCENDING INDEX IDX_STL_RECEIPT_FECHA_DESC ON STL_GOODS_RECEIPTS(FECHA, ID);
+CREATE INDEX IDX_STL_ITEMS_DESCRIPCION ON STL_ITEMS(DESCRIPCION_PRODUCTO, ID);
+
+-- El índice de la cola de Telegram (tabla opcional) está en create_telegram_bot_tables.sql
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Huellas compactas de 64 bits (app.core.fingerprint) en lugar de MD5 hexadecimal
+-- DATA_FP reemplaza a DATA_HASH: las filas existentes se migran de forma perezosa en la
+-- siguiente sincronización (se comparan con DATA_HASH y, si no cambiaron, solo se
+-- escribe DATA_FP y DATA_HASH queda en NULL).
+
+ALTER TABLE STL_ITEMS ADD DATA_FP BIGINT;
+ALTER TABLE STL_DISPATCHES ADD DATA_FP BIGINT;
+ALTER TABLE STL_GOODS_RECEIPTS ADD DATA_FP BIGINT;
+ALTER TABLE STL_DISPATCH_LINES ADD DATA_FP BIGINT;
+ALTER TABLE STL_GOODS_RECEIPT_LINES ADD DATA_FP BIGINT;
+
+-- Huella agregada del documento (cabecera + líneas).
+-- Los documentos sin DOC_FP pasan una vez por el diff de líneas y quedan con la huella.
+ALTER TABLE STL_DISPATCHES ADD DOC_FP BIGINT;
+ALTER TABLE STL_GOODS_RECEIPTS ADD DOC_FP BIGINT;
+
+COMMIT;
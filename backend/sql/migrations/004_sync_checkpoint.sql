@@ -0,0 +1,14 @@
+-- Checkpoints de sincronización: progreso confirmado de la corrida en curso por entidad
+-- (app.services.sync_checkpoint). Se escribe en la misma transacción de cada bloque y se
+-- elimina al terminar la corrida; si queda una fila, la siguiente corrida reanuda desde ahí.
+
+CREATE TABLE STL_SYNC_CHECKPOINT (
+    ENTITY_TYPE VARCHAR(50) NOT NULL PRIMARY KEY,
+    SCOPE VARCHAR(1000) NOT NULL,
+    CHUNK_INDEX INTEGER DEFAULT 0 NOT NULL,
+    RECORDS_APPLIED INTEGER DEFAULT 0 NOT NULL,
+    LAST_KEY VARCHAR(500),
+    UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Ledger de reintentos del envío a SAP (app.services.outbound_retry): una fila por
+-- documento (pedido o recepción) cuyo último envío falló. NEXT_ATTEMPT_AT aplica el
+-- backoff exponencial; STATUS = 'DEAD' retira el documento hasta que se reinicie a mano.
+-- Las vistas de pendientes lo consultan por la clave primaria (DOC_TYPE, DOC_ID).
+
+CREATE TABLE STL_OUTBOUND_RETRY (
+    DOC_TYPE VARCHAR(20) NOT NULL,
+    DOC_ID INTEGER NOT NULL,
+    ATTEMPTS INTEGER DEFAULT 0 NOT NULL,
+    STATUS VARCHAR(10) DEFAULT 'RETRY' NOT NULL,
+    LAST_ERROR_CLASS VARCHAR(20),
+    LAST_CODE INTEGER,
+    LAST_MESSAGE VARCHAR(200),
+    FIRST_FAILED_AT TIMESTAMP,
+    LAST_ATTEMPT_AT TIMESTAMP,
+    NEXT_ATTEMPT_AT TIMESTAMP,
+    CONSTRAINT PK_STL_OUTBOUND_RETRY PRIMARY KEY (DOC_TYPE, DOC_ID)
+);
+
+CREATE INDEX IDX_OUTBOUND_RETRY_STATUS ON STL_OUTBOUND_RETRY (DOC_TYPE, STATUS);
+
+COMMIT;
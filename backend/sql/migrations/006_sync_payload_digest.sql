@@ -0,0 +1,13 @@
+-- Digest (SHA-256) del cuerpo de la última respuesta aplicada por endpoint y filtros
+-- (app.services.payload_digest). Si la siguiente respuesta es idéntica, la corrida se
+-- omite sin construir modelos ni escribir en la base.
+
+CREATE TABLE STL_SYNC_PAYLOAD_DIGEST (
+    DIGEST_KEY VARCHAR(500) NOT NULL PRIMARY KEY,
+    ENTITY_TYPE VARCHAR(50) NOT NULL,
+    DIGEST CHAR(64) NOT NULL,
+    BODY_BYTES BIGINT,
+    UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMIT;
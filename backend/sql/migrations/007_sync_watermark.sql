@@ -0,0 +1,13 @@
+-- Marca de agua (watermark) por entidad para la sincronización incremental
+-- (app.services.sync_delta; sin estas columnas cada corrida es una pasada completa)
+
+-- Tipo de marca: 'DATE' (fecha ISO) o 'NUMBER' (numeroBusqueda más alto)
+ALTER TABLE STL_SYNC_CONFIG ADD WATERMARK_KIND VARCHAR(10);
+
+-- Valor de la marca serializado como texto
+ALTER TABLE STL_SYNC_CONFIG ADD WATERMARK_VALUE VARCHAR(50);
+
+-- Última pasada completa de reconciliación (sin filtro)
+ALTER TABLE STL_SYNC_CONFIG ADD LAST_FULL_SYNC_AT TIMESTAMP;
+
+COMMIT;
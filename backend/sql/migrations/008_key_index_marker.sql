@@ -0,0 +1,41 @@
+-- Marca del índice de claves de sincronización (EntitySyncPipeline.key_index_marker)
+-- sin recorrer la tabla: MAX(UPDATED_AT) sale de un índice descendente y las bajas se
+-- cuentan con un generador que incrementa un trigger, en lugar de COUNT(*).
+
+CREATE DESCENDING INDEX IDX_STL_ITEMS_UPDATED_DESC ON STL_ITEMS(UPDATED_AT);
+CREATE DESCENDING INDEX IDX_STL_DISPATCH_UPDATED_DESC ON STL_DISPATCHES(UPDATED_AT);
+CREATE DESCENDING INDEX IDX_STL_RECEIPT_UPDATED_DESC ON STL_GOODS_RECEIPTS(UPDATED_AT);
+
+CREATE GENERATOR GEN_STL_ITEMS_DELETES;
+CREATE GENERATOR GEN_STL_DISPATCHES_DELETES;
+CREATE GENERATOR GEN_STL_GOODS_RECEIPTS_DELETES;
+
+SET TERM ^ ;
+
+CREATE TRIGGER AD_STL_ITEMS_DELETES FOR STL_ITEMS
+ACTIVE AFTER DELETE POSITION 0
+AS
+DECLARE VARIABLE DELETES BIGINT;
+BEGIN
+    DELETES = GEN_ID(GEN_STL_ITEMS_DELETES, 1);
+END^
+
+CREATE TRIGGER AD_STL_DISPATCHES_DELETES FOR STL_DISPATCHES
+ACTIVE AFTER DELETE POSITION 0
+AS
+DECLARE VARIABLE DELETES BIGINT;
+BEGIN
+    DELETES = GEN_ID(GEN_STL_DISPATCHES_DELETES, 1);
+END^
+
+CREATE TRIGGER AD_STL_GOODS_RECEIPTS_DELETES FOR STL_GOODS_RECEIPTS
+ACTIVE AFTER DELETE POSITION 0
+AS
+DECLARE VARIABLE DELETES BIGINT;
+BEGIN
+    DELETES = GEN_ID(GEN_STL_GOODS_RECEIPTS_DELETES, 1);
+END^
+
+SET TERM ; ^
+
+COMMIT;
@@ -66,7 +66,7 @@ export default function ProductosPage() {
     try {
       const [userResponse, productsResponse] = await Promise.all([
         api.get<User>('/auth/me'),
-        api.get<{items: Product[], total: number}>(`/items/?skip=${(pagination.page - 1) * pagination.limit}&limit=${pagination.limit}`)
+        api.get<{items: Product[], total: number}>(`/items/?skip=${(pagination.page - 1) * pagination.limit}&limit=${pagination.limit}&include_total=true`)
       ])
       
       setCurrentUser(userResponse.data)
@@ -107,6 +107,7 @@ export default function ProductosPage() {
       if (filters.codigo_familia) params.append('codigo_familia', filters.codigo_familia)
       params.append('skip', '0')
       params.append('limit', pagination.limit.toString())
+      params.append('include_total', 'true')
       
       const response = await api.get<{items: Product[], total: number}>(`/items/?${params.toString()}`)
       setProducts(response.data.items)